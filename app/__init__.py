@@ -1,12 +1,10 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from config import Config
 from markupsafe import escape
 
 
 db = SQLAlchemy()
-migrate = Migrate()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
@@ -14,7 +12,28 @@ def create_app(config_class=Config):
     
     # Инициализация расширений
     db.init_app(app)
-    migrate.init_app(app, db)
+
+    # Flask-Migrate тянет alembic (~150 мс импорта), а нужен только командам
+    # `flask db`; рабочие процессы сервера запускаются с LOAD_MIGRATIONS=0
+    if app.config.get('LOAD_MIGRATIONS', True):
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    # Счётчики SQL-запросов на HTTP-запрос (Server-Timing, бюджет запросов)
+    from app.instrumentation import init_app as init_instrumentation
+    init_instrumentation(app)
+
+    # Метрики Prometheus (/metrics)
+    from app.metrics import init_app as init_metrics
+    init_metrics(app)
+
+    # Сброс кэшей во всех процессах после коммита (LISTEN/NOTIFY)
+    from app.cache_bus import init_app as init_cache_bus
+    init_cache_bus(app)
+
+    # Профилирование запросов по требованию (/_debug/profiles)
+    from app.profiling import init_app as init_profiling
+    init_profiling(app)
     
     # Регистрация пользовательских фильтров Jinja2
     from app.filters import init_app as init_filters
@@ -0,0 +1,198 @@
+# app/asgi.py
+"""
+ASGI-приложение: асинхронные JSON-ленты только для чтения + существующее
+Flask-приложение, смонтированное в корень через WSGI-адаптер.
+
+Медленные геозапросы лент выполняются на asyncpg и не занимают рабочие
+потоки, поэтому одновременные пользователи карты не ждут друг друга.
+Всё остальное (формы, страницы, запись) по-прежнему обслуживает Flask.
+Здесь же SSE-поток живых обновлений карт (app.live): тысячи открытых
+соединений держит цикл событий, а не потоки рабочих процессов.
+
+Запуск: uvicorn asgi:app --workers 4
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import create_app
+from app.async_db import create_engine_from_config, create_sessionmaker
+from app.cache_bus import listen, start_listener
+from app.live import LiveHub
+from app.metrics import REQUEST_LATENCY, REQUESTS_TOTAL, start_flusher
+from app.services.battle_service import BattleService, parse_window_args
+from app.services.feed_service import FeedService
+from app.services.change_service import CHANGE_CHANNEL, ChangeService
+from app.services.live_service import LIVE_TABLES
+from app.services.movement_service import MovementService, parse_nearby_args
+from config import Config
+
+
+async def _fetch_all(request, stmt):
+    async with request.app.state.sessionmaker() as session:
+        return (await session.execute(stmt)).all()
+
+
+async def battles_window(request):
+    window = parse_window_args(request.query_params)
+    data = BattleService.pack_window(await _fetch_all(request, BattleService.window_statement(**window)))
+    if request.query_params.get('histogram'):
+        histogram = BattleService.cached_histogram(request.app.state.config.get('BATTLE_HISTOGRAM_TTL', 300))
+        if histogram is None:
+            rows = await _fetch_all(request, BattleService.histogram_statement())
+            histogram = BattleService.store_histogram(BattleService.pack_histogram(rows))
+        data['histogram'] = histogram
+    return data
+
+
+async def events_feed(request):
+    window = parse_window_args(request.query_params)
+    stmt = FeedService.events_statement(window['date_from'], window['date_to'])
+    return FeedService.pack_events(await _fetch_all(request, stmt))
+
+
+async def movements_feed(request):
+    window = parse_window_args(request.query_params)
+    unit_id = request.query_params.get('unit_id')
+    if unit_id and not unit_id.isdigit():
+        raise ValueError('unit_id должен быть числом')
+    stmt = FeedService.movements_statement(int(unit_id) if unit_id else None, window['date_from'], window['date_to'])
+    return FeedService.pack_movements(await _fetch_all(request, stmt))
+
+
+async def movements_nearby(request):
+    query = parse_nearby_args(request.query_params)
+    rows = await _fetch_all(request, MovementService.nearby_statement(**query))
+    return {'place_id': query['place_id'], 'radius_km': query['radius_km'],
+            'units': MovementService.pack_nearby(rows)}
+
+
+async def unit_oob(request):
+    try:
+        on_date = datetime.strptime(request.query_params.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('Параметр date ожидается в формате ГГГГ-ММ-ДД')
+    rows = await _fetch_all(request, FeedService.oob_statement(request.path_params['unit_id'], on_date))
+    tree = FeedService.pack_oob(rows)
+    if tree is None:
+        return JSONResponse({'error': 'Подразделение не найдено'}, status_code=404)
+    return tree
+
+
+async def live_stream(request):
+    """
+    SSE: события changes (маркеры сражений и событий для замены на месте)
+    и reset (перечитать данные). Комментарий-пинг раз в LIVE_HEARTBEAT
+    секунд не даёт прокси закрыть простаивающее соединение.
+    """
+    hub = request.app.state.live_hub
+    heartbeat = request.app.state.config.get('LIVE_HEARTBEAT', 15)
+    queue = hub.subscribe()
+
+    async def events():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+        finally:
+            hub.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _json_endpoint(name, handler, metrics_enabled):
+    """Обёртка: JSON-ответ, ValueError -> 400, учёт в общих метриках Prometheus"""
+    endpoint_label = f'async.{name}'
+
+    async def endpoint(request):
+        started = time.perf_counter()
+        status = 500
+        try:
+            try:
+                result = await handler(request)
+                response = result if isinstance(result, Response) else JSONResponse(result)
+            except ValueError as e:
+                response = JSONResponse({'error': str(e)}, status_code=400)
+            status = response.status_code
+            return response
+        finally:
+            if metrics_enabled:
+                REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint_label, request.method)
+                REQUESTS_TOTAL.inc(endpoint_label, request.method, str(status))
+
+    return endpoint
+
+
+def _check_live_triggers(flask_app):
+    """Без триггеров журнала уведомлений нет и карты молча не обновляются"""
+    try:
+        with flask_app.app_context():
+            missing = ChangeService.missing_triggers(LIVE_TABLES)
+    except Exception as e:
+        flask_app.logger.warning(f"Живые обновления: триггеры журнала не проверены ({e})")
+        return
+    if missing:
+        flask_app.logger.warning(
+            f"Живые обновления: нет триггеров журнала на {', '.join(missing)}; "
+            f"выполните `flask changes install-triggers`"
+        )
+
+
+def create_asgi_app(config_class=Config):
+    """Асинхронные ленты под ASYNC_API_PREFIX, остальные пути — Flask"""
+    flask_app = create_app(config_class)
+    config = flask_app.config
+    prefix = config.get('ASYNC_API_PREFIX', '/async').rstrip('/')
+    metrics_enabled = config.get('METRICS_ENABLED', True)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        engine = create_engine_from_config(config)
+        app.state.config = config
+        app.state.sessionmaker = create_sessionmaker(engine)
+        app.state.live_hub = LiveHub(app.state.sessionmaker, flask_app.logger,
+                                     debounce=config.get('LIVE_DEBOUNCE', 0.5),
+                                     queue_size=config.get('LIVE_CLIENT_QUEUE', 100))
+        if config.get('LIVE_UPDATES_ENABLED', True):
+            _check_live_triggers(flask_app)
+            app.state.live_hub.start()
+            listen(CHANGE_CHANNEL, app.state.live_hub.notify_threadsafe, app.state.live_hub.reset_threadsafe)
+        # Кэши процесса (гистограмма лент) сбрасываются по сообщениям других процессов;
+        # то же соединение слушает журнал изменений для живых обновлений карт
+        start_listener(flask_app)
+        # Снимки метрик процесса для сводки по всем процессам uvicorn
+        start_flusher(flask_app)
+        try:
+            yield
+        finally:
+            await app.state.live_hub.stop()
+            await engine.dispose()
+
+    feeds = [
+        ('battles_window', '/battles/window', battles_window),
+        ('events', '/events', events_feed),
+        ('movements', '/movements', movements_feed),
+        ('movements_nearby', '/movements/nearby', movements_nearby),
+        ('unit_oob', '/units/{unit_id:int}/oob', unit_oob),
+    ]
+    routes = [
+        Route(f'{prefix}{path}', _json_endpoint(name, handler, metrics_enabled), methods=['GET'], name=name)
+        for name, path, handler in feeds
+    ]
+    if config.get('LIVE_UPDATES_ENABLED', True):
+        routes.append(Route(f'{prefix}/live', live_stream, methods=['GET'], name='live'))
+        # Страницы Flask подключают поток, только если его обслуживает это приложение
+        config['LIVE_STREAM_SERVED'] = True
+    routes.append(Mount('/', app=WSGIMiddleware(flask_app)))
+
+    return Starlette(routes=routes, lifespan=lifespan)
@@ -0,0 +1,28 @@
+# app/async_db.py
+"""
+Асинхронный движок SQLAlchemy (asyncpg) для API только для чтения.
+Модели общие с Flask-SQLAlchemy: запросы строятся через select() по тем же
+классам, меняется только способ выполнения.
+"""
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+
+def create_engine_from_config(config):
+    """Движок с теми же настройками пула и statement_timeout, что и у синхронного"""
+    connect_args = {}
+    if config.get('DB_STATEMENT_TIMEOUT'):
+        connect_args['server_settings'] = {'statement_timeout': str(config['DB_STATEMENT_TIMEOUT'])}
+
+    return create_async_engine(
+        config['ASYNC_DATABASE_URI'],
+        pool_size=config.get('DB_POOL_SIZE', 10),
+        max_overflow=config.get('DB_MAX_OVERFLOW', 20),
+        pool_recycle=config.get('DB_POOL_RECYCLE', 1800),
+        pool_timeout=config.get('DB_POOL_TIMEOUT', 30),
+        pool_pre_ping=True,
+        connect_args=connect_args,
+    )
+
+
+def create_sessionmaker(engine):
+    return async_sessionmaker(engine, expire_on_commit=False)
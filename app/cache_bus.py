@@ -0,0 +1,331 @@
+# app/cache_bus.py
+"""
+Шина сброса кэшей между процессами через LISTEN/NOTIFY PostgreSQL.
+
+Кэши в памяти есть в каждом рабочем процессе gunicorn/uvicorn на каждом
+хосте, и запись через форму сбрасывала только кэш обработавшего её процесса.
+Теперь сервисы регистрируют кэши (register) и сбрасывают их через
+invalidate: запись удаляется в своём процессе, а ключи уходят в NOTIFY.
+Вместе с ключами публикуются таблицы, изменённые в транзакции через ORM:
+кэши, зависящие от таблицы целиком (tables=...), сбрасываются и тогда,
+когда код записи не вызвал invalidate.
+
+Сообщение отправляется после коммита (after_commit), откат транзакции его
+отменяет; invalidate вне транзакции с изменениями отправляет сразу. В каждом
+процессе фоновый поток держит отдельное соединение с LISTEN и сбрасывает
+указанные записи. Пока поток не подключён, кэши живут не дольше
+CACHE_BUS_FALLBACK_TTL (см. ttl), после переподключения сбрасываются целиком:
+сообщения за время разрыва потеряны.
+
+Соединение слушателя доступно и другим каналам (listen): через него же
+приходят уведомления журнала изменений для живых обновлений карт (app.live).
+
+Проверка на локальном PostgreSQL: `flask cache-bus listen` в одном терминале,
+`flask cache-bus publish unit_rollup 1 2` (или сохранение формы) — в другом.
+"""
+import json
+import os
+import select as select_module
+import socket
+import threading
+import time
+
+import click
+from flask import current_app
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from app import db
+from app.metrics import CACHE_BUS_MESSAGES
+
+# Предел размера сообщения NOTIFY — 8000 байт; длинные списки ключей
+# заменяются сбросом кэша целиком
+MAX_PAYLOAD = 7500
+
+# Ключи session.info: сбросы и таблицы, ожидающие коммита; признак записи в транзакции
+_PENDING = 'cache_bus_pending'
+_TABLES = 'cache_bus_tables'
+_WRITES = 'cache_bus_writes'
+
+# Зарегистрированные кэши: имя -> (функция сброса, таблицы)
+_caches = {}
+
+# Другие каналы на соединении слушателя: канал -> (обработчик, при переподключении)
+_channels = {}
+
+# Поток-слушатель текущего процесса (создаётся после fork)
+_listener = None
+
+
+def register(name, evict, tables=()):
+    """
+    Регистрирует кэш процесса. evict(keys) удаляет записи с ключами keys,
+    evict(None) — все; tables — таблицы, изменение которых сбрасывает кэш целиком.
+    """
+    _caches[name] = (evict, tuple(tables))
+
+
+def listen(channel, handler, on_reconnect=None):
+    """
+    Подписывает обработчик на канал NOTIFY через соединение слушателя шины:
+    одно соединение на процесс. handler(payload) и on_reconnect() вызываются
+    в потоке слушателя; регистрировать до start_listener.
+    """
+    _channels[channel] = (handler, on_reconnect)
+
+
+def _origin():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _evict(name, keys):
+    entry = _caches.get(name)
+    if entry is not None:
+        entry[0](keys)
+
+
+def _evict_tables(tables):
+    for name, (evict, depends) in _caches.items():
+        if tables.intersection(depends):
+            evict(None)
+
+
+def evict_all():
+    for evict, _ in _caches.values():
+        evict(None)
+
+
+def invalidate(name, keys=None):
+    """
+    Сбрасывает записи кэша name (keys=None — все) в этом процессе и публикует
+    сброс для остальных. Ключи должны сериализоваться в JSON.
+    """
+    keys = None if keys is None else list(keys)
+    _evict(name, keys)
+
+    session = db.session()
+    pending = session.info.setdefault(_PENDING, {})
+    if keys is None or pending.get(name, []) is None:
+        pending[name] = None
+    else:
+        pending[name] = pending.get(name, []) + keys
+
+    # Без изменений в текущей транзакции ждать нечего: данные уже в базе
+    if not (session.info.get(_WRITES) or session.new or session.dirty or session.deleted):
+        _send(session)
+
+
+def ttl(configured):
+    """
+    Срок жизни записей кэша: заданный, если шина не запущена (один процесс)
+    или слушатель подключён; иначе — не больше CACHE_BUS_FALLBACK_TTL.
+    """
+    if _listener is None or not _listener.bus_enabled or _listener.connected:
+        return configured
+    return min(configured, _listener.fallback_ttl)
+
+
+def _payload(caches, tables):
+    message = {'origin': _origin(), 'caches': caches, 'tables': sorted(tables)}
+    payload = json.dumps(message, separators=(',', ':'))
+    if len(payload) > MAX_PAYLOAD:
+        message['caches'] = {name: None for name in caches}
+        payload = json.dumps(message, separators=(',', ':'))
+    return payload
+
+
+def _send(session):
+    caches = session.info.pop(_PENDING, None) or {}
+    tables = session.info.pop(_TABLES, None) or set()
+    if not (caches or tables):
+        return
+    config = current_app.config
+    if not config.get('CACHE_BUS_ENABLED', True) or db.engine.dialect.name != 'postgresql':
+        return
+    try:
+        with db.engine.connect() as conn:
+            conn.execute(select(func.pg_notify(config.get('CACHE_BUS_CHANNEL', 'cache_invalidation'),
+                                               _payload(caches, tables))))
+            conn.commit()
+        CACHE_BUS_MESSAGES.inc('sent')
+    except Exception as e:
+        # Другие процессы досидят до TTL — запись пользователя важнее
+        current_app.logger.warning(f"Сброс кэшей не опубликован: {e}")
+
+
+def _after_flush(session, flush_context):
+    session.info[_WRITES] = True
+    watched = {table for _, depends in _caches.values() for table in depends}
+    changed = {inspect(obj).mapper.local_table.name for obj in [*session.new, *session.dirty, *session.deleted]}
+    if changed & watched:
+        session.info.setdefault(_TABLES, set()).update(changed & watched)
+
+
+def _after_commit(session):
+    session.info.pop(_WRITES, None)
+    tables = session.info.get(_TABLES)
+    if tables:
+        _evict_tables(tables)
+    if session.info.get(_PENDING) or tables:
+        _send(session)
+
+
+def _after_rollback(session):
+    session.info.pop(_WRITES, None)
+    session.info.pop(_PENDING, None)
+    session.info.pop(_TABLES, None)
+
+
+class _Listener:
+    """Поток LISTEN на отдельном соединении с переподключением"""
+
+    def __init__(self, app):
+        self.app = app
+        self.channel = app.config.get('CACHE_BUS_CHANNEL', 'cache_invalidation')
+        self.bus_enabled = app.config.get('CACHE_BUS_ENABLED', True)
+        self.channels = ([self.channel] if self.bus_enabled else []) + list(_channels)
+        self.fallback_ttl = app.config.get('CACHE_BUS_FALLBACK_TTL', 30)
+        self.reconnect_delay = app.config.get('CACHE_BUS_RECONNECT', 5)
+        self.connected = False
+        self._connected_before = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cache-bus', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _connect(self):
+        with self.app.app_context():
+            engine = db.engine
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        conn = engine.dialect.connect(*cargs, **cparams)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for channel in self.channels:
+                cursor.execute('LISTEN "{}"'.format(channel.replace('"', '""')))
+        return conn
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                if self._connected_before:
+                    # Сообщения за время разрыва потеряны
+                    self._reconnected()
+                self.connected = self._connected_before = True
+                self._listen(conn)
+            except Exception as e:
+                self.app.logger.warning(f"Шина кэшей: соединение потеряно ({e}), "
+                                        f"повтор через {self.reconnect_delay} с")
+            finally:
+                self.connected = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop.wait(self.reconnect_delay)
+
+    def _listen(self, conn):
+        origin = _origin()
+        while not self._stop.is_set():
+            if select_module.select([conn], [], [], self.reconnect_delay) == ([], [], []):
+                # Тишина: проверяем, что соединение живо
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                if notify.channel == self.channel:
+                    self.dispatch(notify.payload, origin)
+                elif notify.channel in _channels:
+                    self._call(_channels[notify.channel][0], notify.payload)
+
+    def _reconnected(self):
+        if self.bus_enabled:
+            evict_all()
+        for _, on_reconnect in _channels.values():
+            if on_reconnect is not None:
+                self._call(on_reconnect)
+
+    def _call(self, func, *args):
+        # Ошибка обработчика не должна рвать соединение остальным каналам
+        try:
+            func(*args)
+        except Exception as e:
+            self.app.logger.warning(f"Шина кэшей: ошибка обработчика {func.__name__}: {e}")
+
+    def dispatch(self, payload, origin):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get('origin') == origin:
+            return
+        CACHE_BUS_MESSAGES.inc('received')
+        _evict_tables(set(message.get('tables') or ()))
+        for name, keys in (message.get('caches') or {}).items():
+            _evict(name, keys)
+
+
+def start_listener(app):
+    """Запускает слушателя в текущем процессе (после fork; повторный вызов заменяет поток)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if not (app.config.get('CACHE_BUS_ENABLED', True) or _channels):
+        return
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            return
+    _listener = _Listener(app)
+    _listener.start()
+
+
+@click.group('cache-bus', help='Шина сброса кэшей (LISTEN/NOTIFY)')
+def cli():
+    pass
+
+
+# flask cache-bus publish unit_rollup 1 2 — сброс ключей во всех процессах
+@cli.command('publish')
+@click.argument('cache')
+@click.argument('keys', nargs=-1, type=int)
+def publish_command(cache, keys):
+    invalidate(cache, keys or None)
+    click.echo(f'Опубликован сброс {cache}: {list(keys) or "все записи"}')
+
+
+# flask cache-bus listen — печать сообщений шины (проверка на локальном PostgreSQL)
+@cli.command('listen')
+def listen_command():
+    listener = _Listener(current_app._get_current_object())
+    conn = listener._connect()
+    click.echo(f'LISTEN {listener.channel}; Ctrl+C — выход')
+    try:
+        while True:
+            if select_module.select([conn], [], [], 5) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                click.echo(f'{time.strftime("%H:%M:%S")} {notify.payload}')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+def init_app(app):
+    """Хуки сессии (публикация после коммита) и команды flask cache-bus"""
+    if not event.contains(Session, 'after_commit', _after_commit):
+        event.listen(Session, 'after_flush', _after_flush)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
+    app.cli.add_command(cli)
@@ -0,0 +1,15 @@
+# app/forms.py
+# Формы WTForms отдельно от моделей: flask_wtf/wtforms загружаются
+# только при первом обращении к форме, а не при импорте app.models
+from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileAllowed, FileRequired
+from wtforms import BooleanField, TextAreaField
+
+
+class DiagramForm(FlaskForm):
+    image = FileField('Схема сражения', validators=[
+        FileRequired(),
+        FileAllowed(['jpg', 'jpeg', 'png', 'gif'], 'Только изображения!')
+    ])
+    description = TextAreaField('Описание схемы')
+    is_main = BooleanField('Основная схема')
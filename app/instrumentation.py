@@ -0,0 +1,96 @@
+# app/instrumentation.py
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class RequestSQLStats:
+    """Счётчики SQL-запросов в рамках одного HTTP-запроса"""
+
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0  # секунды
+
+
+def current_sql_stats():
+    """Статистика текущего запроса или None вне контекста запроса"""
+    if not has_request_context():
+        return None
+    return g.get('sql_stats')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('query_start_time')
+    if not start_times:
+        return
+    started = start_times.pop()
+    elapsed = time.perf_counter() - started
+
+    stats = current_sql_stats()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += elapsed
+
+        # Хронология запросов ведётся только по запросу профилировщика
+        timeline = g.get('sql_timeline')
+        if timeline is not None:
+            timeline.append({
+                'start_ms': round((started - g.request_start_time) * 1000, 3),
+                'duration_ms': round(elapsed * 1000, 3),
+                'statement': statement,
+            })
+
+
+def _handle_error(exception_context):
+    # Упавший запрос не доходит до after_cursor_execute — снимаем отметку времени
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_start_time'):
+        conn.info['query_start_time'].pop()
+
+
+def _start_request():
+    g.sql_stats = RequestSQLStats()
+    g.request_start_time = time.perf_counter()
+
+
+def _finish_request(response):
+    stats = g.get('sql_stats')
+    if stats is None:
+        return response
+
+    total_ms = (time.perf_counter() - g.request_start_time) * 1000
+    db_ms = stats.duration * 1000
+
+    if current_app.config.get('SQL_TIMING_HEADER', True):
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={db_ms:.1f};desc="{stats.count} queries", app;dur={total_ms:.1f}'
+        )
+
+    budget = current_app.config.get('SQL_QUERY_BUDGET')
+    if budget and stats.count > budget:
+        current_app.logger.warning(
+            f"SQL budget exceeded: {request.method} {request.path} "
+            f"(endpoint={request.endpoint}) — {stats.count} queries "
+            f"(budget {budget}), db {db_ms:.1f} ms, total {total_ms:.1f} ms"
+        )
+    return response
+
+
+def init_app(app):
+    """Подключение счётчиков SQL к приложению"""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,108 @@
+# app/live.py
+"""
+Живые обновления карт (SSE) в ASGI-приложении.
+
+Триггер журнала изменений шлёт NOTIFY в канал change_log. В каждом процессе
+его слушает одно соединение шины кэшей (app.cache_bus.listen); уведомления
+передаются в цикл asyncio, копятся LIVE_DEBOUNCE секунд, затем затронутые
+маркеры читаются одним запросом на таблицу, и готовое сообщение раздаётся
+всем подключённым клиентам. Число запросов к БД не зависит от числа клиентов.
+
+Клиент, не успевающий читать (очередь заполнена), и все клиенты после
+разрыва соединения слушателя получают событие reset — перечитать данные.
+"""
+import asyncio
+
+from app.metrics import LIVE_CLIENTS
+from app.services.live_service import LiveService
+
+RESET_MESSAGE = LiveService.format_event('reset')
+
+
+class LiveHub:
+    def __init__(self, sessionmaker, logger, debounce=0.5, queue_size=100):
+        self.sessionmaker = sessionmaker
+        self.logger = logger
+        self.debounce = debounce
+        self.queue_size = queue_size
+        self._clients = set()
+        self._loop = None
+        self._pending = None
+        self._task = None
+
+    def start(self):
+        """Запуск обработки уведомлений; вызывать из работающего цикла (lifespan)"""
+        self._loop = asyncio.get_running_loop()
+        self._pending = asyncio.Queue()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    # Вызываются из потока слушателя шины
+    def notify_threadsafe(self, payload):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._pending.put_nowait, payload)
+
+    def reset_threadsafe(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._broadcast, RESET_MESSAGE)
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._clients.add(queue)
+        LIVE_CLIENTS.inc()
+        return queue
+
+    def unsubscribe(self, queue):
+        if queue in self._clients:
+            self._clients.discard(queue)
+            LIVE_CLIENTS.dec()
+
+    def _broadcast(self, message):
+        for queue in self._clients:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Пропущенные изменения не восстановить — клиент перечитает всё
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESET_MESSAGE)
+
+    async def _run(self):
+        while True:
+            batch = [await self._pending.get()]
+            await asyncio.sleep(self.debounce)
+            while not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+            if not self._clients:
+                continue
+            try:
+                message = await self._load(batch)
+            except Exception as e:
+                self.logger.warning(f"Живые обновления: изменения не прочитаны ({e})")
+                message = RESET_MESSAGE
+            if message:
+                self._broadcast(message)
+
+    async def _load(self, batch):
+        changed = LiveService.collect(batch)
+        if not any(changed.values()):
+            return None
+
+        battle_rows, event_rows = [], []
+        async with self.sessionmaker() as session:
+            if changed['battles'] or changed['places']:
+                stmt = LiveService.battles_statement(changed['battles'], changed['places'])
+                battle_rows = (await session.execute(stmt)).all()
+            if changed['events'] or changed['places']:
+                stmt = LiveService.events_statement(changed['events'], changed['places'])
+                event_rows = (await session.execute(stmt)).all()
+
+        data = LiveService.pack_changes(changed, battle_rows, event_rows)
+        return LiveService.format_event('changes', data) if data else None
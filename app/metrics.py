@@ -0,0 +1,350 @@
+# app/metrics.py
+"""
+Метрики в текстовом формате Prometheus без внешних зависимостей.
+Каждая метрика защищена собственной блокировкой, критические секции —
+несколько арифметических операций, поэтому сбор можно держать включённым.
+
+Значения живут в памяти процесса. При нескольких рабочих процессах
+(gunicorn, uvicorn --workers) задаётся METRICS_MULTIPROC_DIR: каждый процесс
+раз в METRICS_FLUSH_INTERVAL секунд и при выходе пишет снимок в <pid>.json,
+а /metrics суммирует снимки всех процессов. Показания других процессов
+отстают не больше чем на интервал записи; датчики (gauge) учитываются
+только у живых процессов, счётчики завершившихся мастер gunicorn
+переносит в archive.json (mark_process_dead). Без каталога /metrics
+показывает только обработавший запрос процесс.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+
+from flask import g, request, template_rendered, before_render_template
+
+from app.instrumentation import current_sql_stats
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Накопленные счётчики завершившихся процессов в METRICS_MULTIPROC_DIR
+ARCHIVE_FILE = 'archive.json'
+
+# Каталог снимков процессов или None — метрики только этого процесса
+_multiproc_dir = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def items(self):
+        """Копия значений: [(метки, значение)]"""
+        with self._lock:
+            return list(self._values.items())
+
+    @staticmethod
+    def merge(values, labels, value):
+        """Добавляет значение другого процесса к сводке values"""
+        values[labels] = values.get(labels, 0) + value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self, values=None):
+        items = self.items() if values is None else values.items()
+        lines = self.header()
+        lines += [f'{self.name}{_format_labels(self.labelnames, k)} {v}' for k, v in items]
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [счётчики по корзинам..., +Inf], сумма
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def items(self):
+        with self._lock:
+            return [(k, [list(v[0]), v[1]]) for k, v in self._values.items()]
+
+    @staticmethod
+    def merge(values, labels, value):
+        state = values.get(labels)
+        if state is None:
+            values[labels] = [list(value[0]), value[1]]
+        else:
+            state[0] = [a + b for a, b in zip(state[0], value[0])]
+            state[1] += value[1]
+
+    def collect(self, values=None):
+        items = [(k, v[0], v[1]) for k, v in (self.items() if values is None else values.items())]
+        lines = self.header()
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, ("le", le))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """Значения всех метрик процесса в виде, пригодном для JSON"""
+        return {metric.name: [[list(labels), value] for labels, value in metric.items()]
+                for metric in self._metrics}
+
+    def aggregate(self, directory):
+        """Сумма снимков процессов из каталога: имя метрики -> {метки: значение}"""
+        merged = {metric.name: {} for metric in self._metrics}
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            pid = filename[:-len('.json')]
+            alive = pid.isdigit() and _process_alive(int(pid))
+            data = _read_snapshot(os.path.join(directory, filename))
+            for metric in self._metrics:
+                if metric.kind == 'gauge' and not alive:
+                    continue  # датчик завершившегося процесса больше ничего не значит
+                for labels, value in data.get(metric.name, ()):
+                    metric.merge(merged[metric.name], tuple(labels), value)
+        return merged
+
+    def render(self):
+        merged = None
+        if _multiproc_dir:
+            write_snapshot()
+            merged = self.aggregate(_multiproc_dir)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect(None if merged is None else merged[metric.name]))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    'http_request_duration_seconds', 'Время обработки HTTP-запроса', ('endpoint', 'method')))
+REQUESTS_TOTAL = registry.register(Counter(
+    'http_requests_total', 'Число HTTP-запросов', ('endpoint', 'method', 'status')))
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    'http_requests_in_flight', 'HTTP-запросы в обработке', ('endpoint',)))
+SQL_STATEMENTS = registry.register(Counter(
+    'db_statements_total', 'Число SQL-запросов', ('endpoint',)))
+SQL_DURATION = registry.register(Counter(
+    'db_statement_duration_seconds_total', 'Суммарное время SQL-запросов', ('endpoint',)))
+TEMPLATE_RENDER = registry.register(Histogram(
+    'template_render_duration_seconds', 'Время рендеринга шаблонов Jinja2', ('template',)))
+CACHE_REQUESTS = registry.register(Counter(
+    'cache_requests_total', 'Обращения к кэшам (result=hit|miss)', ('cache', 'result')))
+CACHE_BUS_MESSAGES = registry.register(Counter(
+    'cache_bus_messages_total', 'Сообщения шины сброса кэшей (direction=sent|received)', ('direction',)))
+LIVE_CLIENTS = registry.register(Gauge(
+    'live_clients', 'Открытые SSE-подписки на изменения карт'))
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def write_snapshot():
+    """Записывает снимок метрик процесса в METRICS_MULTIPROC_DIR"""
+    if _multiproc_dir:
+        _write_json(os.path.join(_multiproc_dir, f'{os.getpid()}.json'), registry.snapshot())
+
+
+def start_flusher(app):
+    """
+    Периодическая запись снимка метрик процесса; вызывается в каждом рабочем
+    процессе (после fork или в lifespan ASGI). Без METRICS_MULTIPROC_DIR ничего не делает.
+    """
+    if not _multiproc_dir:
+        return
+    interval = app.config.get('METRICS_FLUSH_INTERVAL', 5)
+
+    def flush():
+        try:
+            write_snapshot()
+        except OSError as e:
+            app.logger.warning(f"Снимок метрик не записан: {e}")
+
+    def run():
+        while True:
+            time.sleep(interval)
+            flush()
+
+    threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+    # Последние секунды работы процесса тоже попадут в сводку
+    atexit.register(flush)
+
+
+def mark_process_dead(pid, directory):
+    """
+    Переносит счётчики и гистограммы завершившегося процесса в archive.json
+    и удаляет его снимок. Вызывает только мастер gunicorn (child_exit),
+    поэтому архив пишет один процесс.
+    """
+    path = os.path.join(directory, f'{pid}.json')
+    if not os.path.exists(path):
+        return
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    archive = {metric.name: {} for metric in registry._metrics}
+    for source in (_read_snapshot(archive_path), _read_snapshot(path)):
+        for metric in registry._metrics:
+            if metric.kind == 'gauge':
+                continue
+            for labels, value in source.get(metric.name, ()):
+                metric.merge(archive[metric.name], tuple(labels), value)
+    _write_json(archive_path, {name: [[list(labels), value] for labels, value in values.items()]
+                               for name, values in archive.items()})
+    os.remove(path)
+
+
+def clear_multiproc_dir(directory):
+    """Удаляет снимки прошлого запуска сервера (вызывается до старта процессов)"""
+    os.makedirs(directory, exist_ok=True)
+    for filename in os.listdir(directory):
+        if filename.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(directory, filename))
+
+
+def record_cache(cache_name, hit):
+    """Учёт попадания/промаха кэша; доля попаданий считается в Prometheus"""
+    CACHE_REQUESTS.inc(cache_name, 'hit' if hit else 'miss')
+
+
+def _endpoint_label():
+    return request.endpoint or 'unknown'
+
+
+def _start_request():
+    g.metrics_start_time = time.perf_counter()
+    g.metrics_endpoint = _endpoint_label()
+    REQUESTS_IN_FLIGHT.inc(g.metrics_endpoint)
+
+
+def _remember_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _finish_request(exc):
+    start = g.pop('metrics_start_time', None)
+    if start is None:
+        return
+    endpoint = g.pop('metrics_endpoint')
+    REQUESTS_IN_FLIGHT.dec(endpoint)
+    if endpoint == 'metrics.metrics':
+        return
+
+    status = g.pop('metrics_status', 500)
+    REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint, request.method)
+    REQUESTS_TOTAL.inc(endpoint, request.method, str(status))
+
+    stats = current_sql_stats()
+    if stats is not None and stats.count:
+        SQL_STATEMENTS.inc(endpoint, amount=stats.count)
+        SQL_DURATION.inc(endpoint, amount=stats.duration)
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('metrics_render_starts', []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    starts = g.get('metrics_render_starts')
+    if starts:
+        TEMPLATE_RENDER.observe(time.perf_counter() - starts.pop(), template.name or 'string')
+
+
+def init_app(app):
+    """Подключение сбора метрик к приложению"""
+    global _multiproc_dir
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    _multiproc_dir = app.config.get('METRICS_MULTIPROC_DIR') or None
+    if _multiproc_dir:
+        os.makedirs(_multiproc_dir, exist_ok=True)
+    app.before_request(_start_request)
+    app.after_request(_remember_status)
+    app.teardown_request(_finish_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    from app.routes.metrics import bp as metrics_bp
+    app.register_blueprint(metrics_bp)
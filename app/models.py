@@ -1,12 +1,10 @@
-from flask_wtf import FlaskForm
 from marshmallow import validates
 from sqlalchemy import or_, text
-from wtforms import BooleanField, TextAreaField
 from app import db
 from datetime import datetime
 from geoalchemy2 import Geometry
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import date
-from flask_wtf.file import FileField, FileAllowed, FileRequired
 
 class Country(db.Model):
     __tablename__ = 'countries'
@@ -51,7 +49,9 @@ class Commander(db.Model):
 
     # Внешние ключи
     country_id = db.Column(db.Integer, db.ForeignKey('countries.id'), nullable=False)
-    rank_id = db.Column(db.Integer, db.ForeignKey('commander_ranks.id'))
+    # Денормализованный указатель на последнюю запись истории званий (commander_ranks).
+    # Поддерживается CommanderService.sync_current_rank, вручную не заполняется.
+    rank_id = db.Column(db.Integer, db.ForeignKey('commander_ranks.id', use_alter=True))
     
 
     # Отношения
@@ -68,9 +68,21 @@ class Commander(db.Model):
         cascade='all, delete-orphan'
     )
 
+    current_rank_assignment = db.relationship(
+        'CommanderRank',
+        foreign_keys=[rank_id],
+        post_update=True
+    )
+
     @property
     def current_rank(self):
-        return self.rank_assignments[0].rank if self.rank_assignments else None
+        """Текущее звание через денормализованный указатель rank_id"""
+        if self.current_rank_assignment is not None:
+            return self.current_rank_assignment.rank
+        if self.rank_id is None and 'rank_assignments' in self.__dict__:
+            # Коллекция уже загружена — указатель ещё не синхронизирован
+            return self.rank_assignments[0].rank if self.rank_assignments else None
+        return None
 
     # Командование подразделениями через CommanderAssignment
     military_units = db.relationship(
@@ -80,6 +92,20 @@ class Commander(db.Model):
         cascade='all, delete-orphan'
     )
 
+    # Итоги карьеры для списка командиров, см. CommanderService.sync_stats
+    stats = db.relationship(
+        'CommanderStats',
+        back_populates='commander',
+        uselist=False,
+        cascade='all, delete-orphan',
+        passive_deletes=True
+    )
+
+    __table_args__ = (
+        # Keyset-пагинация списка командиров
+        db.Index('idx_commanders_last_name_id', 'last_name', 'id'),
+    )
+
 class MilitaryUnit(db.Model):
     __tablename__ = 'military_units'
 
@@ -360,6 +386,13 @@ class Battle(db.Model):
         back_populates='battle',
         foreign_keys='SizeParties.battle_id'
     )
+
+    __table_args__ = (
+        # Выборка по временному окну шкалы (/battles/api/window)
+        db.Index('idx_battles_date_place', 'date_begin', 'place_id'),
+        # Хронология (ChronologyService): поток сражений по (дата, id)
+        db.Index('idx_battles_date_id', 'date_begin', 'id'),
+    )
     
 
 def get_next_battle_id():
@@ -385,6 +418,11 @@ class Battleparticipations(db.Model):
     commander = db.relationship('Commander', back_populates='battle_participations')
     #losses = db.relationship('BattleLoss', back_populates='participations')
 
+    __table_args__ = (
+        # Итоги командира (CommanderService.sync_stats) — index-only по командиру
+        db.Index('idx_battle_participations_commander', 'commander_id', 'battle_id'),
+    )
+
 
     
 class Trophy(db.Model):
@@ -415,6 +453,19 @@ class Place(db.Model):
     events = db.relationship('Event', back_populates='place')
     movements_from = db.relationship('UnitMovement', foreign_keys='UnitMovement.start_place_id', back_populates='start_place')
     movements_to = db.relationship('UnitMovement', foreign_keys='UnitMovement.end_place_id', back_populates='end_place')
+
+    __table_args__ = (
+        # Keyset-пагинация списка мест
+        db.Index('idx_places_name_id', 'name', 'id'),
+    )
+
+    @staticmethod
+    def make_geom(latitude, longitude):
+        """Точка для колонки geom по координатам формы; None, если координата не задана"""
+        if latitude is None or longitude is None:
+            return None
+        return db.func.ST_SetSRID(db.func.ST_MakePoint(longitude, latitude), 4326)
+
     @property
     def latitude(self):
         """Получить широту из геометрии"""
@@ -435,8 +486,10 @@ class UnitMovement(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
-    distance_km = db.Column(db.Float)
+    distance_km = db.Column(db.Float)  # вычисляется по route (MovementService.update_routes)
     route_description = db.Column(db.Text)
+    # Линия маршрута от start_place до end_place; GiST-индекс создаёт geoalchemy2
+    route = db.Column(Geometry(geometry_type='LINESTRING', srid=4326, spatial_index=True))
     
     # Внешние ключи
     unit_id = db.Column(db.Integer, db.ForeignKey('military_units.id'), nullable=False)
@@ -448,6 +501,17 @@ class UnitMovement(db.Model):
     start_place = db.relationship('Place', foreign_keys=[start_place_id], back_populates='movements_from')
     end_place = db.relationship('Place', foreign_keys=[end_place_id], back_populates='movements_to')
 
+    __table_args__ = (
+        # Keyset-пагинация списка перемещений (обратный проход по индексу)
+        db.Index('idx_unit_movements_date_id', 'date', 'id'),
+        # Положение подразделения на дату: последнее перемещение до даты
+        db.Index('idx_unit_movements_unit_date', 'unit_id', 'date'),
+        # Кто стоял в месте к дате (MovementService.nearby_statement)
+        db.Index('idx_unit_movements_end_place_date', 'end_place_id', 'date'),
+        # ST_DWithin по geography(route) в метрах без перебора строк
+        db.Index('idx_unit_movements_route_geog', db.text('geography(route)'), postgresql_using='gist'),
+    )
+
 class CommanderRank(db.Model):
     __tablename__ = 'commander_ranks'
     
@@ -460,7 +524,43 @@ class CommanderRank(db.Model):
     commander = db.relationship('Commander', back_populates='rank_assignments', foreign_keys=[commander_id])
     rank = db.relationship('MilitaryRank', back_populates='assignments', foreign_keys=[rank_id])
 
-    __table_args__ = (db.UniqueConstraint('commander_id', 'rank_id', 'date_promoted', name='uq_commander_rank_date'),)
+    __table_args__ = (
+        db.UniqueConstraint('commander_id', 'rank_id', 'date_promoted', name='uq_commander_rank_date'),
+        # Для DISTINCT ON (commander_id) ... ORDER BY date_promoted DESC
+        db.Index('idx_commander_ranks_latest', 'commander_id', db.text('date_promoted DESC')),
+        # Хронология (ChronologyService): поток повышений по (дата, id)
+        db.Index('idx_commander_ranks_date_id', 'date_promoted', 'id'),
+    )
+
+class CommanderStats(db.Model):
+    """
+    Итоги карьеры командира для сортировки и фильтрации списка.
+    Поддерживается CommanderService.sync_stats, вручную не заполняется.
+    """
+    __tablename__ = 'commander_stats'
+
+    commander_id = db.Column(db.Integer, db.ForeignKey('commanders.id', ondelete='CASCADE'), primary_key=True)
+    battles_count = db.Column(db.Integer, nullable=False, default=0)
+    first_battle = db.Column(db.Date)
+    last_battle = db.Column(db.Date)
+    # Высшее звание за карьеру; уровень продублирован для сортировки (0 — званий нет)
+    top_rank_id = db.Column(db.Integer, db.ForeignKey('military_ranks.id', ondelete='SET NULL'))
+    top_rank_level = db.Column(db.Integer, nullable=False, default=0)
+    # Незакрытое назначение, а если его нет — последнее по дате начала
+    current_unit_id = db.Column(db.Integer, db.ForeignKey('military_units.id', ondelete='SET NULL'))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    commander = db.relationship('Commander', back_populates='stats')
+    top_rank = db.relationship('MilitaryRank')
+    current_unit = db.relationship('MilitaryUnit')
+
+    __table_args__ = (
+        # Keyset-пагинация по каждой сортируемой колонке
+        db.Index('idx_commander_stats_battles', 'battles_count', 'commander_id'),
+        db.Index('idx_commander_stats_first_battle', 'first_battle', 'commander_id'),
+        db.Index('idx_commander_stats_last_battle', 'last_battle', 'commander_id'),
+        db.Index('idx_commander_stats_rank', 'top_rank_level', 'commander_id'),
+    )
 
 class Event(db.Model):
     __tablename__ = 'events'
@@ -473,6 +573,11 @@ class Event(db.Model):
 
     place = db.relationship('Place', back_populates='events')
 
+    __table_args__ = (
+        # Хронология (ChronologyService): поток событий по (дата, id)
+        db.Index('idx_events_date_id', 'date', 'id'),
+    )
+
 
 class CommanderAssignment(db.Model):
     __tablename__ = 'commander_assignments'
@@ -496,6 +601,13 @@ class CommanderAssignment(db.Model):
         foreign_keys=[commander_id]
     )
 
+    __table_args__ = (
+        # Назначения командира по дате: цепочки командования и итоги карьеры
+        db.Index('idx_commander_assignments_commander_start', 'commander_id', 'Com_start'),
+        # Хронология (ChronologyService): поток назначений по (дата, id)
+        db.Index('idx_commander_assignments_start_id', 'Com_start', 'id'),
+    )
+
 class ConnectionType(db.Model):
     __tablename__ = 'connection_type'
     
@@ -549,16 +661,45 @@ class BattleDiagram(db.Model):
     is_main = db.Column(db.Boolean, default=False)
     image_path = db.Column(db.String(255))
     #created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Метаданные изображения (заполняются DiagramService при загрузке)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    size_bytes = db.Column(db.Integer)
+    content_hash = db.Column(db.String(64), index=True)  # sha256, для дедупликации файлов
+    variants_status = db.Column(db.String(20), default='pending')  # pending | ready | failed
+    tiles_status = db.Column(db.String(20))  # None — тайлы не нужны | pending | ready | failed
     
     # Связь
     battle = db.relationship('Battle', backref=db.backref('diagrams', lazy=True))
 
-from flask_wtf.file import FileField, FileAllowed, FileRequired
+class ChangeLog(db.Model):
+    """
+    Журнал изменений для дельта-синхронизации клиентов (/api/changes).
+    Заполняется триггерами (ChangeService.install_triggers), вручную не пишется.
+    """
+    __tablename__ = 'change_log'
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(1), nullable=False)  # U — вставка или изменение, D — удаление
+    # Транзакция записи (xid8 числом): курсор клиента идёт по (xid, id)
+    xid = db.Column(db.BigInteger, nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+    __table_args__ = (
+        db.Index('idx_change_log_xid_id', 'xid', 'id'),
+        # Сжатие журнала: поиск более поздних записей той же строки
+        db.Index('idx_change_log_row', 'table_name', 'row_id'),
+    )
+
+class BattleDraft(db.Model):
+    """Черновик мастера добавления сражения (вместо данных в cookie-сессии)"""
+    __tablename__ = 'battle_drafts'
 
-class DiagramForm(FlaskForm):
-    image = FileField('Схема сражения', validators=[
-        FileRequired(),
-        FileAllowed(['jpg', 'jpeg', 'png', 'gif'], 'Только изображения!')
-    ])
-    description = TextAreaField('Описание схемы')
-    is_main = BooleanField('Основная схема')
\ No newline at end of file
+    id = db.Column(db.String(32), primary_key=True)  # uuid4().hex
+    # Разделы мастера: battle, participations, losses, trophies
+    data = db.Column(JSONB, nullable=False, default=dict)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
@@ -0,0 +1,135 @@
+# app/pagination.py
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import text, tuple_
+
+from app import db
+
+
+class KeysetPage:
+    """Страница keyset-пагинации: без OFFSET и без COUNT(*)"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total  # оценка, а не точное значение
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(values):
+    """Кодирует значения ключа сортировки в строку для URL"""
+    raw = json.dumps([v.isoformat() if isinstance(v, (date, datetime)) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Обратное преобразование курсора; None, если курсор битый"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        return [_restore_value(col, v) for col, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        return None
+
+
+def _restore_value(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is date:
+        return date.fromisoformat(value)
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    return python_type(value)
+
+
+def keyset_paginate(query, columns, after=None, before=None, per_page=20, descending=False, row_values=None):
+    """
+    Seek-пагинация по уникальному ключу сортировки (например, (last_name, id)).
+    Все колонки сортируются в одном направлении, поэтому сравнение делается
+    одним row-value выражением и использует составной btree-индекс.
+    row_values(row) -> значения ключа для курсора, если колонки ключа не
+    атрибуты строки (например, принадлежат присоединённой таблице).
+    """
+    after_values = decode_cursor(after, columns)
+    before_values = decode_cursor(before, columns) if after_values is None else None
+    key = tuple_(*columns)
+
+    backwards = before_values is not None
+    if backwards:
+        query = query.filter(key > tuple_(*before_values) if descending else key < tuple_(*before_values))
+    elif after_values is not None:
+        query = query.filter(key < tuple_(*after_values) if descending else key > tuple_(*after_values))
+
+    # При движении назад сортируем в обратную сторону и потом переворачиваем
+    reverse_order = descending != backwards
+    query = query.order_by(None).order_by(*[c.desc() if reverse_order else c.asc() for c in columns])
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def cursor_for(row):
+        if row_values is not None:
+            return encode_cursor(row_values(row))
+        return encode_cursor([getattr(row, c.key) for c in columns])
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = cursor_for(rows[-1])
+        if (has_more and backwards) or (after_values is not None):
+            prev_cursor = cursor_for(rows[0])
+
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor)
+
+
+def estimated_count(query=None, table_name=None):
+    """
+    Оценка числа строк без COUNT(*).
+    Для всей таблицы берётся pg_class.reltuples, для запроса с фильтрами —
+    оценка планировщика из EXPLAIN. Запрос выполняется на отдельном
+    соединении: ошибка оценки не откатывает сессию запроса и не сбрасывает
+    уже загруженные строки страницы.
+    """
+    try:
+        with db.engine.connect() as conn:
+            if table_name is not None:
+                estimate = conn.execute(
+                    text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table_name)"),
+                    {'table_name': table_name}
+                ).scalar()
+            else:
+                # Параметры передаются драйверу отдельно: значения из формы
+                # (например, ':слово' в поиске) не попадают в текст SQL
+                compiled = query.statement.compile(dialect=conn.dialect,
+                                                   compile_kwargs={'render_postcompile': True})
+                plan = conn.exec_driver_sql(
+                    f"EXPLAIN (FORMAT JSON) {compiled.string}", compiled.params
+                ).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = plan[0]['Plan']['Plan Rows']
+    except Exception:
+        return None
+    # reltuples = -1 для таблиц, по которым ещё не было ANALYZE
+    if estimate is None or estimate < 0:
+        return None
+    return int(estimate)
@@ -0,0 +1,136 @@
+# app/profiling.py
+"""
+Профилирование отдельных запросов по требованию.
+
+Запрос профилируется, если передан заголовок ``X-Profile: <PROFILING_TOKEN>``
+или параметр ``?_profile=<PROFILING_TOKEN>``. Фоновый поток с заданным
+интервалом снимает стек обрабатывающего потока; результат сохраняется в
+формате collapsed stacks (открывается в speedscope и flamegraph.pl) вместе
+с хронологией SQL-запросов. Просмотр — /_debug/profiles.
+"""
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = '_profile'
+
+
+class StackSampler:
+    """Сэмплирующий профилировщик одного потока на sys._current_frames()"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                stack.append(f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ','))
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Строки формата collapsed stacks: 'a;b;c <число сэмплов>'"""
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common()) + '\n'
+
+
+def request_token():
+    """Токен профилирования из заголовка или параметра запроса"""
+    return request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_PARAM)
+
+
+def is_authorised(token=None):
+    expected = current_app.config.get('PROFILING_TOKEN')
+    token = token if token is not None else request_token()
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(str(token), str(expected))
+
+
+def profiles_dir():
+    return current_app.config.get('PROFILING_DIR') or os.path.join(current_app.instance_path, 'profiles')
+
+
+def _start_profiling():
+    if request.endpoint and request.endpoint.startswith('debug.'):
+        return
+    if not request_token() or not is_authorised():
+        return
+    g.sql_timeline = []
+    g.profiler = StackSampler(threading.get_ident(), current_app.config.get('PROFILING_INTERVAL', 0.005))
+    g.profiler.start()
+    g.profile_started_at = time.perf_counter()
+
+
+def _finish_profiling(response):
+    sampler = g.pop('profiler', None)
+    if sampler is None:
+        return response
+    sampler.stop()
+    duration_ms = (time.perf_counter() - g.pop('profile_started_at')) * 1000
+
+    profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{(request.endpoint or 'unknown').replace('.', '-')}-{uuid.uuid4().hex[:6]}"
+    directory = profiles_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(directory, f'{profile_id}.folded'), 'w', encoding='utf-8') as f:
+        f.write(sampler.collapsed())
+
+    timeline = g.pop('sql_timeline', [])
+    meta = {
+        'id': profile_id,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'method': request.method,
+        'path': request.full_path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(duration_ms, 1),
+        'samples': sum(sampler.samples.values()),
+        'sql_count': len(timeline),
+        'sql_ms': round(sum(q['duration_ms'] for q in timeline), 1),
+        'sql_timeline': timeline,
+    }
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def init_app(app):
+    """Подключение профилирования по требованию (PROFILING_ENABLED)"""
+    if not app.config.get('PROFILING_ENABLED'):
+        return
+    if not app.config.get('PROFILING_TOKEN'):
+        app.logger.warning('PROFILING_ENABLED без PROFILING_TOKEN — профилирование недоступно')
+        return
+    app.before_request(_start_profiling)
+    app.after_request(_finish_profiling)
+
+    from app.routes.debug import bp as debug_bp
+    app.register_blueprint(debug_bp)
@@ -3,10 +3,14 @@ from .units import bp as units_bp
 from .battles import bp as battles_bp
 from .movements import bp as movements_bp
 from .events import events_bp
+from .chronology import bp as chronology_bp
+from .changes import bp as changes_bp
 
 def init_app(app):
     app.register_blueprint(commanders_bp)
     app.register_blueprint(units_bp)
     app.register_blueprint(battles_bp)
     app.register_blueprint(movements_bp)
+    app.register_blueprint(chronology_bp)
+    app.register_blueprint(changes_bp)
     app.register_blueprint(events_bp, url_prefix='/events')
\ No newline at end of file
@@ -1,16 +1,20 @@
-import os
-import uuid
-from flask import Blueprint, current_app, json, render_template, request, jsonify, redirect, url_for, flash, session
-from app.models import Battle, BattleDiagram, Battleparticipations, Country, DiagramForm, MilitaryUnit, Commander, Place, SizeParties, Trophy, BattleLosses, get_next_battle_id
+import re
+import click
+from flask import Blueprint, abort, current_app, render_template, request, jsonify, redirect, send_file, send_from_directory, url_for, flash, session
+from app.models import Battle, BattleDiagram, Battleparticipations, Country, MilitaryUnit, Commander, Place, SizeParties, Trophy, BattleLosses, get_next_battle_id
 from app import db
+from markupsafe import Markup
 from marshmallow import Schema, ValidationError, fields, validate, validates
-from datetime import datetime, time
-from sqlalchemy import and_, asc, func, or_
-from geoalchemy2.functions import ST_AsGeoJSON
-from datetime import datetime, time
-from dateutil import parser
+from sqlalchemy import and_
 from sqlalchemy.orm import joinedload
-from werkzeug.utils import secure_filename
+from app.services.battle_service import BattleService, parse_window_args
+from app.services.diagram_service import DiagramService, diagrams_folder
+from app.services.live_service import live_stream_url
+from app.services.draft_service import BattleDraftService
+from app.services.participation_service import ParticipationService
+from app.services.commander_service import CommanderService
+from app.services.oob_service import OrderOfBattleService
+from app.services.rollup_service import RollupService
 
 bp = Blueprint('battles', __name__, url_prefix='/battles')
 
@@ -45,63 +49,68 @@ class TrophySchema(Schema):
     quantity = fields.Int(validate=validate.Range(min=1), load_default=1)
     captor_id = fields.Int(required=True)
 
-# Список всех сражений
+def _render_list(search_query):
+    # Гистограмма (из кэша) нужна шкале сразу: первый запрос окна уже идёт с датами
+    return render_template('battles/list.html',
+                           search_query=search_query,
+                           histogram=BattleService.get_year_histogram(),
+                           initial_years=current_app.config.get('BATTLE_WINDOW_INITIAL_YEARS', 5),
+                           live_url=live_stream_url())
+
+# Список всех сражений: данные подгружаются через /battles/api/window
 @bp.route('/')
 def list_battles():
-    battles = db.session.query(
-        Battle.id,
-        Battle.name,
-        Battle.date_begin,
-        Battle.date_end,
-        Battle.victory,
-        Place.name.label('place_name'),
-        func.ST_AsGeoJSON(Place.geom).label('geom_json')
-    ).join(Place).order_by(asc(Battle.date_begin).nulls_first())
-    
-    battles_data = []
-    for battle in battles:
-        # Безопасное преобразование даты для исторических дат
-        timestamp = 0
-        date_str = None
-        
-        if battle.date_begin:
-            try:
-                # Преобразуем в строку и обратно для унификации
-                date_str = battle.date_begin.strftime('%Y-%m-%d')
-                dt = parser.parse(date_str)
-                # Альтернативный метод расчета timestamp
-                timestamp = (dt - datetime(1970, 1, 1)).total_seconds()
-            except Exception as e:
-                current_app.logger.error(f"Error processing date for battle {battle.id}: {str(e)}")
-                timestamp = 0
-        
-        battles_data.append({
-            'id': battle.id,
-            'name': battle.name,
-            'date': date_str if date_str else None,
-            'timestamp': int(timestamp),
-            'victory': battle.victory,
-            'place_name': battle.place_name,
-            'geom': json.loads(battle.geom_json) if battle.geom_json else None
-        })
-    
-    return render_template('battles/list.html', battles=battles_data)
+    return _render_list('')
+
+# API: сражения во временном окне для шкалы и карты (колоночный формат)
+@bp.route('/api/window', methods=['GET'])
+def battles_window():
+    try:
+        window = parse_window_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    data = BattleService.get_window(**window)
+    if request.args.get('histogram'):
+        data['histogram'] = BattleService.get_year_histogram()
+    return jsonify(data)
+
+# Многошаговая форма добавления сражения.
+# Данные шагов хранятся в серверном черновике (BattleDraftService),
+# в cookie-сессии остаётся только его идентификатор.
+DRAFT_SESSION_KEY = 'battle_draft_id'
+
+
+def _int_or_none(value):
+    return int(value) if value not in (None, '') else None
+
+
+def _form_indexes(form, prefix, field):
+    """
+    Индексы N строк формы с полем <prefix>-N-<field> по возрастанию. Строки
+    нумеруются на клиенте, после удаления строки индексы идут с пропусками.
+    """
+    pattern = re.compile(rf'^{re.escape(prefix)}-(\d+)-{re.escape(field)}$')
+    return sorted(int(match.group(1)) for match in map(pattern.match, form) if match)
+
+
+def _load_draft(*required):
+    """Данные текущего черновика или None, если нет черновика или нужных разделов"""
+    data = BattleDraftService.get(session.get(DRAFT_SESSION_KEY))
+    if data is None or any(section not in data for section in required):
+        return None
+    return data
+
 
-# Многошаговая форма добавления сражения
 @bp.route('/new', methods=['GET', 'POST'])
 def new_battle():
     if request.method == 'GET':
-        # Очистка сессии
-        session.pop('battle_data', None)
-        session.pop('participations_data', None)
-        session.pop('losses_data', None)
-        session.pop('trophies_data', None)
-
+        draft = _load_draft() or {}
         countries = Country.query.order_by(Country.name).all()
         places = Place.query.order_by(Place.name).all()
 
         return render_template('battles/wizard_step1.html',
-                               battle_data=session.get('battle_data', {}),
+                               battle_data=draft.get('battle', {}),
                                countries=countries,
                                places=places)
 
@@ -122,32 +131,36 @@ def new_battle():
                 # Обработка даты окончания
                 if form_data.get('date_end') == '':
                     form_data['date_end'] = None
+                form_data['place_id'] = _int_or_none(form_data.get('place_id'))
 
                 form_data.pop('id', None)
 
-                session['battle_data'] = form_data
+                draft_id = session.get(DRAFT_SESSION_KEY)
+                if BattleDraftService.get(draft_id) is None:
+                    draft_id = session[DRAFT_SESSION_KEY] = BattleDraftService.create()
+                BattleDraftService.patch(draft_id, battle=form_data)
                 return redirect(url_for('battles.new_battle_step2'))
 
             except Exception as e:
+                db.session.rollback()
                 flash(f'Ошибка: {str(e)}', 'danger')
                 return redirect(url_for('battles.new_battle'))
 
             
 @bp.route('/new/step2', methods=['GET', 'POST'])
 def new_battle_step2():
-    if 'battle_data' not in session:
+    draft = _load_draft('battle')
+    if draft is None:
         return redirect(url_for('battles.new_battle'))
 
     if request.method == 'GET':
-        battle_data = session.get('battle_data', {})
-        participationss = session.get('participationss_data', [])
         countries = Country.query.order_by(Country.name).all()
         units = MilitaryUnit.query.join(Country).order_by(MilitaryUnit.name).all()
         commanders = Commander.query.join(Country).order_by(Commander.last_name, Commander.first_name).all()
 
         return render_template('battles/wizard_step2.html',
-                               battle=battle_data,
-                               participationss=participationss,
+                               battle=draft['battle'],
+                               participationss=draft.get('participations', []),
                                countries=countries,
                                units=units,
                                commanders=commanders)
@@ -157,32 +170,34 @@ def new_battle_step2():
         if step == '2':
             try:
                 participant_list = []
-                i = 0
-                while f'participations-{i}-country_id' in request.form:
+                for i in _form_indexes(request.form, 'participations', 'country_id'):
                     part_data = {
-                        'country_id': request.form[f'participations-{i}-country_id'],
-                        'unit_id': request.form[f'participations-{i}-unit_id'],
-                        'commander_id': request.form.get(f'participations-{i}-commander_id'),
+                        'country_id': _int_or_none(request.form[f'participations-{i}-country_id']),
+                        'unit_id': _int_or_none(request.form.get(f'participations-{i}-unit_id')),
+                        'commander_id': _int_or_none(request.form.get(f'participations-{i}-commander_id')),
+                        'side': request.form.get(f'participations-{i}-side') or 'other',
                     }
                     participant_list.append(part_data)
-                    i += 1
 
-                session['participations_data'] = participant_list
+                BattleDraftService.patch(session[DRAFT_SESSION_KEY], participations=participant_list)
                 return redirect(url_for('battles.new_battle_step3'))
 
             except Exception as e:
+                db.session.rollback()
                 flash(f'Ошибка при сохранении данных об участниках: {str(e)}', 'danger')
                 return redirect(url_for('battles.new_battle_step2'))
 
 
 @bp.route('/new/step3', methods=['GET', 'POST'])
 def new_battle_step3():
-    if 'battle_data' not in session or 'participationss_data' not in session:
+    draft = _load_draft('battle', 'participations')
+    if draft is None:
         return redirect(url_for('battles.new_battle'))
 
     if request.method == 'POST':
         try:
             loss_data = {
+                'country_id': _int_or_none(request.form.get('country_id')),
                 'killed': request.form.get('killed', 0, type=int),
                 'wounded': request.form.get('wounded', 0, type=int),
                 'captured': request.form.get('captured', 0, type=int),
@@ -190,14 +205,18 @@ def new_battle_step3():
                 'colours_lost': request.form.get('colours_lost', 0, type=int),
             }
 
-            session['losses_data'] = loss_data
+            BattleDraftService.patch(session[DRAFT_SESSION_KEY], losses=loss_data)
             return save_complete_battle()
 
+        except ValueError as e:
+            flash(str(e), 'warning')
+            return redirect(url_for('battles.new_battle_step3'))
         except Exception as e:
+            db.session.rollback()
             flash(f'Ошибка при сохранении данных о потерях: {str(e)}', 'danger')
             return redirect(url_for('battles.new_battle_step3'))
 
-    losses_data = session.get('losses_data', {
+    losses_data = draft.get('losses', {
         'killed': 0,
         'wounded': 0,
         'captured': 0,
@@ -205,49 +224,52 @@ def new_battle_step3():
         'colours_lost': 0
     })
 
-    trophies = session.get('trophies_data', [])
+    trophies = draft.get('trophies', [])
     return render_template(
         'battles/wizard_step3.html',
-        battle=session.get('battle_data', {}),
-        participationss=session.get('participationss_data', []),
+        battle=draft['battle'],
+        participationss=draft['participations'],
         losses_data=losses_data,
         trophies=trophies
     )
 
+# Отмена мастера: черновик удаляется сразу, не дожидаясь BATTLE_DRAFT_TTL
+@bp.route('/new/cancel', methods=['POST'])
+def cancel_new_battle():
+    BattleDraftService.discard(session.pop(DRAFT_SESSION_KEY, None))
+    flash('Добавление сражения отменено', 'info')
+    return redirect(url_for('battles.list_battles'))
+
 @bp.route('/save-complete', methods=['POST'])
 def save_complete_battle():
-    try:
-        # Создаём сражение
-        battle_data = session.get('battle_data', {})
-        battle = Battle(**battle_data)
-        db.session.add(battle)
-        db.session.flush()  # Получаем battle.id
-
-        # Участники
-        for p in session.get('participationss_data', []):
-            participant = Battleparticipations(battle_id=battle.id, **p)
-            db.session.add(participant)
-
-        # Трофеи
-        for t in session.get('trophies_data', []):
-            trophy = Trophy(battle_id=battle.id, **t)
-            db.session.add(trophy)
-
-        # Потери (общие по сражению)
-        losses_data = session.get('losses_data', {})
-        if losses_data:
-            loss = BattleLosses(battle_id=battle.id, **losses_data)
-            db.session.add(loss)
+    draft_id = session.get(DRAFT_SESSION_KEY)
+    if _load_draft('battle') is None:
+        flash('Черновик сражения не найден, начните заново', 'warning')
+        return redirect(url_for('battles.new_battle'))
 
-        db.session.commit()
+    try:
+        # Трофеи приходят с формы последнего шага
+        if request.form.get('step') == '3':
+            trophies = []
+            for i in _form_indexes(request.form, 'trophies', 'type'):
+                trophy_type = request.form[f'trophies-{i}-type'].strip()
+                if trophy_type:
+                    trophies.append({
+                        'type': trophy_type,
+                        'description': request.form.get(f'trophies-{i}-description') or None,
+                        'quantity': request.form.get(f'trophies-{i}-quantity', 1, type=int),
+                        'captor_id': _int_or_none(request.form.get(f'trophies-{i}-captor_id')),
+                    })
+            BattleDraftService.patch(draft_id, trophies=trophies)
+
+        # Сражение, участники, трофеи, потери и итоги командиров — одной транзакцией
+        battle = BattleDraftService.commit(draft_id)
+        BattleService.invalidate_histogram()
+        RollupService.invalidate_units(RollupService.battle_unit_ids(battle.id))
+        OrderOfBattleService.invalidate([battle.id])
         flash('Сражение успешно сохранено!', 'success')
 
-        # Очистка сессии
-        session.pop('battle_data', None)
-        session.pop('participationss_data', None)
-        session.pop('losses_data', None)
-        session.pop('trophies_data', None)
-
+        session.pop(DRAFT_SESSION_KEY, None)
         return redirect(url_for('battles.view_battle', id=battle.id))
 
     except Exception as e:
@@ -260,12 +282,7 @@ def save_complete_battle():
 def view_battle(id):
     battle = Battle.query.options(
         db.joinedload(Battle.place),
-        # Загружаем участников и связанные объекты
-        db.joinedload(Battle.participations).joinedload(Battleparticipations.unit),
-        db.joinedload(Battle.participations).joinedload(Battleparticipations.commander),
-        # ... другие опции ...
     ).get_or_404(id)
-    participations = Battleparticipations.query.filter_by(battle_id=id).all()
     
     # Получаем численность сторон
     size_entries = (SizeParties.query
@@ -278,15 +295,18 @@ def view_battle(id):
     french_size = next((s for s in size_entries if s.country.name == 'France'), None)
     allied_size = [s for s in size_entries if s.country.name != 'France']
 
-    # Участники сражения
-    french_participants = []
-    other_participants = []
-    
-    for p in participations:
-        if p.unit and p.unit.country and p.unit.country.name == 'France':
-            french_participants.append(p)
-        else:
-            other_participants.append(p)
+    # Участники деревом соединений на дату сражения; HTML кэшируется
+    oob_fragment = OrderOfBattleService.cached_fragment(
+        id, battle.date_begin, current_app.config.get('BATTLE_OOB_TTL', 3600))
+    if oob_fragment is None:
+        participations = Battleparticipations.query.filter_by(battle_id=id).all()
+        roots = OrderOfBattleService.get_tree(participations, battle.date_begin)
+        oob_fragment = OrderOfBattleService.store_fragment(id, battle.date_begin, render_template(
+            'battles/_oob.html',
+            french_roots=[root for root in roots if root['country_name'] == 'France'],
+            other_roots=[root for root in roots if root['country_name'] != 'France'],
+            unassigned=[p for p in participations if p.unit_id is None]
+        ))
     
     
     # Потери: собираем ВСЕ записи BattleLosses для этого сражения
@@ -336,8 +356,7 @@ def view_battle(id):
         battle=battle,
         french_size=french_size,
         allied_size=allied_size,
-        french_participants=french_participants,
-        other_participants=other_participants,
+        oob_fragment=Markup(oob_fragment),
         french_losses=french_losses,
         allied_losses=allied_losses,
         trophies=trophies
@@ -350,6 +369,9 @@ def edit_battle(id):
 
     if request.method == 'POST':
         try:
+            # Итоги соединений зависят и от прежнего, и от нового состава участников
+            affected_units = RollupService.battle_unit_ids(id)
+            affected_commanders = CommanderService.battle_commander_ids(id)
             form_data = request.form.to_dict()
 
             # Обработка даты
@@ -363,21 +385,28 @@ def edit_battle(id):
             battle.description = form_data.get('description')
             battle.place_id = form_data.get('place_id')
 
-            # ✅ Обновление участников
-            unit_ids = request.form.getlist('unit_ids')
-
-            # Удаляем старые связи
-            Battleparticipations.query.filter_by(battle_id=id).delete()
-
-            # Добавляем новые
-            for unit_id in unit_ids:
-                participation = Battleparticipations(
-                    battle_id=id,
-                    unit_id=int(unit_id)
-                )
-                db.session.add(participation)
-
+            # ✅ Обновление участников: сравнение с текущим составом по подразделению,
+            # сторона и командир уже записанных участников сохраняются
+            unit_ids = [int(u) for u in request.form.getlist('unit_ids') if u.isdigit()]
+            known_units = ParticipationService.validate_references(unit_ids=unit_ids)['unit']
+            missing = sorted(set(unit_ids) - known_units)
+            if missing:
+                flash(f"Подразделения не найдены и пропущены: {', '.join(map(str, missing))}", 'warning')
+
+            ParticipationService.sync(
+                Battleparticipations.battle_id == id,
+                [{'unit_id': unit_id} for unit_id in unit_ids if unit_id in known_units],
+                key='unit_id',
+                defaults={'battle_id': id, 'side': 'other'}
+            )
+
+            affected_units |= set(unit_ids)
+            # Дата сражения и состав участников меняют итоги командиров
+            CommanderService.sync_stats(affected_commanders | CommanderService.battle_commander_ids(id))
             db.session.commit()
+            BattleService.invalidate_histogram()
+            RollupService.invalidate_units(affected_units)
+            OrderOfBattleService.invalidate([id])
             flash('Изменения сохранены', 'success')
             return redirect(url_for('battles.view_battle', id=battle.id))
 
@@ -404,12 +433,19 @@ def delete_battle(id):
     battle = Battle.query.get_or_404(id)
     
     try:
+        affected_units = RollupService.ancestor_ids(RollupService.battle_unit_ids(id))
+        affected_commanders = CommanderService.battle_commander_ids(id)
         # Удаляем связанные данные
         Battleparticipations.query.filter_by(battle_id=id).delete()
         Trophy.query.filter_by(battle_id=id).delete()
         
         db.session.delete(battle)
+        db.session.flush()
+        CommanderService.sync_stats(affected_commanders)
         db.session.commit()
+        BattleService.invalidate_histogram()
+        RollupService.invalidate(affected_units)
+        OrderOfBattleService.invalidate([id])
         flash('Сражение успешно удалено', 'success')
     except Exception as e:
         db.session.rollback()
@@ -435,48 +471,71 @@ def search_places():
 @bp.route('/search')
 def search_battles():
     query = request.args.get('q', '')
-    # Реализация поиска офицеров
-    results = Battle.query.filter(
-        or_(
-            Battle.name.ilike(f'%{query}%'),
-            Battle.date_begin.ilike(f'%{query}%')
-        )
-    ).all()
-    return render_template('battles/list.html', battles=results)
+    # Поиск выполняет /battles/api/window с параметром q
+    return _render_list(query)
 
 @bp.route('/battle/<int:battle_id>/add_diagram', methods=['GET', 'POST'])
 def add_diagram(battle_id):
+    from app.forms import DiagramForm
+
     battle = Battle.query.get_or_404(battle_id)
     form = DiagramForm()
     
     if form.validate_on_submit():
-        # Сохранение файла
-        file = form.diagram.data
-        filename = secure_filename(f"battle_{battle_id}_{uuid.uuid4().hex[:8]}_{file.filename}")
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], 'battle_diagrams', filename)
-        
-        # Создаем папку если нет
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        file.save(filepath)
-        
-        # Если отмечаем как основную, снимаем флаг у других
-        if form.is_main.data:
-            BattleDiagram.query.filter_by(battle_id=battle_id).update({'is_main': False})
-        
-        # Создаем запись в БД
-        diagram = BattleDiagram(
-            battle_id=battle_id,
-            filename=filename,
+        # Файл сохраняется сразу, миниатюры и WebP/AVIF строятся в фоне
+        DiagramService.save_upload(
+            battle_id,
+            form.image.data,
             description=form.description.data,
             is_main=form.is_main.data
         )
-        db.session.add(diagram)
-        db.session.commit()
         
         flash('Схема успешно добавлена', 'success')
         return redirect(url_for('battles.view_battle', id=battle_id))
     
-    return render_template('add_diagram.html', battle=battle, form=form)
+    return render_template('battles/add_diagram.html', battle=battle, form=form)
+
+# Изображение схемы: подходящий по ширине и формату вариант или оригинал
+@bp.route('/diagram/<int:diagram_id>/image')
+def diagram_image(diagram_id):
+    diagram = BattleDiagram.query.get_or_404(diagram_id)
+    width = request.args.get('w', type=int)
+    fmt = request.args.get('fmt')
+    if fmt and fmt not in current_app.config.get('DIAGRAM_FORMATS', ()):
+        fmt = None
+
+    variant = DiagramService.pick_variant(diagram, width, fmt, request.headers.get('Accept'))
+    if variant:
+        # Варианты адресуются хэшем содержимого и не меняются
+        response = send_file(variant, conditional=True, max_age=31536000)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        # Варианты ещё не готовы — отдаём оригинал без долгого кэширования
+        response = send_from_directory(diagrams_folder(), diagram.filename, conditional=True, max_age=0)
+    if not fmt:
+        response.vary.add('Accept')
+    return response
+
+# Описание тайловой пирамиды крупной схемы (deep zoom)
+@bp.route('/diagram/<int:diagram_id>/tiles/info')
+def diagram_tiles_info(diagram_id):
+    diagram = BattleDiagram.query.get_or_404(diagram_id)
+    if diagram.tiles_status != 'ready':
+        return jsonify({'status': diagram.tiles_status or 'none'}), 404
+    return jsonify(DiagramService.tile_info(diagram))
+
+# Отдельный тайл пирамиды: уровень z, столбец x, строка y
+@bp.route('/diagram/<int:diagram_id>/tiles/<int:z>/<int:x>_<int:y>')
+def diagram_tile(diagram_id, z, x, y):
+    diagram = BattleDiagram.query.get_or_404(diagram_id)
+    path = DiagramService.tile_file(diagram, z, x, y)
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype='image/jpeg', conditional=True, max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @bp.route('/diagram/<int:diagram_id>/set_main', methods=['POST'])
 def set_main_diagram(diagram_id):
@@ -497,17 +556,18 @@ def delete_diagram(diagram_id):
     diagram = BattleDiagram.query.get_or_404(diagram_id)
     battle_id = diagram.battle_id
     
-    # Удаляем файл
-    try:
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], 'battle_diagrams', diagram.filename)
-        if os.path.exists(filepath):
-            os.remove(filepath)
-    except Exception as e:
-        current_app.logger.error(f"Error deleting diagram file: {e}")
-    
-    # Удаляем запись из БД
-    db.session.delete(diagram)
-    db.session.commit()
+    # Удаляем запись и, если файл больше не используется, сам файл с вариантами
+    DiagramService.delete(diagram)
     
     flash('Схема удалена', 'success')
-    return redirect(url_for('battles.view_battle', id=battle_id))
\ No newline at end of file
+    return redirect(url_for('battles.view_battle', id=battle_id))
+
+
+# flask battles process-diagrams — варианты и тайлы схем, загруженных до
+# конвейера обработки изображений (статусы NULL); --failed — и упавших
+@bp.cli.command('process-diagrams')
+@click.option('--failed', is_flag=True, help='повторить схемы с ошибкой обработки')
+def process_diagrams_command(failed):
+    counts = DiagramService.process_unprocessed(include_failed=failed)
+    click.echo(f"Обработано схем: {counts['processed']}, без изменений: {counts['skipped']}, "
+               f"без файла: {counts['missing']}")
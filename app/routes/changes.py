@@ -0,0 +1,39 @@
+import click
+from flask import Blueprint, jsonify, request
+from app import db
+from app.models import ChangeLog
+from app.services.change_service import ChangeService, parse_changes_args
+
+bp = Blueprint('changes', __name__, url_prefix='/api')
+
+
+# API: Журнал изменений для локальной копии данных на клиенте.
+# Первый запрос без since, дальше — since=<next из прошлого ответа>, пока has_more
+@bp.route('/changes', methods=['GET'])
+def list_changes():
+    try:
+        query = parse_changes_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(ChangeService.changes(**query))
+
+
+# flask changes install-triggers — триггеры журнала изменений (повторный запуск безопасен)
+@bp.cli.command('install-triggers')
+@click.option('--seed/--no-seed', default=None,
+              help='записать в журнал существующие строки (по умолчанию — если журнал пуст)')
+def install_triggers_command(seed):
+    if seed is None:
+        seed = ChangeLog.query.first() is None
+    ChangeService.install_triggers()
+    seeded = ChangeService.seed() if seed else 0
+    db.session.commit()
+    click.echo(f'Триггеры установлены, записей добавлено: {seeded}')
+
+
+# flask changes compact — удаление записей, перекрытых более поздними
+@bp.cli.command('compact')
+def compact_command():
+    removed = ChangeService.compact()
+    db.session.commit()
+    click.echo(f'Удалено записей журнала: {removed}')
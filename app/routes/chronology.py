@@ -0,0 +1,19 @@
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from app.services.chronology_service import ChronologyService, parse_chronology_args
+
+bp = Blueprint('chronology', __name__, url_prefix='/chronology')
+
+
+# API: Единая хронология (сражения, события, перемещения, повышения, назначения).
+# Keyset-страницы: следующая запрашивается с ?after=<next из ответа>
+@bp.route('/api', methods=['GET'])
+def chronology_api():
+    try:
+        query = parse_chronology_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return Response(
+        stream_with_context(ChronologyService.stream(**query)),
+        mimetype='application/json'
+    )
@@ -1,13 +1,12 @@
+import click
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
-from flask_migrate import history
-from app.models import Battleparticipations, Commander, CommanderAssignment, CommanderRank, Country, MilitaryRank, MilitaryUnit, UnitHierarchy
+from app.models import Battleparticipations, Commander, CommanderAssignment, CommanderRank, CommanderStats, Country, MilitaryRank, MilitaryUnit, UnitHierarchy
 from app import db
 from marshmallow import Schema, fields, validate, ValidationError, validates
-from datetime import datetime
+from datetime import date, datetime
 from app.services.commander_service import CommanderService
-from flask import render_template, url_for
-from sqlalchemy import or_, text
-from sqlalchemy.orm import joinedload
+from app.services.command_service import MAX_CHAIN_PAIRS, CommandChainService
+from app.pagination import estimated_count, keyset_paginate
 
 bp = Blueprint('commanders', __name__, url_prefix='/commanders')
 
@@ -19,7 +18,7 @@ class CommanderSchema(Schema):
     death_date = fields.Date(allow_none=True)
     biography = fields.Str(allow_none=True)
     country_id = fields.Int(required=True, data_key="nationally_id")  # Связываем с моделью
-    rank_id = fields.Int(allow_none=True)
+    rank_id = fields.Int(dump_only=True)  # указатель на текущее звание, см. CommanderService.sync_current_rank
 
     @validates('death_date')
     def validate_death_date(self, value, **kwargs):
@@ -30,34 +29,111 @@ class CommanderSchema(Schema):
         if 'birth_date' in self.context and self.context['birth_date'] and value < self.context['birth_date']:
             raise ValidationError("Дата смерти должна быть после даты рождения")
         
+# Сортировки списка командиров: колонка итогов (None — по фамилии) и направление
+# по умолчанию. Командиры без строки commander_stats (не пересчитаны после
+# обновления или созданы в обход форм) считаются командирами без сражений
+# и званий: ключ — COALESCE(колонка, 0), NULL в keyset-сравнении не участвует.
+COMMANDER_SORTS = {
+    'name': (None, 'asc'),
+    'battles': ('battles_count', 'desc'),
+    'first_battle': ('first_battle', 'asc'),
+    'last_battle': ('last_battle', 'desc'),
+    'rank': ('top_rank_level', 'desc'),
+}
+
+# Даты сражений есть только у командиров со сражениями, подставлять нечего
+COMMANDER_DATE_SORTS = ('first_battle', 'last_battle')
+
+
+def _commander_sort_key(sort):
+    """Колонки keyset-ключа и функция значений ключа для курсора"""
+    attr = COMMANDER_SORTS[sort][0]
+    if attr is None:
+        return [Commander.last_name, Commander.id], None
+    column = getattr(CommanderStats, attr)
+    if sort not in COMMANDER_DATE_SORTS:
+        column = db.func.coalesce(column, 0)
+    return [column, Commander.id], lambda c: [getattr(c.stats, attr) if c.stats else 0, c.id]
+
 # Список всех командующих
 @bp.route('/commanders', methods=['GET'])
 def list_commanders():
     # Получаем параметры фильтрации
     last_name = request.args.get('last_name', '')
     country_id = request.args.get('country', type=int)
+    min_battles = request.args.get('min_battles', type=int)
+    year_from = request.args.get('year_from', type=int)
+    year_to = request.args.get('year_to', type=int)
+    if year_from is not None and not 1 <= year_from <= 9999:
+        year_from = None
+    if year_to is not None and not 1 <= year_to <= 9999:
+        year_to = None
+
+    sort = request.args.get('sort', 'name')
+    if sort not in COMMANDER_SORTS:
+        sort = 'name'
+    default_order = COMMANDER_SORTS[sort][1]
+    sort_columns, row_values = _commander_sort_key(sort)
+    order = request.args.get('order', default_order)
+    if order not in ('asc', 'desc'):
+        order = default_order
     
-    # Формируем базовый запрос
-    query = Commander.query.options(db.joinedload(Commander.country))
+    # Итоги карьеры, страна и звания — одним запросом без ленивых загрузок;
+    # командир без строки итогов в списке остаётся
+    stats_filtered = bool(min_battles or year_from or year_to)
+    query = Commander.query.outerjoin(Commander.stats).options(
+        db.joinedload(Commander.country),
+        db.joinedload(Commander.current_rank_assignment).joinedload(CommanderRank.rank),
+        db.contains_eager(Commander.stats).joinedload(CommanderStats.top_rank),
+        db.contains_eager(Commander.stats).joinedload(CommanderStats.current_unit)
+    )
     
     # Применяем фильтры
     if last_name:
         query = query.filter(Commander.last_name.ilike(f'%{last_name}%'))
     if country_id:
         query = query.filter(Commander.country_id == country_id)
+    if min_battles:
+        query = query.filter(db.func.coalesce(CommanderStats.battles_count, 0) >= min_battles)
+    # Годы активности: интервал [первое, последнее сражение] пересекается с заданным
+    if year_from:
+        query = query.filter(CommanderStats.last_battle >= date(year_from, 1, 1))
+    if year_to:
+        query = query.filter(CommanderStats.first_battle <= date(year_to, 12, 31))
+    # Без сражений дат нет; NULL в ключе сломал бы keyset-сравнение
+    if sort in COMMANDER_DATE_SORTS:
+        query = query.filter(CommanderStats.battles_count > 0)
     
     # Получаем список всех стран для фильтра
     countries = Country.query.order_by(Country.name).all()
     
-    # Пагинация
-    page = request.args.get('page', 1, type=int)
+    # Keyset-пагинация по выбранной колонке и id
     per_page = 20
-    commanders = query.paginate(page=page, per_page=per_page, error_out=False)
+    commanders = keyset_paginate(
+        query,
+        sort_columns,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=per_page,
+        descending=order == 'desc',
+        row_values=row_values
+    )
+    if last_name or country_id or stats_filtered or sort in COMMANDER_DATE_SORTS:
+        commanders.total = estimated_count(query)
+    else:
+        commanders.total = estimated_count(table_name=Commander.__tablename__)
+
+    # Параметры фильтров без курсора и сортировки — для ссылок в заголовках
+    filter_args = {key: value for key, value in request.args.items()
+                   if key not in ('after', 'before', 'sort', 'order') and value}
     
     return render_template(
         'commanders/list.html',
         commanders=commanders,
-        countries=countries  # Передаем список стран в шаблон
+        countries=countries,  # Передаем список стран в шаблон
+        sort=sort,
+        order=order,
+        filter_args=filter_args
     )
 
 # Форма добавления нового командующего
@@ -117,6 +193,9 @@ def new_commander():
                 )
                 db.session.add(rank_entry)
 
+            db.session.flush()
+            CommanderService.sync_current_rank([commander.id])
+            CommanderService.sync_stats([commander.id])
             db.session.commit()
             flash("Командующий успешно добавлен", "success")
             return redirect(url_for('commanders.view_commander', id=commander.id))
@@ -147,32 +226,37 @@ def view_commander(id):
         db.joinedload(Commander.military_units).joinedload(CommanderAssignment.unit)
     ).get_or_404(id)
 
-    # Исправленный запрос для истории званий
-    rank_query = text("""
-        SELECT mr.rank_name AS rank_name, co.name AS country_name, cr.date_promoted
-        FROM commander_ranks cr
-        JOIN military_ranks mr ON cr.rank_id = mr.id
-        LEFT JOIN countries co ON mr.country_id = co.id
-        WHERE cr.commander_id = :commander_id
-        ORDER BY cr.date_promoted DESC;
-    """)
-    
-    # Исправленный способ получения результатов
-    rank_result = db.session.execute(rank_query, {"commander_id": id})
-    # Преобразуем результат в список словарей
+    # История званий (звание и страна загружаются тем же запросом)
     commander_rank_history = [
         {
-            "rank_name": row[0],
-            "country_name": row[1],
-            "date_promoted": row[2]
+            "rank_name": entry.rank.rank_name,
+            "country_name": entry.rank.country.name if entry.rank.country else None,
+            "date_promoted": entry.date_promoted
         }
-        for row in rank_result
+        for entry in CommanderService.get_commander_ranks_history(id)
     ]
 
+    # Цепочки командования на начало каждого назначения и на дату каждого
+    # сражения — одним рекурсивным запросом для всех пар
+    assignments = [a for a in commander.military_units if a.Com_start]
+    participations = [p for p in commander.battle_participations if p.battle]
+    chains = CommandChainService.resolve(
+        [(id, a.Com_start) for a in assignments] +
+        [(id, p.battle.date_begin) for p in participations]
+    )
+    assignment_chains = {a.id: chain for a, chain in zip(assignments, chains)}
+    participation_chains = {
+        p.id: CommandChainService.superiors(chain)
+        for p, chain in zip(participations, chains[len(assignments):])
+    }
+
     return render_template(
         'commanders/view.html',
         commander=commander,
-        commander_rank_history=commander_rank_history
+        commander_rank_history=commander_rank_history,
+        assignment_chains=assignment_chains,
+        participation_chains=participation_chains,
+        superiors=CommandChainService.superiors
     )
 
 # Редактирование командующего
@@ -195,7 +279,10 @@ def edit_commander(id):
             history_rank_ids = request.form.getlist('history_rank_ids[]')
             history_dates = request.form.getlist('history_dates[]')
 
-            # Удаляем все текущие повышения (для упрощения)
+            # Удаляем все текущие повышения (для упрощения).
+            # Сначала снимаем указатель на текущее звание, иначе сработает FK.
+            commander.rank_id = None
+            db.session.flush()
             CommanderRank.query.filter_by(commander_id=id).delete()
 
             # Сохраняем новые/обновлённые записи
@@ -215,6 +302,9 @@ def edit_commander(id):
                 )
                 db.session.add(new_rank)
 
+            db.session.flush()
+            CommanderService.sync_current_rank([id])
+            CommanderService.sync_stats([id])
             db.session.commit()
             flash("Изменения сохранены", "success")
             return redirect(url_for('commanders.view_commander', id=id))
@@ -260,6 +350,31 @@ def get_ranks_api():
     ranks = MilitaryRank.query.filter_by(country_id=country_id).order_by(MilitaryRank.rank_name).all()
     return jsonify([{'id': r.id, 'name': r.rank_name} for r in ranks])
 
+# API: Цепочки командования для пар (commander_id, date).
+# Пары передаются повторяющимися параметрами: ?commander_id=1&date=1808-08-21&commander_id=2&date=...
+@bp.route('/api/chain-of-command', methods=['GET'])
+def chain_of_command_api():
+    commander_ids = request.args.getlist('commander_id')
+    dates = request.args.getlist('date')
+    if not commander_ids or len(commander_ids) != len(dates):
+        return jsonify({'error': 'Ожидаются пары параметров commander_id и date'}), 400
+    if len(commander_ids) > MAX_CHAIN_PAIRS:
+        return jsonify({'error': f'Не больше {MAX_CHAIN_PAIRS} пар за запрос'}), 400
+
+    try:
+        pairs = [(int(commander_id), datetime.strptime(on_date, '%Y-%m-%d').date())
+                 for commander_id, on_date in zip(commander_ids, dates)]
+    except ValueError:
+        return jsonify({'error': 'commander_id — число, date — в формате ГГГГ-ММ-ДД'}), 400
+
+    chains = CommandChainService.resolve(pairs)
+    return jsonify([{
+        'commander_id': commander_id,
+        'date': on_date.isoformat(),
+        'chain': chain,
+        'superiors': CommandChainService.superiors(chain),
+    } for (commander_id, on_date), chain in zip(pairs, chains)])
+
 # API: Поиск командующих (для автодополнения)
 @bp.route('/api/search', methods=['GET'])
 def search_commanders():
@@ -299,3 +414,20 @@ def add_rank(commander_id):
     
     return redirect(url_for('commanders.detail', commander_id=commander_id))
 
+
+# flask commanders sync-stats — пересчёт итогов карьеры всех командиров
+@bp.cli.command('sync-stats')
+def sync_stats_command():
+    CommanderService.sync_stats()
+    db.session.commit()
+    click.echo(f'Итоги пересчитаны: {CommanderStats.query.count()} командиров')
+
+
+# flask commanders sync-current-rank — заполнение Commander.rank_id по истории
+# званий (один раз после обновления схемы и после ручной правки commander_ranks)
+@bp.cli.command('sync-current-rank')
+def sync_current_rank_command():
+    CommanderService.sync_current_rank()
+    db.session.commit()
+    with_rank = Commander.query.filter(Commander.rank_id.isnot(None)).count()
+    click.echo(f'Текущие звания обновлены: {with_rank} командиров со званием')
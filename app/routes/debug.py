@@ -0,0 +1,60 @@
+import json
+import os
+from collections import Counter
+from flask import Blueprint, abort, render_template, send_from_directory
+from werkzeug.utils import secure_filename
+from app.profiling import PROFILE_PARAM, is_authorised, profiles_dir, request_token
+
+bp = Blueprint('debug', __name__, url_prefix='/_debug')
+
+@bp.before_request
+def check_token():
+    if not is_authorised():
+        abort(404)
+
+def _load_meta(profile_id):
+    path = os.path.join(profiles_dir(), f'{secure_filename(profile_id)}.json')
+    if not os.path.exists(path):
+        abort(404)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+# Список сохранённых профилей
+@bp.route('/profiles')
+def list_profiles():
+    directory = profiles_dir()
+    profiles = []
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory), reverse=True):
+            if name.endswith('.json'):
+                meta = _load_meta(name[:-len('.json')])
+                meta.pop('sql_timeline', None)
+                profiles.append(meta)
+
+    return render_template('debug/profiles.html', profiles=profiles, token=request_token(), token_param=PROFILE_PARAM)
+
+# Один профиль: самые «горячие» функции и хронология SQL
+@bp.route('/profiles/<profile_id>')
+def view_profile(profile_id):
+    meta = _load_meta(profile_id)
+
+    self_samples = Counter()
+    folded_path = os.path.join(profiles_dir(), f"{meta['id']}.folded")
+    if os.path.exists(folded_path):
+        with open(folded_path, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    self_samples[stack.rsplit(';', 1)[-1]] += int(count)
+
+    return render_template('debug/profile.html',
+                           profile=meta,
+                           hot_frames=self_samples.most_common(30),
+                           token=request_token(),
+                           token_param=PROFILE_PARAM)
+
+# Скачивание collapsed stacks (speedscope, flamegraph.pl)
+@bp.route('/profiles/<profile_id>.folded')
+def download_profile(profile_id):
+    return send_from_directory(profiles_dir(), f'{secure_filename(profile_id)}.folded',
+                               mimetype='text/plain', as_attachment=True)
@@ -1,8 +1,8 @@
 from flask import Blueprint, render_template
 from sqlalchemy import func
 from app.models import Event, Place
-from datetime import datetime
-from dateutil import parser
+from app.services.battle_service import date_to_epoch
+from app.services.live_service import live_stream_url
 import json
 from app import db
 
@@ -22,22 +22,13 @@ def list_events():
 
     events_data = []
     for event in events_query:
-        timestamp = 0
-        if event.date:
-            try:
-                dt = parser.parse(event.date.strftime('%Y-%m-%d'))
-                timestamp = (dt - datetime(1970, 1, 1)).total_seconds()
-            except Exception as e:
-                print(f"Error processing date for event {event.id}: {str(e)}")
-                timestamp = 0
-
         events_data.append({
             'id': event.id,
             'event': event.event,
             'date': event.date.strftime('%Y-%m-%d') if event.date else None,
-            'timestamp': int(timestamp),
+            'timestamp': date_to_epoch(event.date) or 0,
             'place_name': event.place_name,
             'geom': json.loads(event.geom_json) if event.geom_json else None
         })
 
-    return render_template('events/list.html', events=events_data)
\ No newline at end of file
+    return render_template('events/list.html', events=events_data, live_url=live_stream_url())
\ No newline at end of file
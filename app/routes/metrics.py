@@ -0,0 +1,9 @@
+from flask import Blueprint, Response
+from app.metrics import registry
+
+bp = Blueprint('metrics', __name__)
+
+# Метрики для Prometheus
+@bp.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
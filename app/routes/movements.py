@@ -1,7 +1,13 @@
+import json
+
+import click
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
 from app.models import Place, UnitMovement, MilitaryUnit
 from app import db
+from app.services.movement_service import BACKFILL_BATCH_SIZE, MovementService, parse_nearby_args
+from app.services.position_service import PositionService
 from marshmallow import Schema, fields, validate
+from app.pagination import estimated_count, keyset_paginate
 
 bp = Blueprint('movements', __name__, url_prefix='/movements')
 
@@ -23,12 +29,17 @@ class MovementSchema(Schema):
 # Список всех мест
 @bp.route('/places', methods=['GET'])
 def list_places():
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     
-    places = Place.query.order_by(
-        Place.name
-    ).paginate(page=page, per_page=per_page)
+    # Keyset-пагинация по (name, id)
+    places = keyset_paginate(
+        Place.query,
+        [Place.name, Place.id],
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=per_page
+    )
+    places.total = estimated_count(table_name=Place.__tablename__)
     
     return render_template('movements/places.html', places=places)
 
@@ -42,8 +53,7 @@ def new_place():
             
             place = Place(
                 name=data['name'],
-                latitude=data.get('latitude'),
-                longitude=data.get('longitude')
+                geom=Place.make_geom(data.get('latitude'), data.get('longitude'))
             )
             
             db.session.add(place)
@@ -68,10 +78,15 @@ def edit_place(id):
             data = schema.load(request.form)
             
             place.name = data['name']
-            place.latitude = data.get('latitude')
-            place.longitude = data.get('longitude')
+            # latitude/longitude — свойства только для чтения, координаты пишутся в geom
+            place.geom = Place.make_geom(data.get('latitude'), data.get('longitude'))
+            db.session.flush()
+            
+            # Маршруты, проходящие через место, пересчитываются вместе с ним
+            MovementService.update_routes(place_id=place.id)
             
             db.session.commit()
+            PositionService.invalidate_timeline()
             flash('Изменения сохранены', 'success')
             return redirect(url_for('movements.list_places'))
             
@@ -84,12 +99,18 @@ def edit_place(id):
 # Список всех перемещений
 @bp.route('/', methods=['GET'])
 def list_movements():
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     
-    movements = UnitMovement.query.order_by(
-        UnitMovement.date.desc()
-    ).paginate(page=page, per_page=per_page)
+    # Keyset-пагинация по (date desc, id desc)
+    movements = keyset_paginate(
+        UnitMovement.query,
+        [UnitMovement.date, UnitMovement.id],
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=per_page,
+        descending=True
+    )
+    movements.total = estimated_count(table_name=UnitMovement.__tablename__)
     
     return render_template('movements/list.html', movements=movements)
 
@@ -111,7 +132,10 @@ def new_movement():
             )
             
             db.session.add(movement)
+            db.session.flush()
+            MovementService.update_routes([movement.id])
             db.session.commit()
+            PositionService.invalidate_timeline()
             flash('Перемещение успешно добавлено', 'success')
             return redirect(url_for('movements.list_movements'))
             
@@ -148,8 +172,11 @@ def edit_movement(id):
             movement.date = data['date']
             movement.distance_km = data.get('distance_km')
             movement.route_description = data.get('route_description')
+            db.session.flush()
+            MovementService.update_routes([movement.id])
             
             db.session.commit()
+            PositionService.invalidate_timeline()
             flash('Изменения сохранены', 'success')
             return redirect(url_for('movements.view_movement', id=movement.id))
             
@@ -173,6 +200,7 @@ def delete_movement(id):
     try:
         db.session.delete(movement)
         db.session.commit()
+        PositionService.invalidate_timeline()
         flash('Перемещение успешно удалено', 'success')
     except Exception as e:
         db.session.rollback()
@@ -180,6 +208,42 @@ def delete_movement(id):
     
     return redirect(url_for('movements.list_movements'))
 
+# API: Путь подразделений одной линией (GeoJSON)
+@bp.route('/api/paths', methods=['GET'])
+def api_paths():
+    unit_ids = request.args.getlist('unit_id', type=int)
+    if not unit_ids:
+        return jsonify({'error': 'Не указан unit_id'}), 400
+
+    features = []
+    for unit_id, path in MovementService.campaign_paths(unit_ids).items():
+        features.append({
+            'type': 'Feature',
+            'geometry': json.loads(path['geojson']) if path['geojson'] else None,
+            'properties': {
+                'unit_id': unit_id,
+                'distance_km': path['distance_km'],
+                'movements': path['movements'],
+                'date_from': path['date_from'].isoformat() if path['date_from'] else None,
+                'date_to': path['date_to'].isoformat() if path['date_to'] else None,
+            }
+        })
+    return jsonify({'type': 'FeatureCollection', 'features': features})
+
+# API: Подразделения рядом с местом в интервале дат
+@bp.route('/api/nearby', methods=['GET'])
+def api_nearby():
+    try:
+        query = parse_nearby_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'place_id': query['place_id'],
+        'radius_km': query['radius_km'],
+        'units': MovementService.nearby(**query)
+    })
+
 # API: Получение координат места
 @bp.route('/api/place_coordinates/<int:id>', methods=['GET'])
 def get_place_coordinates(id):
@@ -199,8 +263,7 @@ def api_create_place():
     try:
         new_place = Place(
             name=data['name'],
-            latitude=data.get('latitude'),
-            longitude=data.get('longitude')
+            geom=Place.make_geom(data.get('latitude'), data.get('longitude'))
         )
         db.session.add(new_place)
         db.session.commit()
@@ -214,4 +277,13 @@ def api_create_place():
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+
+# flask movements backfill-routes — заполнение маршрутов существующих перемещений
+@bp.cli.command('backfill-routes')
+@click.option('--batch-size', default=BACKFILL_BATCH_SIZE, show_default=True, help='строк в одном UPDATE')
+@click.option('--all', 'recompute_all', is_flag=True, help='пересчитать и уже заполненные маршруты')
+def backfill_routes_command(batch_size, recompute_all):
+    updated = MovementService.backfill_routes(batch_size=batch_size, only_missing=not recompute_all)
+    click.echo(f'Обновлено маршрутов: {updated}')
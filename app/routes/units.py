@@ -1,14 +1,37 @@
-from flask import Blueprint, current_app, render_template, request, jsonify, redirect, url_for, flash
-from wsproto import ConnectionType
+import click
+from flask import Blueprint, Response, current_app, render_template, request, jsonify, redirect, stream_with_context, url_for, flash
 from app.models import Battle, Battleparticipations, CommanderAssignment, MilitaryUnit, Country, Commander, UnitHierarchy, ConnectionType, BattleLosses
 from app import db
 from marshmallow import Schema, ValidationError, fields, validate, validates
 from datetime import date, datetime
 from sqlalchemy import or_, and_
 from collections import deque
+from app.services.participation_service import ParticipationService
+from app.services.commander_service import CommanderService
+from app.services.movement_service import MovementService
+from app.services.oob_service import OrderOfBattleService
+from app.services.frame_service import FrameService
+from app.services.position_service import PositionService, parse_frames_args
+from app.services.rollup_service import RollupService
 
 bp = Blueprint('units', __name__, url_prefix='/units')
 
+
+def _indexed_form_rows(form, *fields):
+    """Поля формы вида <поле>_<N>, сгруппированные по индексу N"""
+    rows = {}
+    for name, value in form.items():
+        field, _, index = name.rpartition('_')
+        if field in fields and index.isdigit():
+            rows.setdefault(int(index), dict.fromkeys(fields))[field] = value
+    return dict(sorted(rows.items()))
+
+
+def _form_ids(form, field):
+    """Числовые значения поля <field>_<N> со всех строк формы"""
+    return {int(row[field]) for row in _indexed_form_rows(form, field).values()
+            if row[field] and row[field].isdigit()}
+
 class UnitSchema(Schema):
     id = fields.Int(dump_only=True)
     name = fields.Str(required=True, validate=validate.Length(min=2, max=100))
@@ -237,6 +260,12 @@ def new_unit():
             db.session.add(unit)
             db.session.flush() # Получаем unit.id до коммита
 
+            # Сражения и командиры, на которые ссылается форма, проверяются одним запросом
+            references = ParticipationService.validate_references(
+                battle_ids=_form_ids(request.form, 'battle_id'),
+                commander_ids=_form_ids(request.form, 'commander_id')
+            )
+
             # --- Обработка истории командования ---
             # Собираем данные о назначениях из формы
             new_assignments_data = []
@@ -262,6 +291,9 @@ def new_unit():
                 if not commander_id:
                     flash(f'Не выбран командир в назначении {assignment_counter}. Пропущено.', 'warning')
                     continue
+                if commander_id not in references['commander']:
+                    flash(f'Командир с ID {commander_id} не найден (назначение {assignment_counter}). Пропущено.', 'warning')
+                    continue
                 # Обработка дат
                 start_date = None
                 end_date = None
@@ -294,48 +326,37 @@ def new_unit():
             # --- Конец обработки истории командования ---
 
             # --- Обработка участия в сражениях ---
-            # Предполагаем, что в форме есть поля battle_id_X и side_X, где X - индекс
-            battle_counter = 0
-            while True:
-                battle_id_key = f'battle_id_{battle_counter}'
-                side_key = f'side_{battle_counter}'
-
-                if battle_id_key not in request.form:
-                    break
-
-                battle_id_val = request.form.get(battle_id_key)
-                side_val = request.form.get(side_key, '').strip()
-
-                battle_counter += 1
-
-                if not battle_id_val:
-                    # Пропускаем пустые строки
-                    continue
-
+            # У нового подразделения участий ещё нет: все строки формы
+            # вставляются одним пакетным запросом
+            participation_rows = []
+            for index, fields_ in _indexed_form_rows(request.form, 'battle_id').items():
+                if not fields_['battle_id']:
+                    continue  # пустые строки пропускаем
                 try:
-                    battle_id = int(battle_id_val)
+                    battle_id = int(fields_['battle_id'])
                 except ValueError:
-                    flash(f'Некорректный ID сражения в участии {battle_counter}. Пропущено.', 'warning')
+                    flash(f'Некорректный ID сражения в участии {index + 1}. Пропущено.', 'warning')
                     continue
-
-                # Проверка существования сражения (опционально)
-                battle = Battle.query.get(battle_id)
-                if not battle:
+                if battle_id not in references['battle']:
                     flash(f'Сражение с ID {battle_id} не найдено. Пропущено.', 'warning')
                     continue
-
-                # Создание нового участия
-                from app.models import Battleparticipations # Убедитесь, что импортировано
-                new_participation = Battleparticipations(
-                    battle_id=battle_id,
-                    unit_id=unit.id,
-                    side=side_val if side_val else None # Можно сделать обязательным
-                )
-                db.session.add(new_participation)
+                participation_rows.append({
+                    'battle_id': battle_id,
+                    'side': request.form.get(f'side_{index}', '').strip() or 'other',
+                })
+            ParticipationService.sync(
+                Battleparticipations.unit_id == unit.id,
+                participation_rows,
+                key='id',
+                defaults={'unit_id': unit.id}
+            )
 
             # --- Конец обработки участия в сражениях ---
 
+            CommanderService.sync_stats(CommanderService.unit_commander_ids(unit.id))
             db.session.commit()
+            RollupService.invalidate_units([unit.id])
+            OrderOfBattleService.invalidate()
             flash('Подразделение успешно добавлено', 'success')
             return redirect(url_for('units.list_units'))
         except Exception as e:
@@ -367,11 +388,29 @@ def view_unit(id):
         .order_by(CommanderAssignment.Com_start.desc()) \
         .all()
 
+    # Перемещения с координатами и общий путь — по одному запросу
+    movements = MovementService.unit_movements(id)
+    movements_data = [{
+        'date': m.date.isoformat() if m.date else None,
+        'start_name': m.start_name,
+        'end_name': m.end_name,
+        'distance_km': m.distance_km,
+        'route_description': m.route_description,
+        'start_lat': m.start_lat,
+        'start_lon': m.start_lon,
+        'end_lat': m.end_lat,
+        'end_lon': m.end_lon,
+    } for m in movements]
+
     # Можно передать в шаблон, если нужно отдельно
     return render_template(
         'units/view.html',
         unit=unit,
-        command_history=command_history
+        command_history=command_history,
+        movements=movements,
+        movements_data=movements_data,
+        campaign_path=MovementService.campaign_paths([id]).get(id),
+        rollup=RollupService.get_rollup(id)
     )
 
 # Редактирование подразделения
@@ -386,6 +425,8 @@ def edit_unit(id):
         # --- Обработка основных данных подразделения ---
         # (Оставляем существующую логику для name, dates, country, unit_type)
         try:
+            # Итоги командиров зависят и от прежних, и от новых назначений и участий
+            affected_commanders = CommanderService.unit_commander_ids(id)
             # Подготовим данные подразделения (без commander_id)
             form_data = request.form.to_dict()
             # Убираем потенциально конфликтующие ключи, если они есть
@@ -471,6 +512,11 @@ def edit_unit(id):
             # Это требует сложного фронтенда. Пока покажем, как можно обработать.
             # 1. Получить все существующие назначения для этого юнита
             existing_assignments = {a.id: a for a in CommanderAssignment.query.filter_by(unit_id=id).all()}
+            # Сражения и командиры, на которые ссылается форма, проверяются одним запросом
+            references = ParticipationService.validate_references(
+                battle_ids=_form_ids(request.form, 'battle_id'),
+                commander_ids=_form_ids(request.form, 'commander_id')
+            )
             # 2. Предположим, форма отправляет данные в виде:
             # assignment_ids[] - список ID существующих назначений (или 'new' для новых)
             # commander_id_X, start_date_X, end_date_X - где X - индекс или ID
@@ -512,6 +558,9 @@ def edit_unit(id):
                 if not commander_id:
                     flash(f'Не выбран командир в назначении {assignment_counter}. Пропущено.', 'warning')
                     continue
+                if commander_id not in references['commander']:
+                    flash(f'Командир с ID {commander_id} не найден (назначение {assignment_counter}). Пропущено.', 'warning')
+                    continue
                 # Обработка дат
                 start_date = None
                 end_date = None
@@ -561,81 +610,44 @@ def edit_unit(id):
             # --- Конец обработки истории командования ---
 
             # --- Обработка участия в сражениях ---
-            # Получаем все существующие участия для этого юнита
-            existing_participations = {p.id: p for p in Battleparticipations.query.filter_by(unit_id=id).all()}
-            processed_participation_ids = set()
-
-            battle_counter = 0
-            while True:
-                # Ищем поля для текущего участия
-                participation_id_key = f'participation_id_{battle_counter}'
-                battle_id_key = f'battle_id_{battle_counter}'
-                side_key = f'side_{battle_counter}'
-                delete_key = f'delete_{battle_counter}' # Если будет флаг удаления
-
-                # В простом случае проверяем наличие battle_id_key
-                if battle_id_key not in request.form:
-                    break
-
-                participation_id_val = request.form.get(participation_id_key)
-                battle_id_val = request.form.get(battle_id_key)
-                side_val = request.form.get(side_key, '').strip()
-                delete_flag = request.form.get(delete_key) # 'on' если отмечено
-
-                battle_counter += 1
-
-                # Логика удаления (если реализована через флаг)
-                if delete_flag == 'on':
-                    if participation_id_val and participation_id_val.isdigit():
-                        participation_to_delete = existing_participations.get(int(participation_id_val))
-                        if participation_to_delete:
-                            db.session.delete(participation_to_delete)
-                            processed_participation_ids.add(participation_to_delete.id)
-                    continue
-
-                if not battle_id_val:
-                    # Пропускаем пустые строки
-                    continue
-
+            # Строки формы сравниваются с текущими участиями по id; участие,
+            # строку которого убрали из формы, удаляется. Вставки, изменения
+            # и удаления выполняются пакетно
+            participation_rows = []
+            for index, fields_ in _indexed_form_rows(request.form, 'battle_id').items():
+                participation_id_val = request.form.get(f'participation_id_{index}', '')
+                participation_id = int(participation_id_val) if participation_id_val.isdigit() else None
+                if not fields_['battle_id']:
+                    continue  # пустые строки пропускаем
                 try:
-                    battle_id = int(battle_id_val)
+                    battle_id = int(fields_['battle_id'])
                 except ValueError:
-                    flash(f'Некорректный ID сражения в участии {battle_counter}. Пропущено.', 'warning')
+                    battle_id = None
+                if battle_id not in references['battle']:
+                    flash(f"Сражение с ID {fields_['battle_id']} не найдено. Пропущено.", 'warning')
+                    if participation_id:
+                        # Существующее участие остаётся без изменений
+                        participation_rows.append({'id': participation_id})
                     continue
-
-                # Проверка существования сражения (опционально)
-                battle = Battle.query.get(battle_id)
-                if not battle:
-                    flash(f'Сражение с ID {battle_id} не найдено. Пропущено.', 'warning')
-                    continue
-
-                # Создание или обновление
-                if not participation_id_val or participation_id_val == 'new' or not participation_id_val.isdigit():
-                    # Создание нового участия
-                    new_participation = Battleparticipations(
-                        battle_id=battle_id,
-                        unit_id=unit.id,
-                        side=side_val if side_val else None
-                    )
-                    db.session.add(new_participation)
-                else:
-                    # Обновление существующего
-                    try:
-                        existing_id = int(participation_id_val)
-                        participation_to_update = existing_participations.get(existing_id)
-                        if participation_to_update:
-                            participation_to_update.battle_id = battle_id
-                            participation_to_update.side = side_val if side_val else None
-                            db.session.add(participation_to_update)
-                            processed_participation_ids.add(participation_to_update.id)
-                        else:
-                             flash(f'Участие с ID {existing_id} не найдено. Пропущено.', 'warning')
-                    except ValueError:
-                        flash(f'Некорректный ID участия {participation_id_val}. Пропущено.', 'warning')
+                participation_rows.append({
+                    'id': participation_id,
+                    'battle_id': battle_id,
+                    'side': request.form.get(f'side_{index}', '').strip() or 'other',
+                })
+            ParticipationService.sync(
+                Battleparticipations.unit_id == unit.id,
+                participation_rows,
+                key='id',
+                defaults={'unit_id': unit.id}
+            )
 
             # --- Конец обработки участия в сражениях ---
 
+            CommanderService.sync_stats(affected_commanders | CommanderService.unit_commander_ids(id))
             db.session.commit()
+            RollupService.invalidate_units([unit.id])
+            # Имя и участия подразделения видны в деревьях многих сражений
+            OrderOfBattleService.invalidate()
             flash('Изменения сохранены', 'success')
             return redirect(url_for('units.view_unit', id=unit.id))
         except Exception as e:
@@ -675,10 +687,18 @@ def delete_unit(id):
     unit = MilitaryUnit.query.get_or_404(id)
     
     try:
+        # Предки определяются до удаления: потом связей иерархии уже нет
+        affected_units = RollupService.ancestor_ids([id])
+        affected_commanders = CommanderService.unit_commander_ids(id)
         # Перед удалением обнуляем parent_unit_id у дочерних подразделений
         MilitaryUnit.query.filter_by(parent_unit_id=id).update({'parent_unit_id': None})
         db.session.delete(unit)
+        db.session.flush()
+        CommanderService.sync_stats(affected_commanders)
         db.session.commit()
+        PositionService.invalidate_timeline()
+        RollupService.invalidate(affected_units)
+        OrderOfBattleService.invalidate()
         flash('Подразделение успешно удалено', 'success')
     except Exception as e:
         db.session.rollback()
@@ -686,6 +706,57 @@ def delete_unit(id):
     
     return redirect(url_for('units.list_units'))
 
+# API: Итоги соединения с подчинёнными подразделениями на даты сражений
+@bp.route('/api/<int:id>/rollup', methods=['GET'])
+def api_unit_rollup(id):
+    MilitaryUnit.query.get_or_404(id)
+    rollup = RollupService.get_rollup(id)
+    return jsonify({
+        **rollup,
+        'battles': [{**battle, 'date_begin': battle['date_begin'].isoformat()} for battle in rollup['battles']]
+    })
+
+# API: Положения всех подразделений на дату (интерполяция по перемещениям)
+@bp.route('/api/positions', methods=['GET'])
+def api_positions():
+    try:
+        on_date = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Параметр date ожидается в формате ГГГГ-ММ-ДД'}), 400
+    return jsonify(PositionService.positions_on(on_date))
+
+# API: Кадры анимации кампании с шагом step суток
+@bp.route('/api/positions/frames', methods=['GET'])
+def api_position_frames():
+    try:
+        query = parse_frames_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(PositionService.frames(**query))
+
+# API: Те же кадры в двоичном виде (Float32), потоком по окнам из дискового кэша.
+# Формат описан в FrameService; декодер — static/js/position_frames.js
+@bp.route('/api/positions/frames.bin', methods=['GET'])
+def api_position_frames_binary():
+    try:
+        query = parse_frames_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    delta = request.args.get('delta') == '1'
+
+    timeline = PositionService.get_timeline()
+    etag = f'{timeline.version}-{query["date_from"]}-{query["date_to"]}-{query["step"]}-{int(delta)}'
+    if etag in request.if_none_match:
+        return Response(status=304)
+
+    response = Response(
+        stream_with_context(FrameService.stream(timeline, delta=delta, **query)),
+        mimetype='application/octet-stream'
+    )
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # проверка по ETag, данные меняются с перемещениями
+    return response
+
 # API: Получение подразделений по стране (для AJAX)
 @bp.route('/api/units_by_country', methods=['GET'])
 def get_units_by_country():
@@ -705,4 +776,13 @@ def get_commanders_by_country():
     
     commanders = Commander.query.filter_by(country_id=country_id)\
         .order_by(Commander.last_name, Commander.first_name).all()
-    return jsonify([{'id': c.id, 'name': f'{c.last_name} {c.first_name}'} for c in commanders])
\ No newline at end of file
+    return jsonify([{'id': c.id, 'name': f'{c.last_name} {c.first_name}'} for c in commanders])
+
+
+# flask units precompute-frames — заранее посчитать окна кадров анимации
+@bp.cli.command('precompute-frames')
+@click.option('--step', default=1, show_default=True, help='шаг кадров, сутки')
+@click.option('--delta', is_flag=True, help='дельта-кодирование кадров')
+def precompute_frames_command(step, delta):
+    windows = FrameService.precompute(step=step, delta=delta)
+    click.echo(f'Готово окон: {windows}')
@@ -0,0 +1,151 @@
+import time
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import extract, func, select
+from app import cache_bus
+from app.metrics import record_cache
+from app.models import Battle, Place, db
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Гистограмма сражений по годам для меток временной шкалы: (время расчёта, данные)
+_year_histogram_cache = {}
+
+cache_bus.register('battle_year_histogram', lambda keys: _year_histogram_cache.clear(), tables=('battles',))
+
+
+def date_to_epoch(value):
+    """Дата -> секунды от 1970-01-01 UTC (для исторических дат — отрицательные)"""
+    return (value.toordinal() - EPOCH_ORDINAL) * 86400 if value else None
+
+
+def parse_window_args(args):
+    """
+    Параметры временного окна из строки запроса (from, to, bbox, q).
+    Общая для синхронного и асинхронного API; ValueError — с текстом ошибки.
+    """
+    try:
+        date_from = datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from') else None
+        date_to = datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to') else None
+    except ValueError:
+        raise ValueError('Даты ожидаются в формате ГГГГ-ММ-ДД')
+
+    bbox = None
+    if args.get('bbox'):
+        try:
+            bbox = [float(v) for v in args['bbox'].split(',')]
+        except ValueError:
+            bbox = None
+        if not bbox or len(bbox) != 4:
+            raise ValueError('bbox ожидается как min_lon,min_lat,max_lon,max_lat')
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'bbox': bbox,
+        'name_query': (args.get('q') or '').strip() or None,
+    }
+
+
+class BattleService:
+    @staticmethod
+    def window_statement(date_from=None, date_to=None, bbox=None, name_query=None):
+        """
+        Запрос сражений во временном окне (и, при необходимости, в прямоугольнике
+        карты). bbox — (min_lon, min_lat, max_lon, max_lat).
+        """
+        stmt = select(
+            Battle.id,
+            Battle.name,
+            Battle.date_begin,
+            Battle.victory,
+            Place.name.label('place_name'),
+            func.ST_X(Place.geom).label('lon'),
+            func.ST_Y(Place.geom).label('lat')
+        ).join(Place, Battle.place_id == Place.id)
+
+        if date_from:
+            stmt = stmt.where(Battle.date_begin >= date_from)
+        if date_to:
+            stmt = stmt.where(Battle.date_begin <= date_to)
+        if bbox:
+            envelope = func.ST_MakeEnvelope(*bbox, 4326)
+            stmt = stmt.where(Place.geom.intersects(envelope))
+        if name_query:
+            stmt = stmt.where(Battle.name.ilike(f'%{name_query}%'))
+
+        return stmt.order_by(Battle.date_begin, Battle.id)
+
+    @staticmethod
+    def pack_window(rows):
+        """Строки window_statement в колоночном виде: по массиву на каждое поле"""
+        # Победитель кодируется индексом в словаре victory_codes
+        victory_codes = []
+        victory_index = {}
+        result = {
+            'ids': [], 'lon': [], 'lat': [], 'epoch': [], 'victory': [],
+            'name': [], 'place': [], 'victory_codes': victory_codes
+        }
+        for row in rows:
+            if row.victory is None:
+                code = None
+            else:
+                code = victory_index.get(row.victory)
+                if code is None:
+                    code = victory_index[row.victory] = len(victory_codes)
+                    victory_codes.append(row.victory)
+
+            result['ids'].append(row.id)
+            result['lon'].append(round(row.lon, 5) if row.lon is not None else None)
+            result['lat'].append(round(row.lat, 5) if row.lat is not None else None)
+            result['epoch'].append(date_to_epoch(row.date_begin))
+            result['victory'].append(code)
+            result['name'].append(row.name)
+            result['place'].append(row.place_name)
+
+        result['count'] = len(result['ids'])
+        return result
+
+    @staticmethod
+    def get_window(date_from=None, date_to=None, bbox=None, name_query=None):
+        """Сражения во временном окне в колоночном виде"""
+        rows = db.session.execute(BattleService.window_statement(date_from, date_to, bbox, name_query)).all()
+        return BattleService.pack_window(rows)
+
+    @staticmethod
+    def histogram_statement():
+        year = extract('year', Battle.date_begin)
+        return select(year.label('year'), func.count(Battle.id)).group_by(year).order_by(year)
+
+    @staticmethod
+    def pack_histogram(rows):
+        return {
+            'years': [int(y) for y, _ in rows],
+            'counts': [c for _, c in rows]
+        }
+
+    @staticmethod
+    def cached_histogram(ttl):
+        """Гистограмма из кэша или None, если её нет или она устарела"""
+        cached = _year_histogram_cache.get('years')
+        hit = cached is not None and time.monotonic() - cached[0] < cache_bus.ttl(ttl)
+        record_cache('battle_year_histogram', hit)
+        return cached[1] if hit else None
+
+    @staticmethod
+    def store_histogram(histogram):
+        _year_histogram_cache['years'] = (time.monotonic(), histogram)
+        return histogram
+
+    @staticmethod
+    def get_year_histogram():
+        """Число сражений по годам; кэшируется на BATTLE_HISTOGRAM_TTL секунд"""
+        histogram = BattleService.cached_histogram(current_app.config.get('BATTLE_HISTOGRAM_TTL', 300))
+        if histogram is None:
+            rows = db.session.execute(BattleService.histogram_statement()).all()
+            histogram = BattleService.store_histogram(BattleService.pack_histogram(rows))
+        return histogram
+
+    @staticmethod
+    def invalidate_histogram():
+        cache_bus.invalidate('battle_year_histogram')
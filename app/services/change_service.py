@@ -0,0 +1,188 @@
+from datetime import date, datetime
+from sqlalchemy import BigInteger, Text, cast, delete, func, insert, literal, select, text, tuple_
+from sqlalchemy.orm import aliased
+from app.models import Battle, ChangeLog, Event, MilitaryUnit, Place, UnitMovement, db
+from app.pagination import decode_cursor, encode_cursor
+
+# Размер страницы журнала по умолчанию и предел
+CHANGES_DEFAULT_LIMIT = 1000
+CHANGES_MAX_LIMIT = 5000
+
+# Ключ курсора клиента
+CURSOR_COLUMNS = [ChangeLog.xid, ChangeLog.id]
+
+# Таблицы журнала: модель и колонки, которые получает клиент
+CHANGE_TABLES = {
+    'battles': (Battle, [Battle.id, Battle.name, Battle.date_begin, Battle.date_end,
+                         Battle.place_id, Battle.victory]),
+    'events': (Event, [Event.id, Event.date, Event.event, Event.place_id]),
+    'places': (Place, [Place.id, Place.name,
+                       func.ST_X(Place.geom).label('lon'), func.ST_Y(Place.geom).label('lat')]),
+    'military_units': (MilitaryUnit, [MilitaryUnit.id, MilitaryUnit.name, MilitaryUnit.type,
+                                      MilitaryUnit.country_id, MilitaryUnit.formation_date,
+                                      MilitaryUnit.dissolution_date]),
+    'unit_movements': (UnitMovement, [UnitMovement.id, UnitMovement.unit_id, UnitMovement.date,
+                                      UnitMovement.start_place_id, UnitMovement.end_place_id,
+                                      UnitMovement.distance_km]),
+}
+
+# Канал NOTIFY о записях журнала: "таблица:операция:id", доставляется после
+# коммита (повторы в одной транзакции PostgreSQL склеивает)
+CHANGE_CHANNEL = 'change_log'
+
+LOG_CHANGE_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION log_change() RETURNS trigger AS $$
+DECLARE
+    changed_id integer := CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END;
+    changed_op text := CASE WHEN TG_OP = 'DELETE' THEN 'D' ELSE 'U' END;
+BEGIN
+    INSERT INTO change_log (table_name, row_id, op, xid)
+    VALUES (TG_TABLE_NAME, changed_id, changed_op, pg_current_xact_id()::text::bigint);
+    PERFORM pg_notify('{CHANGE_CHANNEL}', TG_TABLE_NAME || ':' || changed_op || ':' || changed_id);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# UPDATE без фактических изменений (например, пересчёт того же маршрута) журнал не засоряет
+TABLE_TRIGGERS = """
+DROP TRIGGER IF EXISTS {table}_change_log ON {table};
+CREATE TRIGGER {table}_change_log AFTER INSERT OR DELETE ON {table}
+    FOR EACH ROW EXECUTE FUNCTION log_change();
+DROP TRIGGER IF EXISTS {table}_change_log_update ON {table};
+CREATE TRIGGER {table}_change_log_update AFTER UPDATE ON {table}
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION log_change();
+"""
+
+
+def _current_xid():
+    return cast(cast(func.pg_current_xact_id(), Text), BigInteger)
+
+
+def _visible_horizon():
+    """
+    Транзакции с xid ниже xmin текущего снимка завершены, а новые получат
+    xid не меньше него. Записи до этой границы окончательны: курсор,
+    прошедший их, не пропустит позже закоммиченную транзакцию.
+    """
+    return cast(cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), Text), BigInteger)
+
+
+def _jsonable(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, float):
+        return round(value, 5)
+    return value
+
+
+def parse_changes_args(args):
+    """
+    Параметры /api/changes: since (курсор из прошлого ответа), limit.
+    ValueError — с текстом ошибки для ответа 400.
+    """
+    since = decode_cursor(args.get('since'), CURSOR_COLUMNS)
+    if args.get('since') and since is None:
+        raise ValueError('Некорректный курсор since')
+
+    limit = args.get('limit') or str(CHANGES_DEFAULT_LIMIT)
+    if not str(limit).isdigit() or not 0 < int(limit) <= CHANGES_MAX_LIMIT:
+        raise ValueError(f'limit — целое число от 1 до {CHANGES_MAX_LIMIT}')
+    return {'since': since, 'limit': int(limit)}
+
+
+class ChangeService:
+    @staticmethod
+    def install_triggers():
+        """Функция log_change и триггеры на таблицах журнала (идемпотентно)"""
+        db.session.execute(text(LOG_CHANGE_FUNCTION))
+        for table in CHANGE_TABLES:
+            db.session.execute(text(TABLE_TRIGGERS.format(table=table)))
+
+    @staticmethod
+    def missing_triggers(tables=None):
+        """Таблицы журнала (по умолчанию все), на которых нет триггеров install_triggers"""
+        tables = list(tables if tables is not None else CHANGE_TABLES)
+        installed = set(db.session.execute(
+            text("SELECT tgname FROM pg_trigger WHERE NOT tgisinternal AND tgname = ANY(:names)"),
+            {'names': [f'{table}_change_log' for table in tables]}
+        ).scalars())
+        return [table for table in tables if f'{table}_change_log' not in installed]
+
+    @staticmethod
+    def seed():
+        """
+        Записи U для всех существующих строк: клиент без курсора получает
+        весь набор данных через тот же журнал. Возвращает число записей.
+        """
+        total = 0
+        for table, (model, _) in CHANGE_TABLES.items():
+            result = db.session.execute(
+                insert(ChangeLog).from_select(
+                    ['table_name', 'row_id', 'op', 'xid'],
+                    select(literal(table), model.id, literal('U'), _current_xid())
+                )
+            )
+            total += result.rowcount
+        return total
+
+    @staticmethod
+    def compact():
+        """
+        Удаляет записи, за которыми в журнале есть более поздняя запись той же
+        строки: клиенту нужно только последнее состояние. Удаления (D) без
+        последующих записей остаются навсегда. Возвращает число удалённых.
+        """
+        newer = aliased(ChangeLog)
+        superseded = select(newer.id).where(
+            newer.table_name == ChangeLog.table_name,
+            newer.row_id == ChangeLog.row_id,
+            tuple_(newer.xid, newer.id) > tuple_(ChangeLog.xid, ChangeLog.id)
+        ).exists()
+        return db.session.execute(delete(ChangeLog).where(superseded)).rowcount
+
+    @staticmethod
+    def changes_statement(since=None, limit=CHANGES_DEFAULT_LIMIT):
+        stmt = select(ChangeLog.id, ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op, ChangeLog.xid)\
+            .where(ChangeLog.xid < _visible_horizon())
+        if since is not None:
+            stmt = stmt.where(tuple_(ChangeLog.xid, ChangeLog.id) > tuple_(*since))
+        return stmt.order_by(ChangeLog.xid, ChangeLog.id).limit(limit)
+
+    @staticmethod
+    def changes(since=None, limit=CHANGES_DEFAULT_LIMIT):
+        """
+        Страница журнала: для каждой таблицы текущие строки (upserts) и id
+        удалённых (deletes). Несколько записей одной строки сводятся к
+        последней; строка, удалённая после записи U, отдаётся как удаление.
+        next — курсор для следующего запроса, has_more — страница не последняя.
+        """
+        entries = db.session.execute(ChangeService.changes_statement(since, limit)).all()
+
+        latest = {}
+        for entry in entries:
+            latest[(entry.table_name, entry.row_id)] = entry.op
+
+        changes = {}
+        for table, (model, columns) in CHANGE_TABLES.items():
+            upsert_ids = [row_id for (name, row_id), op in latest.items() if name == table and op == 'U']
+            delete_ids = {row_id for (name, row_id), op in latest.items() if name == table and op == 'D'}
+
+            upserts = []
+            if upsert_ids:
+                for row in db.session.execute(select(*columns).where(model.id.in_(upsert_ids))):
+                    upserts.append({key: _jsonable(value) for key, value in row._asdict().items()})
+                delete_ids |= set(upsert_ids) - {row['id'] for row in upserts}
+
+            if upserts or delete_ids:
+                changes[table] = {'upserts': upserts, 'deletes': sorted(delete_ids)}
+
+        if entries:
+            next_cursor = encode_cursor([entries[-1].xid, entries[-1].id])
+        else:
+            next_cursor = encode_cursor(since) if since is not None else None
+        return {
+            'changes': changes,
+            'next': next_cursor,
+            'has_more': len(entries) == limit,
+        }
@@ -0,0 +1,231 @@
+import json
+from sqlalchemy import Date, Integer, String, cast, column, literal, or_, select, true, tuple_, union_all
+from sqlalchemy.orm import aliased
+from app.models import (Battle, Battleparticipations, Commander, CommanderAssignment, CommanderRank,
+                        Event, MilitaryRank, MilitaryUnit, Place, UnitMovement, db)
+from app.pagination import decode_cursor, encode_cursor
+from app.services.battle_service import parse_window_args
+
+# Размер страницы хронологии по умолчанию и предел
+CHRONOLOGY_DEFAULT_LIMIT = 200
+CHRONOLOGY_MAX_LIMIT = 2000
+
+# Строк, читаемых с серверного курсора за раз при потоковой выдаче
+STREAM_BATCH = 200
+
+# Ключ сортировки ленты: (дата, вид записи, id) — уникален для всех потоков
+CURSOR_COLUMNS = [column('date', Date), column('kind', String), column('id', Integer)]
+
+
+def parse_chronology_args(args):
+    """
+    Параметры /chronology/api: from, to, unit, commander, limit, after.
+    ValueError — с текстом ошибки для ответа 400.
+    """
+    window = parse_window_args(args)
+    if window['date_from'] and window['date_to'] and window['date_from'] > window['date_to']:
+        raise ValueError('Дата from позже даты to')
+
+    ids = {}
+    for name in ('unit', 'commander'):
+        value = args.get(name)
+        if value and not str(value).isdigit():
+            raise ValueError(f'{name} должен быть числом')
+        ids[name] = int(value) if value else None
+
+    limit = args.get('limit') or str(CHRONOLOGY_DEFAULT_LIMIT)
+    if not str(limit).isdigit() or not 0 < int(limit) <= CHRONOLOGY_MAX_LIMIT:
+        raise ValueError(f'limit — целое число от 1 до {CHRONOLOGY_MAX_LIMIT}')
+
+    after = decode_cursor(args.get('after'), CURSOR_COLUMNS)
+    if args.get('after') and after is None:
+        raise ValueError('Некорректный курсор after')
+
+    return {
+        'date_from': window['date_from'],
+        'date_to': window['date_to'],
+        'unit_id': ids['unit'],
+        'commander_id': ids['commander'],
+        'limit': int(limit),
+        'after': after,
+    }
+
+
+def _commanded(unit_id, commander_id, on_date):
+    """Назначение командира на подразделение, действующее на дату"""
+    return select(CommanderAssignment.id).where(
+        CommanderAssignment.unit_id == unit_id,
+        CommanderAssignment.commander_id == commander_id,
+        CommanderAssignment.Com_start <= on_date,
+        or_(CommanderAssignment.Com_end.is_(None), CommanderAssignment.Com_end >= on_date)
+    ).exists()
+
+
+def _after(kind, date_column, id_column, after):
+    """
+    Условие «после курсора» для потока одного вида. Вид внутри потока
+    постоянен, поэтому сравнение (date, kind, id) сводится к условию на
+    (date, id), которое ищется по индексу потока.
+    """
+    if after is None:
+        return true()
+    after_date, after_kind, after_id = after
+    if kind > after_kind:
+        return date_column >= after_date
+    if kind < after_kind:
+        return date_column > after_date
+    return tuple_(date_column, id_column) > tuple_(after_date, after_id)
+
+
+def _commander_name():
+    return Commander.last_name + ' ' + Commander.first_name
+
+
+def _stream(date, date_end, kind, id, title, detail, unit_id=None, commander_id=None):
+    """SELECT потока с общими для всех видов колонками"""
+    return select(
+        date.label('date'),
+        (date_end if date_end is not None else cast(None, Date)).label('date_end'),
+        literal(kind).label('kind'),
+        id.label('id'),
+        title.label('title'),
+        detail.label('detail'),
+        (unit_id if unit_id is not None else cast(None, Integer)).label('unit_id'),
+        (commander_id if commander_id is not None else cast(None, Integer)).label('commander_id')
+    )
+
+
+class ChronologyService:
+    """
+    Единая хронология: сражения, события, перемещения, повышения и
+    назначения одним запросом UNION ALL. Каждый поток сам отсекает записи до
+    курсора и берёт не больше limit строк в порядке своего индекса (дата, id),
+    внешний запрос сливает потоки по (date, kind, id).
+    Строки: date, date_end, kind, id, title, detail, unit_id, commander_id.
+    """
+
+    @staticmethod
+    def _battles(unit_id, commander_id):
+        stmt = _stream(Battle.date_begin, Battle.date_end, 'battle', Battle.id, Battle.name, Place.name)\
+            .outerjoin(Place, Place.id == Battle.place_id)
+        if unit_id:
+            stmt = stmt.where(select(Battleparticipations.id).where(
+                Battleparticipations.battle_id == Battle.id,
+                Battleparticipations.unit_id == unit_id
+            ).exists())
+        if commander_id:
+            stmt = stmt.where(select(Battleparticipations.id).where(
+                Battleparticipations.battle_id == Battle.id,
+                Battleparticipations.commander_id == commander_id
+            ).exists())
+        return stmt, Battle.date_begin, Battle.id
+
+    @staticmethod
+    def _events(unit_id, commander_id):
+        # События не связаны с подразделениями и командирами
+        if unit_id or commander_id:
+            return None
+        stmt = _stream(Event.date, None, 'event', Event.id, Event.event, Place.name)\
+            .outerjoin(Place, Place.id == Event.place_id)
+        return stmt, Event.date, Event.id
+
+    @staticmethod
+    def _movements(unit_id, commander_id):
+        end_place = aliased(Place)
+        stmt = _stream(UnitMovement.date, None, 'movement', UnitMovement.id, MilitaryUnit.name, end_place.name,
+                       unit_id=UnitMovement.unit_id)\
+            .join(MilitaryUnit, MilitaryUnit.id == UnitMovement.unit_id)\
+            .outerjoin(end_place, end_place.id == UnitMovement.end_place_id)
+        if unit_id:
+            stmt = stmt.where(UnitMovement.unit_id == unit_id)
+        if commander_id:
+            # Перемещения подразделений, которыми командир командовал в тот день
+            stmt = stmt.where(_commanded(UnitMovement.unit_id, commander_id, UnitMovement.date))
+        return stmt, UnitMovement.date, UnitMovement.id
+
+    @staticmethod
+    def _promotions(unit_id, commander_id):
+        stmt = _stream(CommanderRank.date_promoted, None, 'promotion', CommanderRank.id,
+                       _commander_name(), MilitaryRank.rank_name, commander_id=CommanderRank.commander_id)\
+            .join(Commander, Commander.id == CommanderRank.commander_id)\
+            .outerjoin(MilitaryRank, MilitaryRank.id == CommanderRank.rank_id)
+        if commander_id:
+            stmt = stmt.where(CommanderRank.commander_id == commander_id)
+        if unit_id:
+            # Повышения тех, кто в тот день командовал подразделением
+            stmt = stmt.where(_commanded(unit_id, CommanderRank.commander_id, CommanderRank.date_promoted))
+        return stmt, CommanderRank.date_promoted, CommanderRank.id
+
+    @staticmethod
+    def _assignments(unit_id, commander_id):
+        stmt = _stream(CommanderAssignment.Com_start, CommanderAssignment.Com_end, 'assignment',
+                       CommanderAssignment.id, _commander_name(), MilitaryUnit.name,
+                       unit_id=CommanderAssignment.unit_id, commander_id=CommanderAssignment.commander_id)\
+            .join(Commander, Commander.id == CommanderAssignment.commander_id)\
+            .join(MilitaryUnit, MilitaryUnit.id == CommanderAssignment.unit_id)
+        if unit_id:
+            stmt = stmt.where(CommanderAssignment.unit_id == unit_id)
+        if commander_id:
+            stmt = stmt.where(CommanderAssignment.commander_id == commander_id)
+        return stmt, CommanderAssignment.Com_start, CommanderAssignment.id
+
+    @staticmethod
+    def chronology_statement(date_from=None, date_to=None, unit_id=None, commander_id=None,
+                             limit=CHRONOLOGY_DEFAULT_LIMIT, after=None):
+        streams = {
+            'assignment': ChronologyService._assignments,
+            'battle': ChronologyService._battles,
+            'event': ChronologyService._events,
+            'movement': ChronologyService._movements,
+            'promotion': ChronologyService._promotions,
+        }
+
+        parts = []
+        for kind, build in streams.items():
+            built = build(unit_id, commander_id)
+            if built is None:
+                continue
+            stmt, date_column, id_column = built
+            stmt = stmt.where(date_column.isnot(None), _after(kind, date_column, id_column, after))
+            if date_from:
+                stmt = stmt.where(date_column >= date_from)
+            if date_to:
+                stmt = stmt.where(date_column <= date_to)
+            parts.append(stmt.order_by(date_column, id_column).limit(limit))
+
+        chronology = union_all(*parts).subquery('chronology')
+        return select(chronology)\
+            .order_by(chronology.c.date, chronology.c.kind, chronology.c.id)\
+            .limit(limit)
+
+    @staticmethod
+    def pack_item(row):
+        return {
+            'date': row.date.isoformat(),
+            'date_end': row.date_end.isoformat() if row.date_end else None,
+            'kind': row.kind,
+            'id': row.id,
+            'title': row.title,
+            'detail': row.detail,
+            'unit_id': row.unit_id,
+            'commander_id': row.commander_id,
+        }
+
+    @staticmethod
+    def stream(limit=CHRONOLOGY_DEFAULT_LIMIT, **params):
+        """
+        Генератор JSON-ответа {"items": [...], "next": курсор}. Строки
+        читаются с серверного курсора пачками по STREAM_BATCH и сразу
+        отдаются клиенту; next — None, если лента закончилась.
+        """
+        stmt = ChronologyService.chronology_statement(limit=limit, **params)
+        rows = db.session.execute(stmt.execution_options(yield_per=STREAM_BATCH))
+
+        yield '{"items": ['
+        last, count = None, 0
+        for row in rows:
+            yield (',' if count else '') + json.dumps(ChronologyService.pack_item(row), ensure_ascii=False)
+            last, count = row, count + 1
+
+        next_cursor = encode_cursor([last.date, last.kind, last.id]) if count == limit else None
+        yield '], "next": ' + json.dumps(next_cursor) + '}'
@@ -0,0 +1,127 @@
+from sqlalchemy import Date, Integer, and_, case, column, literal, or_, select, true, values
+from app.models import Commander, CommanderAssignment, MilitaryUnit, UnitHierarchy, db
+from app.services.feed_service import OOB_MAX_DEPTH
+
+# Предел числа пар (командир, дата) в одном запросе API
+MAX_CHAIN_PAIRS = 200
+
+
+def _active_assignment(on_date):
+    return and_(
+        CommanderAssignment.Com_start <= on_date,
+        or_(CommanderAssignment.Com_end.is_(None), CommanderAssignment.Com_end >= on_date)
+    )
+
+
+class CommandChainService:
+    @staticmethod
+    def chains_statement(pairs):
+        """
+        Цепочки командования для пар (commander_id, date) одним рекурсивным запросом.
+        Уровень 0 — подразделение, которым командир командовал на дату,
+        далее — его родители по UnitHierarchy на ту же дату и их командиры.
+        Как и MilitaryUnit.get_parent_at_date, из нескольких действующих
+        записей берётся начавшаяся позже всех (LATERAL ... LIMIT 1).
+        Строки: pair, level, unit_id, unit_name, commander_id, first_name, last_name.
+        """
+        pairs_table = values(
+            column('pair', Integer), column('commander_id', Integer), column('on_date', Date),
+            name='pairs'
+        ).data([(i, commander_id, on_date) for i, (commander_id, on_date) in enumerate(pairs)])
+
+        own_unit = select(CommanderAssignment.unit_id)\
+            .where(CommanderAssignment.commander_id == pairs_table.c.commander_id,
+                   _active_assignment(pairs_table.c.on_date))\
+            .order_by(CommanderAssignment.Com_start.desc(), CommanderAssignment.id.desc())\
+            .limit(1).lateral('own_unit')
+
+        chain = select(
+            pairs_table.c.pair,
+            pairs_table.c.on_date,
+            pairs_table.c.commander_id.label('own_commander_id'),
+            own_unit.c.unit_id,
+            literal(0).label('level')
+        ).select_from(pairs_table).join(own_unit, true()).cte('chain', recursive=True)
+
+        parent = select(UnitHierarchy.parent_unit_id)\
+            .where(UnitHierarchy.unit_id == chain.c.unit_id,
+                   UnitHierarchy.start_date <= chain.c.on_date,
+                   or_(UnitHierarchy.end_date.is_(None), UnitHierarchy.end_date >= chain.c.on_date))\
+            .order_by(UnitHierarchy.start_date.desc())\
+            .limit(1).lateral('parent')
+
+        chain = chain.union_all(
+            select(
+                chain.c.pair,
+                chain.c.on_date,
+                chain.c.own_commander_id,
+                parent.c.parent_unit_id,
+                chain.c.level + 1
+            ).select_from(chain).join(parent, true())
+             .where(chain.c.level < OOB_MAX_DEPTH)
+        )
+
+        unit_commander = select(CommanderAssignment.commander_id)\
+            .where(CommanderAssignment.unit_id == chain.c.unit_id,
+                   _active_assignment(chain.c.on_date))\
+            .order_by(CommanderAssignment.Com_start.desc(), CommanderAssignment.id.desc())\
+            .limit(1).lateral('unit_commander')
+
+        # На нулевом уровне командир — сам запрошенный, даже если у
+        # подразделения одновременно записано несколько командиров
+        commander_id = case(
+            (chain.c.level == 0, chain.c.own_commander_id),
+            else_=unit_commander.c.commander_id
+        ).label('commander_id')
+
+        return select(
+            chain.c.pair,
+            chain.c.level,
+            chain.c.unit_id,
+            MilitaryUnit.name.label('unit_name'),
+            commander_id,
+            Commander.first_name,
+            Commander.last_name
+        ).select_from(chain)\
+         .join(MilitaryUnit, MilitaryUnit.id == chain.c.unit_id)\
+         .outerjoin(unit_commander, true())\
+         .outerjoin(Commander, Commander.id == commander_id)\
+         .order_by(chain.c.pair, chain.c.level)
+
+    @staticmethod
+    def pack_chains(rows, pair_count):
+        """Строки chains_statement -> список цепочек по порядку пар (пустая — нет назначения)"""
+        chains = [[] for _ in range(pair_count)]
+        for row in rows:
+            chains[row.pair].append({
+                'level': row.level,
+                'unit_id': row.unit_id,
+                'unit_name': row.unit_name,
+                'commander_id': row.commander_id,
+                'commander_name': f'{row.last_name} {row.first_name}' if row.last_name else None,
+            })
+        return chains
+
+    @staticmethod
+    def resolve(pairs):
+        """
+        Цепочки командования для списка пар (commander_id, date).
+        Возвращает список той же длины: для каждой пары — уровни от
+        собственного подразделения командира вверх по иерархии.
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return []
+        rows = db.session.execute(CommandChainService.chains_statement(pairs)).all()
+        return CommandChainService.pack_chains(rows, len(pairs))
+
+    @staticmethod
+    def superiors(chain):
+        """Вышестоящие командиры цепочки снизу вверх (без повторов и без самого командира)"""
+        own_id = chain[0]['commander_id'] if chain else None
+        result, seen = [], {own_id}
+        for level in chain[1:]:
+            if level['commander_id'] is not None and level['commander_id'] not in seen:
+                seen.add(level['commander_id'])
+                result.append(level)
+        return result
@@ -1,18 +1,25 @@
 from datetime import date
-from app.models import Commander, CommanderRank, MilitaryRank, db
+from sqlalchemy import distinct, func, select, true, union, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import joinedload
+from app.models import (Battle, Battleparticipations, Commander, CommanderAssignment, CommanderRank,
+                        CommanderStats, MilitaryRank, db)
 
 class CommanderService:
     @staticmethod
     def add_rank_to_commander(commander_id, rank_id, promotion_date=None):
         """Добавляет звание командиру с указанной датой"""
         promotion_date = promotion_date or date.today()
-        
+
         assignment = CommanderRank(
             commander_id=commander_id,
             rank_id=rank_id,
             date_promoted=promotion_date
         )
         db.session.add(assignment)
+        db.session.flush()
+        CommanderService.sync_current_rank([commander_id])
+        CommanderService.sync_stats([commander_id])
         db.session.commit()
         return assignment
 
@@ -21,6 +28,129 @@ class CommanderService:
         """Получить историю званий с информацией о званиях"""
         return db.session.query(CommanderRank).\
             join(MilitaryRank).\
+            options(joinedload(CommanderRank.rank).joinedload(MilitaryRank.country)).\
             filter(CommanderRank.commander_id == commander_id).\
             order_by(CommanderRank.date_promoted.desc()).\
-            all()
\ No newline at end of file
+            all()
+
+    @staticmethod
+    def _latest_rank_query(commander_ids=None):
+        """Последняя запись CommanderRank для каждого командира (DISTINCT ON)"""
+        query = select(CommanderRank.id, CommanderRank.commander_id)\
+            .distinct(CommanderRank.commander_id)\
+            .order_by(CommanderRank.commander_id,
+                      CommanderRank.date_promoted.desc(),
+                      CommanderRank.id.desc())
+        if commander_ids is not None:
+            query = query.where(CommanderRank.commander_id.in_(commander_ids))
+        return query
+
+    @staticmethod
+    def sync_current_rank(commander_ids=None):
+        """
+        Обновляет денормализованный указатель Commander.rank_id на последнюю
+        запись истории званий. Без аргументов пересчитывает всех командиров.
+        """
+        if commander_ids is not None:
+            commander_ids = list(commander_ids)
+
+        latest = CommanderService._latest_rank_query(commander_ids).subquery()
+        point_to_latest = update(Commander)\
+            .where(Commander.id == latest.c.commander_id,
+                   Commander.rank_id.is_distinct_from(latest.c.id))\
+            .values(rank_id=latest.c.id)
+
+        # Командиры, у которых не осталось записей о званиях
+        has_ranks = select(CommanderRank.id)\
+            .where(CommanderRank.commander_id == Commander.id)\
+            .exists()
+        clear_stale = update(Commander)\
+            .where(Commander.rank_id.isnot(None), ~has_ranks)\
+            .values(rank_id=None)
+        if commander_ids is not None:
+            clear_stale = clear_stale.where(Commander.id.in_(commander_ids))
+
+        for stmt in (point_to_latest, clear_stale):
+            db.session.execute(stmt.execution_options(synchronize_session=False))
+
+    @staticmethod
+    def stats_statement(commander_ids=None):
+        """
+        Пересчёт commander_stats одним запросом: для каждого командира три
+        LATERAL-подзапроса (сражения, высшее звание, текущее командование),
+        результат — INSERT ... ON CONFLICT DO UPDATE.
+        """
+        battles = select(
+            func.count(distinct(Battleparticipations.battle_id)).label('battles_count'),
+            func.min(Battle.date_begin).label('first_battle'),
+            func.max(Battle.date_begin).label('last_battle')
+        ).join(Battle, Battle.id == Battleparticipations.battle_id)\
+         .where(Battleparticipations.commander_id == Commander.id)\
+         .lateral('battles')
+
+        top_rank = select(CommanderRank.rank_id, MilitaryRank.rank_level)\
+            .join(MilitaryRank, MilitaryRank.id == CommanderRank.rank_id)\
+            .where(CommanderRank.commander_id == Commander.id)\
+            .order_by(MilitaryRank.rank_level.desc().nulls_last(), CommanderRank.date_promoted.desc())\
+            .limit(1).lateral('top_rank')
+
+        command = select(CommanderAssignment.unit_id)\
+            .where(CommanderAssignment.commander_id == Commander.id)\
+            .order_by(CommanderAssignment.Com_end.is_(None).desc(),
+                      CommanderAssignment.Com_start.desc(),
+                      CommanderAssignment.id.desc())\
+            .limit(1).lateral('command')
+
+        source = select(
+            Commander.id,
+            battles.c.battles_count,
+            battles.c.first_battle,
+            battles.c.last_battle,
+            top_rank.c.rank_id,
+            func.coalesce(top_rank.c.rank_level, 0),
+            command.c.unit_id,
+            func.now()
+        ).select_from(Commander)\
+         .join(battles, true())\
+         .outerjoin(top_rank, true())\
+         .outerjoin(command, true())
+        if commander_ids is not None:
+            source = source.where(Commander.id.in_(commander_ids))
+
+        columns = ['commander_id', 'battles_count', 'first_battle', 'last_battle',
+                   'top_rank_id', 'top_rank_level', 'current_unit_id', 'updated_at']
+        stmt = insert(CommanderStats).from_select(columns, source)
+        return stmt.on_conflict_do_update(
+            index_elements=[CommanderStats.commander_id],
+            set_={column: stmt.excluded[column] for column in columns[1:]}
+        )
+
+    @staticmethod
+    def sync_stats(commander_ids=None):
+        """
+        Обновляет итоги карьеры (commander_stats) указанных командиров в
+        текущей транзакции. Без аргументов пересчитывает всех.
+        """
+        if commander_ids is not None:
+            commander_ids = [i for i in set(commander_ids) if i is not None]
+            if not commander_ids:
+                return
+        db.session.execute(CommanderService.stats_statement(commander_ids))
+
+    @staticmethod
+    def battle_commander_ids(battle_id):
+        """Командиры, чьи итоги зависят от сражения"""
+        return set(db.session.scalars(
+            select(Battleparticipations.commander_id)
+            .where(Battleparticipations.battle_id == battle_id,
+                   Battleparticipations.commander_id.isnot(None))
+        ))
+
+    @staticmethod
+    def unit_commander_ids(unit_id):
+        """Командиры, чьи итоги зависят от подразделения: назначения и участия"""
+        return set(db.session.scalars(union(
+            select(CommanderAssignment.commander_id).where(CommanderAssignment.unit_id == unit_id),
+            select(Battleparticipations.commander_id).where(Battleparticipations.unit_id == unit_id,
+                                                            Battleparticipations.commander_id.isnot(None))
+        )))
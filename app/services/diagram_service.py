@@ -0,0 +1,368 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import or_
+from werkzeug.utils import secure_filename
+from app.models import BattleDiagram, db
+
+CHUNK_SIZE = 64 * 1024
+
+# Пул фоновых потоков для конвертации (создаётся при первой загрузке)
+_executor = None
+
+
+def _get_executor(app):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=app.config.get('DIAGRAM_WORKERS', 2),
+            thread_name_prefix='diagram-worker'
+        )
+    return _executor
+
+
+def reset_executor():
+    """После fork потоки пула родителя недоступны — пул создаётся заново"""
+    global _executor
+    _executor = None
+
+
+def diagrams_folder():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'battle_diagrams')
+
+
+def variant_path(folder, content_hash, width, fmt):
+    """Варианты хранятся по хэшу содержимого: одинаковые файлы конвертируются один раз"""
+    return os.path.join(folder, 'variants', content_hash, f'{width}.{fmt}')
+
+
+def tiles_path(folder, content_hash):
+    return os.path.join(folder, 'variants', content_hash, 'tiles')
+
+
+def tile_max_level(width, height):
+    """Номер уровня полного разрешения в пирамиде DZI: ceil(log2(max(w, h)))"""
+    return (max(width, height, 1) - 1).bit_length()
+
+
+def supported_formats(formats):
+    from PIL import features
+    return [fmt for fmt in formats if features.check(fmt)]
+
+
+class DiagramService:
+    @staticmethod
+    def save_upload(battle_id, file, description=None, is_main=False):
+        """
+        Сохраняет загруженную схему: файл пишется потоком с подсчётом sha256,
+        дубликат уже загруженного файла не сохраняется повторно. Размеры
+        читаются из заголовка изображения, а миниатюры и WebP/AVIF-варианты
+        строятся в фоновом пуле — запрос не ждёт конвертации.
+        """
+        folder = diagrams_folder()
+        os.makedirs(folder, exist_ok=True)
+
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            content_hash = digest.hexdigest()
+
+            duplicate = BattleDiagram.query.filter_by(content_hash=content_hash).first()
+            if duplicate and os.path.exists(os.path.join(folder, duplicate.filename)):
+                os.remove(tmp_path)
+                filename = duplicate.filename
+            else:
+                filename = secure_filename(f"battle_{battle_id}_{uuid.uuid4().hex[:8]}_{file.filename}")
+                os.replace(tmp_path, os.path.join(folder, filename))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        width, height = DiagramService.read_dimensions(os.path.join(folder, filename))
+
+        # Если отмечаем как основную, снимаем флаг у других
+        if is_main:
+            BattleDiagram.query.filter_by(battle_id=battle_id).update({'is_main': False})
+
+        # Варианты и тайлы дубликата переиспользуются, только если они достроены:
+        # иначе статус копии так и остался бы pending. Незавершённое строится
+        # фоновой задачей заново, уже готовые файлы она пропускает
+        reuse = duplicate is not None and duplicate.variants_status == 'ready' and (
+            duplicate.tiles_status == 'ready' or not DiagramService.needs_tiles(duplicate))
+
+        diagram = BattleDiagram(
+            battle_id=battle_id,
+            filename=filename,
+            description=description,
+            is_main=is_main,
+            width=width,
+            height=height,
+            size_bytes=size,
+            content_hash=content_hash,
+            variants_status='ready' if reuse else 'pending',
+            tiles_status=duplicate.tiles_status if reuse else None
+        )
+        db.session.add(diagram)
+        db.session.commit()
+
+        if diagram.variants_status != 'ready':
+            DiagramService.schedule_variants(diagram.id)
+        return diagram
+
+    @staticmethod
+    def read_dimensions(path):
+        """Размеры изображения (Pillow читает только заголовок файла)"""
+        try:
+            from PIL import Image
+            with Image.open(path) as image:
+                return image.size
+        except Exception as e:
+            current_app.logger.warning(f"Не удалось прочитать размеры {path}: {e}")
+            return None, None
+
+    @staticmethod
+    def fill_metadata(diagram):
+        """
+        Дополняет хэш, размер и габариты схем, загруженных до появления этих
+        колонок. Возвращает False, если файла схемы нет.
+        """
+        path = os.path.join(diagrams_folder(), diagram.filename)
+        if not os.path.exists(path):
+            return False
+        if not diagram.content_hash:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as source:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            diagram.content_hash = digest.hexdigest()
+            diagram.size_bytes = os.path.getsize(path)
+        if not diagram.width or not diagram.height:
+            diagram.width, diagram.height = DiagramService.read_dimensions(path)
+        return True
+
+    @staticmethod
+    def unprocessed_query(include_failed=False):
+        """Схемы без вариантов или тайлов: загруженные до конвейера обработки (статус NULL)"""
+        statuses = [BattleDiagram.variants_status.is_(None), BattleDiagram.tiles_status.is_(None)]
+        if include_failed:
+            statuses += [BattleDiagram.variants_status == 'failed', BattleDiagram.tiles_status == 'failed']
+        return BattleDiagram.query.filter(or_(*statuses)).order_by(BattleDiagram.id)
+
+    @staticmethod
+    def needs_processing(diagram):
+        """Есть ли что строить: варианты не готовы или не готовы нужные тайлы"""
+        if diagram.variants_status != 'ready':
+            return True
+        return diagram.tiles_status != 'ready' and DiagramService.needs_tiles(diagram)
+
+    @staticmethod
+    def process_unprocessed(include_failed=False):
+        """
+        Строит варианты и тайлы схем из unprocessed_query в текущем процессе
+        (команда flask battles process-diagrams). Возвращает счётчики
+        {'processed', 'skipped', 'missing'}.
+        """
+        app = current_app._get_current_object()
+        counts = {'processed': 0, 'skipped': 0, 'missing': 0}
+        query = DiagramService.unprocessed_query(include_failed).with_entities(BattleDiagram.id)
+        for diagram_id in [row.id for row in query]:
+            diagram = db.session.get(BattleDiagram, diagram_id)
+            if not DiagramService.fill_metadata(diagram):
+                app.logger.warning(f"Файл схемы {diagram_id} не найден: {diagram.filename}")
+                counts['missing'] += 1
+                continue
+            if not DiagramService.needs_processing(diagram):
+                counts['skipped'] += 1
+                db.session.commit()
+                continue
+            db.session.commit()
+            DiagramService._build_variants_job(app, diagram_id)
+            counts['processed'] += 1
+        return counts
+
+    @staticmethod
+    def schedule_variants(diagram_id):
+        app = current_app._get_current_object()
+        return _get_executor(app).submit(DiagramService._build_variants_job, app, diagram_id)
+
+    @staticmethod
+    def _build_variants_job(app, diagram_id):
+        with app.app_context():
+            diagram = db.session.get(BattleDiagram, diagram_id)
+            if diagram is None:
+                return
+            try:
+                DiagramService.build_variants(diagram)
+                diagram.variants_status = 'ready'
+            except Exception as e:
+                app.logger.error(f"Ошибка обработки схемы {diagram_id}: {e}")
+                diagram.variants_status = 'failed'
+            db.session.commit()
+
+            if DiagramService.needs_tiles(diagram):
+                diagram.tiles_status = 'pending'
+                db.session.commit()
+                try:
+                    DiagramService.build_tiles(diagram)
+                    diagram.tiles_status = 'ready'
+                except Exception as e:
+                    app.logger.error(f"Ошибка построения тайлов схемы {diagram_id}: {e}")
+                    diagram.tiles_status = 'failed'
+                db.session.commit()
+            db.session.remove()
+
+    @staticmethod
+    def build_variants(diagram):
+        """Миниатюры по корзинам ширины в каждом поддерживаемом формате"""
+        from PIL import Image, ImageOps
+
+        folder = diagrams_folder()
+        widths = current_app.config.get('DIAGRAM_WIDTHS', (320, 640, 1280))
+        formats = supported_formats(current_app.config.get('DIAGRAM_FORMATS', ('webp',)))
+
+        with Image.open(os.path.join(folder, diagram.filename)) as source:
+            source = ImageOps.exif_transpose(source)
+            if source.mode not in ('RGB', 'RGBA'):
+                source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+            for width in widths:
+                if diagram.width and width > diagram.width and width != min(widths):
+                    continue  # не увеличиваем изображение
+                resized = source.copy()
+                resized.thumbnail((width, width * 10), Image.LANCZOS)
+                for fmt in formats:
+                    path = variant_path(folder, diagram.content_hash, width, fmt)
+                    if os.path.exists(path):
+                        continue
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+                    resized.save(tmp_path, format=fmt.upper(), quality=80)
+                    os.replace(tmp_path, path)
+
+    @staticmethod
+    def needs_tiles(diagram):
+        """Тайлы строятся только для крупных сканов"""
+        if not diagram.width or not diagram.height:
+            return False
+        return diagram.width * diagram.height >= current_app.config.get('DIAGRAM_TILE_MIN_PIXELS', 4_000_000)
+
+    @staticmethod
+    def tile_info(diagram):
+        """Описание пирамиды для просмотрщика (в терминах DZI)"""
+        return {
+            'width': diagram.width,
+            'height': diagram.height,
+            'tileSize': current_app.config.get('DIAGRAM_TILE_SIZE', 256),
+            'tileOverlap': 0,
+            'maxLevel': tile_max_level(diagram.width, diagram.height),
+            'format': 'jpg',
+        }
+
+    @staticmethod
+    def build_tiles(diagram):
+        """
+        Нарезает пирамиду тайлов: от полного разрешения вниз, каждый следующий
+        уровень получается уменьшением предыдущего вдвое (Image.reduce),
+        поэтому полноразмерное изображение масштабируется только один раз.
+        """
+        from PIL import Image, ImageOps
+
+        folder = diagrams_folder()
+        tile_size = current_app.config.get('DIAGRAM_TILE_SIZE', 256)
+        root = tiles_path(folder, diagram.content_hash)
+        if os.path.exists(os.path.join(root, 'complete')):
+            return  # тот же файл уже нарезан для другой записи
+
+        with Image.open(os.path.join(folder, diagram.filename)) as source:
+            level_image = ImageOps.exif_transpose(source).convert('RGB')
+
+        level = tile_max_level(*level_image.size)
+        while level >= 0:
+            level_dir = os.path.join(root, str(level))
+            os.makedirs(level_dir, exist_ok=True)
+            width, height = level_image.size
+            for x in range(0, (width + tile_size - 1) // tile_size):
+                for y in range(0, (height + tile_size - 1) // tile_size):
+                    box = (x * tile_size, y * tile_size,
+                           min((x + 1) * tile_size, width), min((y + 1) * tile_size, height))
+                    level_image.crop(box).save(os.path.join(level_dir, f'{x}_{y}.jpg'), format='JPEG', quality=85)
+
+            level -= 1
+            if level >= 0:
+                # reduce() округляет размер вверх, как и DZI
+                level_image = level_image.reduce(2)
+
+        open(os.path.join(root, 'complete'), 'w').close()
+
+    @staticmethod
+    def tile_file(diagram, level, x, y):
+        """Путь к тайлу или None, если пирамида не готова или тайла нет"""
+        if diagram.tiles_status != 'ready' or not diagram.content_hash:
+            return None
+        path = os.path.join(tiles_path(diagrams_folder(), diagram.content_hash), str(level), f'{x}_{y}.jpg')
+        return path if os.path.exists(path) else None
+
+    @staticmethod
+    def pick_variant(diagram, width=None, fmt=None, accept=None):
+        """
+        Путь к наиболее подходящему готовому варианту или None.
+        Ширина округляется вверх до ближайшей корзины, формат выбирается
+        явно или по заголовку Accept.
+        """
+        if diagram.variants_status != 'ready' or not diagram.content_hash:
+            return None
+
+        folder = diagrams_folder()
+        widths = sorted(current_app.config.get('DIAGRAM_WIDTHS', (320, 640, 1280)))
+        if fmt:
+            formats = [fmt]
+        else:
+            formats = [f for f in current_app.config.get('DIAGRAM_FORMATS', ('webp',))
+                       if f'image/{f}' in (accept or '')]
+
+        if width is None:
+            candidates = widths[::-1]
+        else:
+            # Сначала ближайшая корзина не меньше запрошенной, затем меньшие
+            candidates = [w for w in widths if w >= width] + [w for w in widths[::-1] if w < width]
+
+        for candidate in candidates:
+            for variant_fmt in formats:
+                path = variant_path(folder, diagram.content_hash, candidate, variant_fmt)
+                if os.path.exists(path):
+                    return path
+        return None
+
+    @staticmethod
+    def delete(diagram):
+        """Удаляет запись; файл и варианты — только если на них больше никто не ссылается"""
+        folder = diagrams_folder()
+        still_used = BattleDiagram.query.filter(
+            BattleDiagram.id != diagram.id,
+            BattleDiagram.filename == diagram.filename
+        ).count()
+
+        db.session.delete(diagram)
+        db.session.commit()
+
+        if still_used:
+            return
+        try:
+            filepath = os.path.join(folder, diagram.filename)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            if diagram.content_hash:
+                shutil.rmtree(os.path.join(folder, 'variants', diagram.content_hash), ignore_errors=True)
+        except Exception as e:
+            current_app.logger.error(f"Error deleting diagram file: {e}")
@@ -0,0 +1,118 @@
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import cast, delete, insert, update
+from sqlalchemy.dialects.postgresql import JSONB
+from app.models import Battle, BattleDraft, BattleLosses, Battleparticipations, Trophy, db
+from app.services.commander_service import CommanderService
+
+# Разделы черновика мастера добавления сражения
+DRAFT_SECTIONS = ('battle', 'participations', 'losses', 'trophies')
+
+
+def _model_fields(model, data):
+    """Оставляет только ключи, соответствующие колонкам модели"""
+    columns = model.__table__.columns.keys()
+    return {key: value for key, value in data.items() if key in columns and key != 'id'}
+
+
+class BattleDraftService:
+    @staticmethod
+    def create():
+        """Новый пустой черновик; заодно удаляет просроченные"""
+        BattleDraftService.purge_expired()
+        draft = BattleDraft(id=uuid.uuid4().hex, data={})
+        db.session.add(draft)
+        db.session.commit()
+        return draft.id
+
+    @staticmethod
+    def get(draft_id):
+        """Данные черновика или None, если черновик не найден"""
+        if not draft_id:
+            return None
+        draft = db.session.get(BattleDraft, draft_id)
+        return dict(draft.data) if draft else None
+
+    @staticmethod
+    def patch(draft_id, **sections):
+        """
+        Сохраняет изменённые разделы черновика. Обновление выполняется
+        на стороне БД оператором jsonb ||, поэтому передаются только
+        новые разделы, а не весь черновик. ValueError — неизвестный раздел
+        или потери без страны.
+        """
+        unknown = set(sections) - set(DRAFT_SECTIONS)
+        if unknown:
+            raise ValueError(f"Неизвестные разделы черновика: {', '.join(sorted(unknown))}")
+        losses = sections.get('losses') or {}
+        if not losses.get('country_id') and any(value for key, value in losses.items() if key != 'country_id'):
+            # Запись потерь привязана к стране: без неё commit не смог бы их сохранить
+            raise ValueError('Укажите страну, понёсшую потери, иначе потери не будут сохранены')
+
+        result = db.session.execute(
+            update(BattleDraft)
+            .where(BattleDraft.id == draft_id)
+            .values(
+                data=BattleDraft.data.op('||')(cast(sections, JSONB)),
+                updated_at=datetime.utcnow()
+            )
+        )
+        db.session.commit()
+        return result.rowcount > 0
+
+    @staticmethod
+    def commit(draft_id):
+        """
+        Создаёт сражение из черновика в одной транзакции: участники и трофеи
+        вставляются пакетно (executemany), итоги командиров пересчитываются,
+        черновик удаляется.
+        """
+        data = BattleDraftService.get(draft_id)
+        if data is None or not data.get('battle'):
+            raise ValueError('Черновик сражения не найден')
+
+        try:
+            battle = Battle(**_model_fields(Battle, data['battle']))
+            db.session.add(battle)
+            db.session.flush()  # Получаем battle.id
+
+            participations = [
+                dict(_model_fields(Battleparticipations, p), battle_id=battle.id)
+                for p in data.get('participations', [])
+            ]
+            if participations:
+                db.session.execute(insert(Battleparticipations), participations)
+
+            trophies = [
+                dict(_model_fields(Trophy, t), battle_id=battle.id)
+                for t in data.get('trophies', [])
+            ]
+            if trophies:
+                db.session.execute(insert(Trophy), trophies)
+
+            # Потери без страны patch не принимает; пустой раздел записи не создаёт
+            losses = _model_fields(BattleLosses, data.get('losses') or {})
+            if losses.get('country_id'):
+                db.session.add(BattleLosses(battle_id=battle.id, **losses))
+
+            CommanderService.sync_stats(CommanderService.battle_commander_ids(battle.id))
+            db.session.execute(delete(BattleDraft).where(BattleDraft.id == draft_id))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return battle
+
+    @staticmethod
+    def discard(draft_id):
+        if draft_id:
+            db.session.execute(delete(BattleDraft).where(BattleDraft.id == draft_id))
+            db.session.commit()
+
+    @staticmethod
+    def purge_expired():
+        ttl = current_app.config.get('BATTLE_DRAFT_TTL', 7 * 24 * 3600)
+        db.session.execute(
+            delete(BattleDraft).where(BattleDraft.updated_at < datetime.utcnow() - timedelta(seconds=ttl))
+        )
@@ -0,0 +1,129 @@
+from sqlalchemy import Integer, and_, cast, func, literal, or_, select
+from sqlalchemy.orm import aliased
+from app.models import Event, MilitaryUnit, Place, UnitHierarchy, UnitMovement
+from app.services.battle_service import date_to_epoch
+
+# Предел глубины дерева подчинённости (защита от циклов в истории)
+OOB_MAX_DEPTH = 20
+
+
+def _coord(value):
+    return round(value, 5) if value is not None else None
+
+
+class FeedService:
+    """
+    Запросы и упаковка JSON-лент только для чтения (события, перемещения,
+    структура подчинённости). Запросы строятся как select(), поэтому одни и
+    те же выражения выполняются и синхронной сессией Flask, и асинхронным
+    движком (app.asgi).
+    """
+
+    @staticmethod
+    def events_statement(date_from=None, date_to=None):
+        stmt = select(
+            Event.id,
+            Event.event,
+            Event.date,
+            Place.name.label('place_name'),
+            func.ST_X(Place.geom).label('lon'),
+            func.ST_Y(Place.geom).label('lat')
+        ).join(Place, Event.place_id == Place.id)
+
+        if date_from:
+            stmt = stmt.where(Event.date >= date_from)
+        if date_to:
+            stmt = stmt.where(Event.date <= date_to)
+        return stmt.order_by(Event.date, Event.id)
+
+    @staticmethod
+    def pack_events(rows):
+        return [{
+            'id': row.id,
+            'event': row.event,
+            'date': row.date.isoformat() if row.date else None,
+            'timestamp': date_to_epoch(row.date),
+            'place_name': row.place_name,
+            'lon': _coord(row.lon),
+            'lat': _coord(row.lat),
+        } for row in rows]
+
+    @staticmethod
+    def movements_statement(unit_id=None, date_from=None, date_to=None):
+        start_place = aliased(Place)
+        end_place = aliased(Place)
+        stmt = select(
+            UnitMovement.id,
+            UnitMovement.date,
+            UnitMovement.unit_id,
+            UnitMovement.distance_km,
+            func.ST_X(start_place.geom).label('start_lon'),
+            func.ST_Y(start_place.geom).label('start_lat'),
+            func.ST_X(end_place.geom).label('end_lon'),
+            func.ST_Y(end_place.geom).label('end_lat')
+        ).join(start_place, UnitMovement.start_place_id == start_place.id)\
+         .join(end_place, UnitMovement.end_place_id == end_place.id)
+
+        if unit_id:
+            stmt = stmt.where(UnitMovement.unit_id == unit_id)
+        if date_from:
+            stmt = stmt.where(UnitMovement.date >= date_from)
+        if date_to:
+            stmt = stmt.where(UnitMovement.date <= date_to)
+        return stmt.order_by(UnitMovement.date, UnitMovement.id)
+
+    @staticmethod
+    def pack_movements(rows):
+        return [{
+            'id': row.id,
+            'date': row.date.isoformat() if row.date else None,
+            'unit_id': row.unit_id,
+            'distance_km': row.distance_km,
+            'from': [_coord(row.start_lon), _coord(row.start_lat)],
+            'to': [_coord(row.end_lon), _coord(row.end_lat)],
+        } for row in rows]
+
+    @staticmethod
+    def oob_statement(root_id, on_date):
+        """
+        Дерево подчинённости подразделения на дату одним рекурсивным запросом:
+        (id, name, parent_id, depth) в порядке обхода в ширину.
+        """
+        active = and_(
+            UnitHierarchy.start_date <= on_date,
+            or_(UnitHierarchy.end_date.is_(None), UnitHierarchy.end_date >= on_date)
+        )
+
+        tree = select(
+            MilitaryUnit.id.label('id'),
+            cast(None, Integer).label('parent_id'),
+            literal(0).label('depth')
+        ).where(MilitaryUnit.id == root_id).cte('oob', recursive=True)
+
+        tree = tree.union_all(
+            select(
+                UnitHierarchy.unit_id,
+                UnitHierarchy.parent_unit_id,
+                tree.c.depth + 1
+            ).join(tree, UnitHierarchy.parent_unit_id == tree.c.id)
+             .where(active, tree.c.depth < OOB_MAX_DEPTH)
+        )
+
+        return select(tree.c.id, MilitaryUnit.name, tree.c.parent_id, tree.c.depth)\
+            .join(MilitaryUnit, MilitaryUnit.id == tree.c.id)\
+            .order_by(tree.c.depth, MilitaryUnit.name)
+
+    @staticmethod
+    def pack_oob(rows):
+        """Плоские строки дерева -> вложенная структура {id, name, children}"""
+        nodes = {}
+        root = None
+        for row in rows:
+            if row.id in nodes:
+                continue  # подразделение уже встречалось выше по дереву
+            node = nodes[row.id] = {'id': row.id, 'name': row.name, 'children': []}
+            if row.parent_id is None:
+                root = node
+            elif row.parent_id in nodes:
+                nodes[row.parent_id]['children'].append(node)
+        return root
@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import struct
+import time
+import uuid
+
+import numpy as np
+from flask import current_app
+from app.services.position_service import PositionService, date_to_day
+
+# Кадров в одном окне — единице кэширования и потоковой передачи
+WINDOW_FRAMES = 32
+
+# Заголовок: магия, флаги, кадров в окне, число подразделений, число кадров,
+# первые сутки (от 1970-01-01), шаг в сутках. Little-endian.
+# Размер окна передаётся клиенту: от него зависит восстановление дельта-кадров
+HEADER = struct.Struct('<4sHHIIiI')
+MAGIC = b'UPF1'
+FLAG_DELTA = 1
+
+
+def frames_folder():
+    # Не в UPLOAD_FOLDER: он раздаётся как статика, а кадры отдаются только через API
+    return current_app.config.get('POSITION_FRAMES_DIR') or os.path.join(current_app.instance_path, 'position_frames')
+
+
+def window_path(folder, version, step, delta, window):
+    """Окна хранятся по версии хронологии: изменённые данные — новый каталог"""
+    return os.path.join(folder, version, f'{step}{"d" if delta else "a"}', f'{window}.bin')
+
+
+def window_range(date_from, date_to, step):
+    """Номера окон, покрывающих интервал; окна выровнены по сетке от 1970-01-01"""
+    days_per_window = WINDOW_FRAMES * step
+    return range(date_to_day(date_from) // days_per_window, date_to_day(date_to) // days_per_window + 1)
+
+
+def encode_window(lon, lat, delta=False):
+    """
+    Кадры окна (массивы формы кадры x подразделения) -> Float32 lon/lat
+    попарно для каждого подразделения. NaN — подразделения нет на карте.
+    В дельта-режиме первый кадр окна абсолютный, остальные — разность с
+    предыдущим (отсутствующее значение считается нулём), поэтому стоящие
+    подразделения дают нули и хорошо сжимаются при передаче.
+    """
+    frames = np.empty((lon.shape[0], lon.shape[1], 2), dtype=np.float32)
+    frames[:, :, 0] = lon
+    frames[:, :, 1] = lat
+    if delta and len(frames) > 1:
+        previous = np.nan_to_num(frames[:-1], nan=0.0)
+        frames[1:] = frames[1:] - previous
+    return frames.astype('<f4').tobytes()
+
+
+class FrameService:
+    """
+    Кадры анимации кампании в двоичном виде. Окна по WINDOW_FRAMES кадров
+    считаются из PositionTimeline один раз и хранятся на диске, ответ
+    собирается потоком из файлов окон — память не растёт с длиной интервала.
+
+    Формат ответа:
+      HEADER; Int32 id подразделений; Uint32 длина + UTF-8 JSON имён
+      (дополнен пробелами до кратности 4); кадры Float32 [lon, lat] * N.
+    Кадры покрывают целые окна, первые сутки и число кадров — в заголовке.
+    """
+
+    @staticmethod
+    def header(timeline, first_day, frame_count, step, delta):
+        names = json.dumps(timeline.unit_names, ensure_ascii=False).encode('utf-8')
+        names += b' ' * (-len(names) % 4)  # Float32Array требует выравнивания
+        return b''.join([
+            HEADER.pack(MAGIC, FLAG_DELTA if delta else 0, WINDOW_FRAMES, len(timeline), frame_count, first_day, step),
+            np.asarray(timeline.unit_ids, dtype='<i4').tobytes(),
+            struct.pack('<I', len(names)),
+            names
+        ])
+
+    @staticmethod
+    def window_file(timeline, window, step, delta):
+        """Путь к файлу окна; окно считается и записывается при первом обращении"""
+        folder = frames_folder()
+        path = window_path(folder, timeline.version, step, delta, window)
+        if os.path.exists(path):
+            return path
+
+        first_day = window * WINDOW_FRAMES * step
+        lon, lat = timeline.positions(np.arange(WINDOW_FRAMES, dtype=np.float64) * step + first_day)
+
+        if not os.path.isdir(os.path.join(folder, timeline.version)):
+            FrameService.purge_stale(timeline.version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_window(lon, lat, delta))
+        os.replace(tmp_path, path)
+        return path
+
+    @staticmethod
+    def stream(timeline, date_from, date_to, step=1, delta=False):
+        """
+        Генератор частей ответа: заголовок, затем окна по одному.
+        Хронология передаётся снаружи, поэтому все окна одной версии.
+        """
+        windows = window_range(date_from, date_to, step)
+        yield FrameService.header(timeline, windows[0] * WINDOW_FRAMES * step,
+                                  len(windows) * WINDOW_FRAMES, step, delta)
+        for window in windows:
+            with open(FrameService.window_file(timeline, window, step, delta), 'rb') as f:
+                yield f.read()
+
+    @staticmethod
+    def precompute(step=1, delta=False):
+        """Считает все окна хронологии заранее; возвращает число окон"""
+        timeline = PositionService.get_timeline()
+        if not len(timeline):
+            return 0
+        days_per_window = WINDOW_FRAMES * step
+        windows = range(int(timeline.day_min) // days_per_window, int(timeline.day_max) // days_per_window + 1)
+        for window in windows:
+            FrameService.window_file(timeline, window, step, delta)
+        FrameService.purge_stale(timeline.version)
+        return len(windows)
+
+    @staticmethod
+    def purge_stale(version, max_age=None):
+        """
+        Удаляет окна прежних версий хронологии. По умолчанию — только те,
+        что не менялись дольше двух сроков жизни хронологии: другие рабочие
+        процессы могут ещё отдавать свою версию из кэша.
+        """
+        folder = frames_folder()
+        if not os.path.isdir(folder):
+            return
+        if max_age is None:
+            max_age = 2 * current_app.config.get('POSITION_TIMELINE_TTL', 300)
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if name != version and time.time() - os.path.getmtime(path) >= max_age:
+                shutil.rmtree(path, ignore_errors=True)
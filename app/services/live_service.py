@@ -0,0 +1,83 @@
+import json
+from flask import current_app
+from sqlalchemy import or_
+from app.models import Battle, Event
+from app.services.battle_service import BattleService
+from app.services.feed_service import FeedService
+
+# Таблицы журнала изменений, влияющие на маркеры карт
+LIVE_TABLES = ('battles', 'events', 'places')
+
+
+def parse_notification(payload):
+    """'таблица:операция:id' из канала журнала -> (таблица, id) или None"""
+    parts = payload.split(':')
+    if len(parts) != 3 or parts[0] not in LIVE_TABLES or not parts[2].isdigit():
+        return None
+    return parts[0], int(parts[2])
+
+
+def live_stream_url():
+    """
+    Адрес SSE-потока для страниц с картой или None, если живые обновления
+    выключены или поток никто не обслуживает (Flask без ASGI-приложения)
+    """
+    config = current_app.config
+    if not (config.get('LIVE_UPDATES_ENABLED', True) and config.get('LIVE_STREAM_SERVED')):
+        return None
+    return config.get('ASYNC_API_PREFIX', '/async').rstrip('/') + '/live'
+
+
+class LiveService:
+    """
+    Изменения для карт сражений и событий: по пачке уведомлений журнала
+    заново читаются затронутые маркеры. Строка, которой больше нет на карте
+    (удалена или осталась без места), отдаётся как удаление; правка места
+    переотправляет все его сражения и события.
+    """
+
+    @staticmethod
+    def collect(notifications):
+        """Уведомления -> {'battles': ids, 'events': ids, 'places': ids}"""
+        changed = {table: set() for table in LIVE_TABLES}
+        for payload in notifications:
+            parsed = parse_notification(payload)
+            if parsed is not None:
+                changed[parsed[0]].add(parsed[1])
+        return changed
+
+    @staticmethod
+    def battles_statement(battle_ids, place_ids):
+        return BattleService.window_statement()\
+            .where(or_(Battle.id.in_(battle_ids), Battle.place_id.in_(place_ids)))
+
+    @staticmethod
+    def events_statement(event_ids, place_ids):
+        return FeedService.events_statement()\
+            .where(or_(Event.id.in_(event_ids), Event.place_id.in_(place_ids)))
+
+    @staticmethod
+    def pack_changes(changed, battle_rows, event_rows):
+        """
+        {'battles': {'upserts': колонки как у /battles/api/window, 'deletes': [id]},
+         'events': {'upserts': [как в ленте событий], 'deletes': [id]}};
+        таблицы без изменений опускаются.
+        """
+        result = {}
+
+        battles = BattleService.pack_window(battle_rows)
+        deletes = sorted(changed['battles'] - set(battles['ids']))
+        if battles['count'] or deletes:
+            result['battles'] = {'upserts': battles, 'deletes': deletes}
+
+        events = FeedService.pack_events(event_rows)
+        deletes = sorted(changed['events'] - {event['id'] for event in events})
+        if events or deletes:
+            result['events'] = {'upserts': events, 'deletes': deletes}
+        return result
+
+    @staticmethod
+    def format_event(name, data=None):
+        """Сообщение SSE; строка формируется один раз на всех клиентов"""
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')) if data is not None else '{}'
+        return f'event: {name}\ndata: {payload}\n\n'
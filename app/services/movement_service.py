@@ -0,0 +1,244 @@
+from geoalchemy2 import Geography
+from sqlalchemy import and_, case, cast, false, func, literal, or_, select, true, union_all, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import aliased
+from app.models import MilitaryUnit, Place, UnitMovement, db
+from app.services.battle_service import parse_window_args
+
+# Сколько строк обновлять за один UPDATE при заполнении маршрутов
+BACKFILL_BATCH_SIZE = 5000
+
+# Ограничения запроса «кто был рядом с местом»
+NEARBY_DEFAULT_RADIUS_KM = 30
+NEARBY_MAX_RADIUS_KM = 500
+
+
+def parse_nearby_args(args):
+    """
+    Параметры /movements/api/nearby: place_id, radius_km, from, to.
+    ValueError — с текстом ошибки для ответа 400.
+    """
+    place_id = args.get('place_id')
+    if not place_id or not str(place_id).isdigit():
+        raise ValueError('place_id обязателен и должен быть числом')
+
+    try:
+        radius_km = float(args.get('radius_km') or NEARBY_DEFAULT_RADIUS_KM)
+    except ValueError:
+        raise ValueError('radius_km должен быть числом')
+    if not 0 < radius_km <= NEARBY_MAX_RADIUS_KM:
+        raise ValueError(f'radius_km должен быть в пределах (0, {NEARBY_MAX_RADIUS_KM}]')
+
+    window = parse_window_args(args)
+    if window['date_from'] and window['date_to'] and window['date_from'] > window['date_to']:
+        raise ValueError('Дата from позже даты to')
+
+    return {
+        'place_id': int(place_id),
+        'radius_km': radius_km,
+        'date_from': window['date_from'],
+        'date_to': window['date_to'],
+    }
+
+
+class MovementService:
+    @staticmethod
+    def _route_update(start_place, end_place, clear_missing=False):
+        """
+        UPDATE ... FROM places: линия маршрута и её длина по эллипсоиду (км).
+        Перемещения, у мест которых нет координат, по умолчанию не трогаются;
+        с clear_missing их маршрут и расстояние обнуляются, чтобы после
+        переноса на место без координат не оставалась прежняя линия.
+        """
+        line = func.ST_MakeLine(start_place.geom, end_place.geom)
+        distance = func.ST_Length(cast(line, Geography(srid=4326))) / 1000.0
+        located = and_(start_place.geom.isnot(None), end_place.geom.isnot(None))
+        stmt = update(UnitMovement)\
+            .where(
+                UnitMovement.start_place_id == start_place.id,
+                UnitMovement.end_place_id == end_place.id
+            )
+        if clear_missing:
+            return stmt.values(route=case((located, line)), distance_km=case((located, distance)))
+        return stmt.where(located).values(route=line, distance_km=distance)
+
+    @staticmethod
+    def update_routes(movement_ids=None, place_id=None):
+        """
+        Пересчитывает маршрут и расстояние для указанных перемещений или для
+        всех перемещений, начинающихся или заканчивающихся в place_id; если
+        у одного из мест нет координат, маршрут и расстояние обнуляются.
+        Выполняется одним UPDATE; коммит — за вызывающим кодом.
+        """
+        start_place = aliased(Place)
+        end_place = aliased(Place)
+        stmt = MovementService._route_update(start_place, end_place, clear_missing=True)
+        if movement_ids is not None:
+            stmt = stmt.where(UnitMovement.id.in_(list(movement_ids)))
+        if place_id is not None:
+            stmt = stmt.where(or_(UnitMovement.start_place_id == place_id,
+                                  UnitMovement.end_place_id == place_id))
+        return db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+
+    @staticmethod
+    def backfill_routes(batch_size=BACKFILL_BATCH_SIZE, only_missing=True):
+        """
+        Заполняет маршруты существующих перемещений пакетами по диапазонам id,
+        чтобы не держать блокировку всей таблицы одной транзакцией.
+        Возвращает число обновлённых строк.
+        """
+        bounds = db.session.execute(select(func.min(UnitMovement.id), func.max(UnitMovement.id))).one()
+        if bounds[0] is None:
+            return 0
+
+        start_place = aliased(Place)
+        end_place = aliased(Place)
+        updated = 0
+        for low in range(bounds[0], bounds[1] + 1, batch_size):
+            stmt = MovementService._route_update(start_place, end_place)\
+                .where(UnitMovement.id >= low, UnitMovement.id < low + batch_size)
+            if only_missing:
+                stmt = stmt.where(UnitMovement.route.is_(None))
+            updated += db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+            db.session.commit()
+        return updated
+
+    @staticmethod
+    def campaign_paths(unit_ids):
+        """
+        Путь каждого подразделения одной линией: ST_MakeLine по маршрутам
+        в порядке дат (общие точки соседних отрезков схлопываются).
+        Возвращает {unit_id: {'geojson', 'distance_km', 'movements', 'date_from', 'date_to'}}.
+        """
+        unit_ids = list(unit_ids)
+        if not unit_ids:
+            return {}
+
+        path = func.ST_MakeLine(aggregate_order_by(UnitMovement.route, UnitMovement.date, UnitMovement.id))
+        rows = db.session.execute(
+            select(
+                UnitMovement.unit_id,
+                func.ST_AsGeoJSON(path, 5).label('geojson'),
+                func.sum(UnitMovement.distance_km).label('distance_km'),
+                func.count(UnitMovement.id).label('movements'),
+                func.min(UnitMovement.date).label('date_from'),
+                func.max(UnitMovement.date).label('date_to')
+            )
+            .where(UnitMovement.unit_id.in_(unit_ids), UnitMovement.route.isnot(None))
+            .group_by(UnitMovement.unit_id)
+        ).all()
+        return {row.unit_id: row._asdict() for row in rows}
+
+    @staticmethod
+    def unit_movements(unit_id):
+        """
+        Перемещения подразделения с координатами концов маршрута одним
+        запросом (без обращения к Place.latitude/longitude на каждую точку).
+        """
+        start_place = aliased(Place)
+        end_place = aliased(Place)
+        return db.session.execute(
+            select(
+                UnitMovement.id,
+                UnitMovement.date,
+                UnitMovement.distance_km,
+                UnitMovement.route_description,
+                start_place.name.label('start_name'),
+                end_place.name.label('end_name'),
+                func.ST_Y(start_place.geom).label('start_lat'),
+                func.ST_X(start_place.geom).label('start_lon'),
+                func.ST_Y(end_place.geom).label('end_lat'),
+                func.ST_X(end_place.geom).label('end_lon')
+            )
+            .join(start_place, UnitMovement.start_place_id == start_place.id)
+            .join(end_place, UnitMovement.end_place_id == end_place.id)
+            .where(UnitMovement.unit_id == unit_id)
+            .order_by(UnitMovement.date, UnitMovement.id)
+        ).all()
+
+    @staticmethod
+    def nearby_statement(place_id, radius_km, date_from=None, date_to=None):
+        """
+        Подразделения, находившиеся в пределах radius_km от места в интервале дат.
+        Учитываются:
+          - перемещения за интервал, маршрут которых проходит рядом с местом
+            (ST_DWithin по всей линии, т.е. и промежуточные точки пути);
+          - подразделения, стоявшие рядом к началу интервала: последнее
+            перемещение до date_from закончилось рядом с местом.
+        Поиск идёт по geography(route) (функциональный GiST-индекс) и
+        индексам по датам, без загрузки всех перемещений.
+        Строки: unit_id, unit_name, distance_km, date_first, date_last,
+        movement_ids, stationary.
+        """
+        radius_m = radius_km * 1000.0
+        target = select(func.geography(Place.geom).label('geog'))\
+            .where(Place.id == place_id, Place.geom.isnot(None))\
+            .cte('target')
+        route_geog = func.geography(UnitMovement.route)
+
+        passing = select(
+            UnitMovement.unit_id,
+            UnitMovement.id.label('movement_id'),
+            UnitMovement.date,
+            (func.ST_Distance(route_geog, target.c.geog) / 1000.0).label('distance_km'),
+            false().label('stationary')
+        ).join(target, func.ST_DWithin(route_geog, target.c.geog, radius_m))
+        if date_from:
+            passing = passing.where(UnitMovement.date >= date_from)
+        if date_to:
+            passing = passing.where(UnitMovement.date <= date_to)
+        parts = [passing]
+
+        if date_from:
+            # Места рядом с целью -> перемещения, закончившиеся там до начала
+            # интервала, -> только те, после которых до date_from перемещений не было
+            end_place = aliased(Place)
+            later = aliased(UnitMovement)
+            end_geog = func.geography(end_place.geom)
+            stationary = select(
+                UnitMovement.unit_id,
+                UnitMovement.id.label('movement_id'),
+                literal(date_from).label('date'),
+                (func.ST_Distance(end_geog, target.c.geog) / 1000.0).label('distance_km'),
+                true().label('stationary')
+            ).join(end_place, UnitMovement.end_place_id == end_place.id)\
+             .join(target, func.ST_DWithin(end_geog, target.c.geog, radius_m))\
+             .where(
+                UnitMovement.date < date_from,
+                ~select(later.id).where(
+                    later.unit_id == UnitMovement.unit_id,
+                    later.date > UnitMovement.date,
+                    later.date < date_from
+                ).exists()
+            )
+            parts.append(stationary)
+
+        hits = union_all(*parts).subquery('hits')
+        return select(
+            hits.c.unit_id,
+            MilitaryUnit.name.label('unit_name'),
+            func.min(hits.c.distance_km).label('distance_km'),
+            func.min(hits.c.date).label('date_first'),
+            func.max(hits.c.date).label('date_last'),
+            func.array_agg(aggregate_order_by(hits.c.movement_id, hits.c.date)).label('movement_ids'),
+            func.bool_or(hits.c.stationary).label('stationary')
+        ).join(MilitaryUnit, MilitaryUnit.id == hits.c.unit_id)\
+         .group_by(hits.c.unit_id, MilitaryUnit.name)\
+         .order_by(func.min(hits.c.distance_km), MilitaryUnit.name)
+
+    @staticmethod
+    def pack_nearby(rows):
+        return [{
+            'unit_id': row.unit_id,
+            'unit_name': row.unit_name,
+            'distance_km': round(row.distance_km, 2) if row.distance_km is not None else None,
+            'date_first': row.date_first.isoformat() if row.date_first else None,
+            'date_last': row.date_last.isoformat() if row.date_last else None,
+            'movement_ids': list(row.movement_ids or []),
+            'stationary': bool(row.stationary),
+        } for row in rows]
+
+    @staticmethod
+    def nearby(place_id, radius_km, date_from=None, date_to=None):
+        stmt = MovementService.nearby_statement(place_id, radius_km, date_from, date_to)
+        return MovementService.pack_nearby(db.session.execute(stmt).all())
@@ -0,0 +1,138 @@
+import time
+from sqlalchemy import Integer, column, literal, or_, select, true, values
+from app import cache_bus
+from app.metrics import record_cache
+from app.models import Country, MilitaryUnit, UnitHierarchy, db
+from app.services.feed_service import OOB_MAX_DEPTH
+
+# Отрисованные деревья участников: battle_id -> (время, дата сражения, HTML)
+_fragment_cache = {}
+
+
+def _evict(battle_ids):
+    if battle_ids is None:
+        _fragment_cache.clear()
+        return
+    for battle_id in battle_ids:
+        _fragment_cache.pop(battle_id, None)
+
+
+cache_bus.register('battle_oob', _evict)
+
+
+def _parent_on(unit_id, on_date):
+    """Родитель на дату; из нескольких действующих записей — начавшаяся позже всех"""
+    return select(UnitHierarchy.parent_unit_id)\
+        .where(UnitHierarchy.unit_id == unit_id,
+               UnitHierarchy.start_date <= on_date,
+               or_(UnitHierarchy.end_date.is_(None), UnitHierarchy.end_date >= on_date))\
+        .order_by(UnitHierarchy.start_date.desc())\
+        .limit(1).lateral('parent')
+
+
+class OrderOfBattleService:
+    @staticmethod
+    def ancestors_statement(unit_ids, on_date):
+        """
+        Участники и все их вышестоящие соединения на дату одним рекурсивным
+        запросом. Строки: unit_id, parent_id, name, type, country_name.
+        Подъём ограничен OOB_MAX_DEPTH уровнями: цикл в истории подчинения
+        обрывается на нём, повторы строк отбрасывает DISTINCT.
+        """
+        start = values(column('unit_id', Integer), name='participants')\
+            .data([(unit_id,) for unit_id in unit_ids])
+
+        parent = _parent_on(start.c.unit_id, on_date)
+        tree = select(start.c.unit_id, parent.c.parent_unit_id.label('parent_id'), literal(0).label('depth'))\
+            .select_from(start).outerjoin(parent, true())\
+            .cte('oob', recursive=True)
+
+        parent = _parent_on(tree.c.parent_id, on_date)
+        tree = tree.union(
+            select(tree.c.parent_id, parent.c.parent_unit_id, tree.c.depth + 1)
+            .select_from(tree).outerjoin(parent, true())
+            .where(tree.c.parent_id.isnot(None), tree.c.depth < OOB_MAX_DEPTH)
+        )
+
+        return select(
+            tree.c.unit_id,
+            tree.c.parent_id,
+            MilitaryUnit.name,
+            MilitaryUnit.type,
+            Country.name.label('country_name')
+        ).distinct()\
+         .join(MilitaryUnit, MilitaryUnit.id == tree.c.unit_id)\
+         .outerjoin(Country, Country.id == MilitaryUnit.country_id)
+
+    @staticmethod
+    def build_tree(rows, participations):
+        """
+        Один проход по строкам ancestors_statement -> корни деревьев.
+        Узел: {'id', 'name', 'type', 'country_name', 'participations', 'children'};
+        пустой список participations — соединение, не сражавшееся напрямую.
+        Связь с родителем, замыкающая цикл подчинения, отбрасывается: узел
+        становится корнем, и участники цикла не пропадают из дерева.
+        """
+        nodes = {}
+        parents = {}
+        for row in rows:
+            if row.unit_id in nodes:
+                continue
+            nodes[row.unit_id] = {
+                'id': row.unit_id,
+                'name': row.name,
+                'type': row.type,
+                'country_name': row.country_name,
+                'participations': [],
+                'children': [],
+            }
+            parents[row.unit_id] = row.parent_id
+
+        for participation in participations:
+            if participation.unit_id in nodes:
+                nodes[participation.unit_id]['participations'].append(participation)
+
+        # Принятые связи образуют лес: подъём от родителя по ним конечен
+        linked = {}
+        for unit_id in sorted(nodes):
+            ancestor = parents[unit_id] if parents[unit_id] in nodes else None
+            while ancestor is not None and ancestor != unit_id:
+                ancestor = linked.get(ancestor)
+            if ancestor is None and parents[unit_id] in nodes:
+                linked[unit_id] = parents[unit_id]
+
+        roots = []
+        for unit_id, node in nodes.items():
+            parent = nodes.get(linked.get(unit_id))
+            (parent['children'] if parent else roots).append(node)
+
+        for node in nodes.values():
+            node['children'].sort(key=lambda child: child['name'])
+        return sorted(roots, key=lambda root: root['name'])
+
+    @staticmethod
+    def get_tree(participations, on_date):
+        """Дерево участников на дату: один запрос предков для всех подразделений"""
+        unit_ids = sorted({p.unit_id for p in participations if p.unit_id is not None})
+        if not unit_ids:
+            return []
+        rows = db.session.execute(OrderOfBattleService.ancestors_statement(unit_ids, on_date)).all()
+        return OrderOfBattleService.build_tree(rows, participations)
+
+    @staticmethod
+    def cached_fragment(battle_id, on_date, ttl):
+        """HTML дерева из кэша или None (устарел или изменилась дата сражения)"""
+        cached = _fragment_cache.get(battle_id)
+        hit = cached is not None and cached[1] == on_date and time.monotonic() - cached[0] < cache_bus.ttl(ttl)
+        record_cache('battle_oob', hit)
+        return cached[2] if hit else None
+
+    @staticmethod
+    def store_fragment(battle_id, on_date, html):
+        _fragment_cache[battle_id] = (time.monotonic(), on_date, html)
+        return html
+
+    @staticmethod
+    def invalidate(battle_ids=None):
+        """Сбрасывает деревья указанных сражений (без аргументов — все) во всех процессах"""
+        cache_bus.invalidate('battle_oob', battle_ids)
@@ -0,0 +1,84 @@
+from sqlalchemy import delete, insert, literal, select, union_all, update
+from app.models import Battle, Battleparticipations, Commander, MilitaryUnit, db
+
+# Изменяемые колонки участия в сражении
+PARTICIPATION_COLUMNS = ('battle_id', 'unit_id', 'commander_id', 'side')
+
+REFERENCE_MODELS = {
+    'battle': Battle,
+    'commander': Commander,
+    'unit': MilitaryUnit,
+}
+
+
+class ParticipationService:
+    @staticmethod
+    def validate_references(battle_ids=(), commander_ids=(), unit_ids=()):
+        """
+        Проверяет существование сражений, командиров и подразделений одним
+        запросом (UNION ALL). Возвращает словарь вид -> множество найденных id.
+        """
+        requested = {'battle': battle_ids, 'commander': commander_ids, 'unit': unit_ids}
+        found = {kind: set() for kind in requested}
+
+        parts = []
+        for kind, ids in requested.items():
+            ids = {i for i in ids if i is not None}
+            if ids:
+                model = REFERENCE_MODELS[kind]
+                parts.append(select(literal(kind).label('kind'), model.id).where(model.id.in_(ids)))
+        if parts:
+            for kind, ref_id in db.session.execute(union_all(*parts)):
+                found[kind].add(ref_id)
+        return found
+
+    @staticmethod
+    def sync(scope, rows, key, defaults=None):
+        """
+        Приводит участия в границах scope (например, Battleparticipations.battle_id == 5)
+        к списку rows, сравнивая строки по колонке key ('id' или естественный ключ).
+        Естественный ключ может повторяться (подразделение дважды в сражении),
+        поэтому строки сопоставляются как мультимножество: каждая строка rows
+        занимает одну ещё не занятую строку с тем же ключом. Строки без пары
+        вставляются (недостающие колонки берутся из defaults), совпавшие
+        с изменениями обновляются, оставшиеся без пары удаляются. Строки, у
+        которых колонка key пуста (участник без подразделения), форма не
+        показывает — они не удаляются. Каждое действие — один пакетный запрос,
+        поэтому число обращений к БД не зависит от числа участников.
+        Возвращает счётчики {'inserted', 'updated', 'deleted'}.
+        """
+        unmatched = {}
+        for row in db.session.execute(
+            select(Battleparticipations.id, *[getattr(Battleparticipations, c) for c in PARTICIPATION_COLUMNS])
+            .where(scope)
+            .order_by(Battleparticipations.id)
+        ):
+            if getattr(row, key) is not None:
+                unmatched.setdefault(getattr(row, key), []).append(row._asdict())
+
+        inserts, updates = [], []
+        for row in rows:
+            row_key = row.get(key)
+            values = {c: row[c] for c in PARTICIPATION_COLUMNS if c in row}
+
+            candidates = unmatched.get(row_key) if row_key is not None else None
+            if candidates:
+                current = candidates.pop(0)
+                if any(current[c] != v for c, v in values.items()):
+                    # Не переданные формой колонки сохраняют текущие значения
+                    updates.append({**current, **values})
+            elif key == 'id' and row_key is not None:
+                continue  # id не из этого набора или повтор в форме — чужие строки не трогаем
+            else:
+                inserts.append({**dict.fromkeys(PARTICIPATION_COLUMNS), **(defaults or {}), **values})
+
+        deleted_ids = [row['id'] for candidates in unmatched.values() for row in candidates]
+
+        if deleted_ids:
+            db.session.execute(delete(Battleparticipations).where(Battleparticipations.id.in_(deleted_ids)))
+        if updates:
+            db.session.execute(update(Battleparticipations), updates)  # executemany по первичному ключу
+        if inserts:
+            db.session.execute(insert(Battleparticipations), inserts)
+
+        return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deleted_ids)}
@@ -0,0 +1,236 @@
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+from app import cache_bus
+from app.metrics import record_cache
+from app.models import MilitaryUnit, Place, UnitMovement, db
+from app.services.battle_service import EPOCH_ORDINAL
+
+# Скорость марша для оценки длительности перемещения, км в сутки
+MARCH_KM_PER_DAY = 20.0
+
+# Предел числа кадров в одном запросе анимации
+MAX_FRAMES = 1000
+
+# Хронология перемещений всех подразделений: (время построения, PositionTimeline)
+_timeline_cache = {}
+
+# Координаты берутся из places, поэтому правка места тоже сбрасывает хронологию
+cache_bus.register('position_timeline', lambda keys: _timeline_cache.clear(),
+                   tables=('unit_movements', 'places'))
+
+
+def date_to_day(value):
+    """Дата -> номер суток от 1970-01-01 (для исторических дат — отрицательный)"""
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def parse_frames_args(args):
+    """Параметры /units/api/positions/frames: from, to, step (сутки)"""
+    try:
+        date_from = datetime.strptime(args.get('from', ''), '%Y-%m-%d').date()
+        date_to = datetime.strptime(args.get('to', ''), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('Даты from и to обязательны в формате ГГГГ-ММ-ДД')
+    if date_from > date_to:
+        raise ValueError('Дата from позже даты to')
+
+    step = args.get('step') or '1'
+    if not str(step).isdigit() or int(step) < 1:
+        raise ValueError('step — целое число суток не меньше 1')
+    step = int(step)
+
+    if (date_to - date_from).days // step + 1 > MAX_FRAMES:
+        raise ValueError(f'Не больше {MAX_FRAMES} кадров за запрос: увеличьте step или сузьте интервал')
+    return {'date_from': date_from, 'date_to': date_to, 'step': step}
+
+
+class PositionTimeline:
+    """
+    Опорные точки маршрутов всех подразделений в плоских массивах NumPy,
+    отсортированных по (подразделение, время). Положение на любой момент
+    ищется одним searchsorted по составному ключу для всех подразделений
+    сразу, между опорными точками — линейная интерполяция.
+    """
+
+    def __init__(self, unit_ids, unit_names, unit_index, days, lon, lat):
+        self.unit_ids = unit_ids
+        self.unit_names = unit_names
+        self.days = days
+        self.lon = lon
+        self.lat = lat
+
+        # Границы участка каждого подразделения в массивах опорных точек
+        self.starts = np.searchsorted(unit_index, np.arange(len(unit_ids)), side='left')
+        self.ends = np.searchsorted(unit_index, np.arange(len(unit_ids)), side='right')
+
+        # Составной ключ: участки подразделений не пересекаются по значениям
+        self.day_min = days.min() if len(days) else 0.0
+        self.day_max = days.max() if len(days) else 0.0
+        self.span = self.day_max - self.day_min + 2.0
+        self.keys = unit_index * self.span + (days - self.day_min)
+
+        # Версия по содержимому: меняется только при изменении данных
+        digest = hashlib.sha1(np.asarray(unit_ids, dtype=np.int64).tobytes())
+        for array in (unit_index, days, lon, lat):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        self.version = digest.hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.unit_ids)
+
+    def positions(self, days):
+        """
+        Положения всех подразделений на моменты days (сутки от 1970-01-01).
+        Возвращает массивы lon, lat формы (len(days), число подразделений);
+        NaN — подразделение ещё не появилось на карте.
+        """
+        days = np.atleast_1d(np.asarray(days, dtype=np.float64))
+        units = np.arange(len(self.unit_ids))
+        # Запросы за пределами хронологии прижимаются к её краям, чтобы
+        # ключ не попадал в участок соседнего подразделения
+        offsets = np.clip(days, self.day_min - 0.5, self.day_max + 0.5) - self.day_min
+        query = units[np.newaxis, :] * self.span + offsets[:, np.newaxis]
+
+        following = np.searchsorted(self.keys, query, side='right')
+        previous = following - 1
+        present = previous >= self.starts
+        moving = present & (following < self.ends)
+
+        previous = np.clip(previous, 0, None)
+        following = np.where(moving, following, previous)
+
+        elapsed = days[:, np.newaxis] - self.days[previous]
+        duration = self.days[following] - self.days[previous]
+        fraction = np.divide(elapsed, duration, out=np.zeros_like(elapsed), where=duration > 0)
+        fraction = np.clip(fraction, 0.0, 1.0)
+
+        lon = self.lon[previous] + (self.lon[following] - self.lon[previous]) * fraction
+        lat = self.lat[previous] + (self.lat[following] - self.lat[previous]) * fraction
+        lon[~present] = np.nan
+        lat[~present] = np.nan
+        return lon, lat
+
+
+class PositionService:
+    @staticmethod
+    def timeline_statement():
+        """Перемещения с координатами концов в порядке (подразделение, дата)"""
+        start_place = aliased(Place)
+        end_place = aliased(Place)
+        return select(
+            UnitMovement.unit_id,
+            MilitaryUnit.name,
+            UnitMovement.date,
+            UnitMovement.distance_km,
+            func.ST_X(start_place.geom).label('start_lon'),
+            func.ST_Y(start_place.geom).label('start_lat'),
+            func.ST_X(end_place.geom).label('end_lon'),
+            func.ST_Y(end_place.geom).label('end_lat')
+        ).join(MilitaryUnit, MilitaryUnit.id == UnitMovement.unit_id)\
+         .join(start_place, UnitMovement.start_place_id == start_place.id)\
+         .join(end_place, UnitMovement.end_place_id == end_place.id)\
+         .where(start_place.geom.isnot(None), end_place.geom.isnot(None))\
+         .order_by(UnitMovement.unit_id, UnitMovement.date, UnitMovement.id)
+
+    @staticmethod
+    def build_timeline(rows):
+        """
+        Строки timeline_statement -> PositionTimeline.
+        Перемещение с датой D: выход из начального места в D, прибытие через
+        distance_km / MARCH_KM_PER_DAY суток (не меньше одних), но не позже
+        следующего перемещения подразделения. Между перемещениями
+        подразделение стоит на месте, после последнего — остаётся в конечном.
+        """
+        if not rows:
+            empty = np.empty(0)
+            return PositionTimeline([], [], np.empty(0, dtype=np.int64), empty, empty, empty)
+
+        unit_column = np.fromiter((row.unit_id for row in rows), dtype=np.int64, count=len(rows))
+        unit_ids, first_rows, unit_index = np.unique(unit_column, return_index=True, return_inverse=True)
+        unit_names = [rows[i].name for i in first_rows]
+
+        departure = np.fromiter((date_to_day(row.date) for row in rows), dtype=np.float64, count=len(rows))
+        distance = np.fromiter((row.distance_km or 0.0 for row in rows), dtype=np.float64, count=len(rows))
+        coords = np.array([(row.start_lon, row.start_lat, row.end_lon, row.end_lat) for row in rows],
+                          dtype=np.float64)
+
+        # Следующее перемещение того же подразделения ограничивает прибытие
+        next_departure = np.full(len(rows), np.inf)
+        same_unit = unit_index[1:] == unit_index[:-1]
+        next_departure[:-1][same_unit] = departure[1:][same_unit]
+        arrival = np.minimum(departure + np.maximum(distance / MARCH_KM_PER_DAY, 1.0), next_departure)
+
+        # Две опорные точки на перемещение: (выход, начало), (прибытие, конец)
+        return PositionTimeline(
+            unit_ids=unit_ids.tolist(),
+            unit_names=unit_names,
+            unit_index=np.repeat(unit_index, 2),
+            days=np.column_stack([departure, arrival]).ravel(),
+            lon=coords[:, [0, 2]].ravel(),
+            lat=coords[:, [1, 3]].ravel()
+        )
+
+    @staticmethod
+    def get_timeline():
+        """Хронология из кэша; перестраивается раз в POSITION_TIMELINE_TTL секунд"""
+        ttl = current_app.config.get('POSITION_TIMELINE_TTL', 300)
+        cached = _timeline_cache.get('timeline')
+        hit = cached is not None and time.monotonic() - cached[0] < cache_bus.ttl(ttl)
+        record_cache('position_timeline', hit)
+        if hit:
+            return cached[1]
+
+        timeline = PositionService.build_timeline(db.session.execute(PositionService.timeline_statement()).all())
+        _timeline_cache['timeline'] = (time.monotonic(), timeline)
+        return timeline
+
+    @staticmethod
+    def invalidate_timeline():
+        cache_bus.invalidate('position_timeline')
+
+    @staticmethod
+    def _pack_coords(values):
+        return [None if np.isnan(v) else round(float(v), 5) for v in values]
+
+    @staticmethod
+    def positions_on(on_date):
+        """Положения подразделений на дату в колоночном формате (только присутствующие)"""
+        timeline = PositionService.get_timeline()
+        lon, lat = timeline.positions([date_to_day(on_date)])
+        present = np.flatnonzero(~np.isnan(lon[0]))
+        return {
+            'date': on_date.isoformat(),
+            'unit_ids': [timeline.unit_ids[i] for i in present],
+            'names': [timeline.unit_names[i] for i in present],
+            'lon': PositionService._pack_coords(lon[0, present]),
+            'lat': PositionService._pack_coords(lat[0, present]),
+        }
+
+    @staticmethod
+    def frames(date_from, date_to, step=1):
+        """
+        Кадры анимации с date_from по date_to с шагом step суток. Таблица
+        подразделений общая для всех кадров; в кадре lon/lat по порядку
+        этой таблицы, null — подразделения ещё нет.
+        """
+        timeline = PositionService.get_timeline()
+        days = np.arange(date_to_day(date_from), date_to_day(date_to) + 1, step, dtype=np.float64)
+        lon, lat = timeline.positions(days)
+        return {
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat(),
+            'step': step,
+            'unit_ids': timeline.unit_ids,
+            'names': timeline.unit_names,
+            'frames': [{
+                'date': (date_from + timedelta(days=i * step)).isoformat(),
+                'lon': PositionService._pack_coords(lon[i]),
+                'lat': PositionService._pack_coords(lat[i]),
+            } for i in range(len(days))],
+        }
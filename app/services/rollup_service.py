@@ -0,0 +1,197 @@
+import time
+from flask import current_app
+from sqlalchemy import Date, and_, cast, func, literal, or_, select, union, union_all
+from app import cache_bus
+from app.metrics import record_cache
+from app.models import Battle, Battleparticipations, MilitaryUnit, Trophy, UnitHierarchy, db
+from app.services.feed_service import OOB_MAX_DEPTH
+
+# Итоги по соединениям: unit_id -> (время расчёта, данные)
+_rollup_cache = {}
+
+
+def _evict(unit_ids):
+    if unit_ids is None:
+        _rollup_cache.clear()
+        return
+    for unit_id in unit_ids:
+        _rollup_cache.pop(unit_id, None)
+
+
+cache_bus.register('unit_rollup', _evict)
+
+
+def _within(day, valid_from, valid_to):
+    """day в интервале [valid_from, valid_to]; NULL — граница не задана"""
+    return and_(
+        or_(valid_from.is_(None), valid_from <= day),
+        or_(valid_to.is_(None), valid_to >= day)
+    )
+
+
+class RollupService:
+    @staticmethod
+    def subtree_cte(root_id):
+        """
+        Все подчинённые подразделения root_id за всё время с интервалами, в
+        которые они входили в поддерево: (unit_id, valid_from, valid_to).
+        Интервал потомка — пересечение интервала родителя и записи
+        UnitHierarchy (GREATEST/LEAST в PostgreSQL пропускают NULL, поэтому
+        NULL работает как открытая граница). Корень входит всегда.
+        """
+        subtree = select(
+            MilitaryUnit.id.label('unit_id'),
+            cast(None, Date).label('valid_from'),
+            cast(None, Date).label('valid_to'),
+            literal(0).label('depth')
+        ).where(MilitaryUnit.id == root_id).cte('subtree', recursive=True)
+
+        valid_from = func.greatest(subtree.c.valid_from, UnitHierarchy.start_date)
+        valid_to = func.least(subtree.c.valid_to, UnitHierarchy.end_date)
+        return subtree.union_all(
+            select(UnitHierarchy.unit_id, valid_from, valid_to, subtree.c.depth + 1)
+            .join(subtree, UnitHierarchy.parent_unit_id == subtree.c.unit_id)
+            .where(
+                or_(valid_to.is_(None), valid_from <= valid_to),
+                subtree.c.depth < OOB_MAX_DEPTH
+            )
+        )
+
+    @staticmethod
+    def rollup_statement(root_id):
+        """
+        Участия и трофеи подразделений поддерева, которые входили в него на
+        дату начала сражения, одним запросом.
+        Строки: kind ('participation' | 'trophy'), row_id, battle_id,
+        battle_name, date_begin, unit_id, unit_name, quantity.
+        """
+        subtree = RollupService.subtree_cte(root_id)
+
+        participations = select(
+            literal('participation').label('kind'),
+            Battleparticipations.id.label('row_id'),
+            Battle.id.label('battle_id'),
+            Battle.name.label('battle_name'),
+            Battle.date_begin,
+            MilitaryUnit.id.label('unit_id'),
+            MilitaryUnit.name.label('unit_name'),
+            literal(0).label('quantity')
+        ).join(subtree, Battleparticipations.unit_id == subtree.c.unit_id)\
+         .join(Battle, Battle.id == Battleparticipations.battle_id)\
+         .join(MilitaryUnit, MilitaryUnit.id == Battleparticipations.unit_id)\
+         .where(_within(Battle.date_begin, subtree.c.valid_from, subtree.c.valid_to))
+
+        trophies = select(
+            literal('trophy'),
+            Trophy.id,
+            Battle.id,
+            Battle.name,
+            Battle.date_begin,
+            MilitaryUnit.id,
+            MilitaryUnit.name,
+            func.coalesce(Trophy.quantity, 1)
+        ).join(subtree, Trophy.captor_id == subtree.c.unit_id)\
+         .join(Battle, Battle.id == Trophy.battle_id)\
+         .join(MilitaryUnit, MilitaryUnit.id == Trophy.captor_id)\
+         .where(_within(Battle.date_begin, subtree.c.valid_from, subtree.c.valid_to))
+
+        return union_all(participations, trophies)
+
+    @staticmethod
+    def pack_rollup(rows):
+        """
+        Строки rollup_statement -> итоги и список сражений. Подразделение,
+        входившее в поддерево несколькими путями, учитывается один раз.
+        """
+        seen = set()
+        battles = {}
+        units = set()
+        trophies = trophy_quantity = participations = 0
+        for row in rows:
+            if (row.kind, row.row_id) in seen:
+                continue
+            seen.add((row.kind, row.row_id))
+
+            battle = battles.setdefault(row.battle_id, {
+                'battle_id': row.battle_id,
+                'name': row.battle_name,
+                'date_begin': row.date_begin,
+                'units': {},
+                'trophies': 0,
+            })
+            if row.kind == 'participation':
+                participations += 1
+                units.add(row.unit_id)
+                battle['units'][row.unit_id] = row.unit_name
+            else:
+                trophies += 1
+                trophy_quantity += row.quantity
+                battle['trophies'] += row.quantity
+
+        battle_list = sorted(battles.values(), key=lambda b: (b['date_begin'], b['battle_id']))
+        for battle in battle_list:
+            battle['units'] = [{'id': unit_id, 'name': name}
+                               for unit_id, name in sorted(battle['units'].items(), key=lambda u: u[1])]
+        return {
+            'battles_count': len(battle_list),
+            'participations': participations,
+            'units_involved': len(units),
+            'trophies': trophies,
+            'trophy_quantity': trophy_quantity,
+            'battles': battle_list,
+        }
+
+    @staticmethod
+    def get_rollup(unit_id):
+        """Итоги по соединению из кэша; пересчитываются раз в UNIT_ROLLUP_TTL секунд"""
+        ttl = current_app.config.get('UNIT_ROLLUP_TTL', 3600)
+        cached = _rollup_cache.get(unit_id)
+        hit = cached is not None and time.monotonic() - cached[0] < cache_bus.ttl(ttl)
+        record_cache('unit_rollup', hit)
+        if hit:
+            return cached[1]
+
+        rollup = RollupService.pack_rollup(db.session.execute(RollupService.rollup_statement(unit_id)).all())
+        _rollup_cache[unit_id] = (time.monotonic(), rollup)
+        return rollup
+
+    @staticmethod
+    def ancestor_ids(unit_ids):
+        """Подразделения и все их предки за всё время (UNION отсекает циклы)"""
+        unit_ids = [i for i in set(unit_ids) if i is not None]
+        if not unit_ids:
+            return set()
+
+        ancestors = select(MilitaryUnit.id.label('unit_id'))\
+            .where(MilitaryUnit.id.in_(unit_ids))\
+            .cte('ancestors', recursive=True)
+        ancestors = ancestors.union(
+            select(UnitHierarchy.parent_unit_id)
+            .join(ancestors, UnitHierarchy.unit_id == ancestors.c.unit_id)
+        )
+        return set(db.session.scalars(select(ancestors.c.unit_id))) | set(unit_ids)
+
+    @staticmethod
+    def battle_unit_ids(battle_id):
+        """Подразделения, чьи итоги зависят от сражения: участники и взявшие трофеи"""
+        return set(db.session.scalars(union(
+            select(Battleparticipations.unit_id).where(Battleparticipations.battle_id == battle_id),
+            select(Trophy.captor_id).where(Trophy.battle_id == battle_id)
+        )))
+
+    @staticmethod
+    def invalidate(unit_ids):
+        """
+        Сбрасывает итоги только затронутых соединений: самих подразделений
+        и их предков. Вызывать после коммита; для удаления — передавать
+        результат ancestor_ids, полученный до него. Сбрасывается во всех процессах.
+        """
+        cache_bus.invalidate('unit_rollup', unit_ids)
+
+    @staticmethod
+    def invalidate_units(unit_ids):
+        RollupService.invalidate(RollupService.ancestor_ids(unit_ids))
+
+    @staticmethod
+    def invalidate_all():
+        cache_bus.invalidate('unit_rollup')
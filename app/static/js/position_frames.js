@@ -0,0 +1,63 @@
+// Декодер двоичных кадров анимации /units/api/positions/frames.bin
+// (формат — app/services/frame_service.py)
+const PositionFrames = (function() {
+    const HEADER_SIZE = 24;
+    const FLAG_DELTA = 1;
+
+    function parseHeader(buffer) {
+        const view = new DataView(buffer);
+        const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+        if (magic !== 'UPF1') {
+            throw new Error('Неизвестный формат кадров');
+        }
+        const unitCount = view.getUint32(8, true);
+        const namesOffset = HEADER_SIZE + unitCount * 4;
+        const namesLength = view.getUint32(namesOffset, true);
+        const names = new TextDecoder().decode(new Uint8Array(buffer, namesOffset + 4, namesLength));
+        return {
+            delta: (view.getUint16(4, true) & FLAG_DELTA) !== 0,
+            windowFrames: view.getUint16(6, true),
+            unitCount: unitCount,
+            frameCount: view.getUint32(12, true),
+            firstDay: view.getInt32(16, true),
+            step: view.getUint32(20, true),
+            unitIds: Array.from(new Int32Array(buffer.slice(HEADER_SIZE, namesOffset))),
+            names: JSON.parse(names),
+            framesOffset: namesOffset + 4 + namesLength
+        };
+    }
+
+    // Кадр i: Float32Array [lon0, lat0, lon1, lat1, ...]; NaN — подразделения нет.
+    // Дельта-кадры восстанавливаются от первого кадра своего окна
+    // (windowFrames кадров, размер окна берётся из заголовка).
+    function decode(buffer) {
+        const header = parseHeader(buffer);
+        const frameLength = header.unitCount * 2;
+        const frames = [];
+        for (let i = 0; i < header.frameCount; i++) {
+            const frame = new Float32Array(buffer, header.framesOffset + i * frameLength * 4, frameLength);
+            if (header.delta && i % header.windowFrames !== 0) {
+                const previous = frames[i - 1];
+                for (let j = 0; j < frameLength; j++) {
+                    frame[j] += isNaN(previous[j]) ? 0 : previous[j];
+                }
+            }
+            frames.push(frame);
+        }
+        header.frames = frames;
+        header.dateOf = function(i) {
+            return new Date((header.firstDay + i * header.step) * 86400000);
+        };
+        return header;
+    }
+
+    async function load(params) {
+        const response = await fetch('/units/api/positions/frames.bin?' + new URLSearchParams(params));
+        if (!response.ok) {
+            throw new Error((await response.json()).error || response.statusText);
+        }
+        return decode(await response.arrayBuffer());
+    }
+
+    return { decode: decode, load: load };
+})();
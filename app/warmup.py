@@ -0,0 +1,86 @@
+# app/warmup.py
+"""
+Подготовка рабочих процессов сервера (см. gunicorn.conf.py).
+
+В мастер-процессе до fork настраиваются мапперы SQLAlchemy и компилируются
+шаблоны — результат наследуется рабочими процессами. После fork каждый процесс сбрасывает унаследованные
+соединения пула и заполняет свои кэши до первого запроса.
+"""
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+from app import db
+
+# Функции прогрева кэшей: вызываются в контексте приложения в каждом процессе
+_warmers = []
+
+
+def warmer(func):
+    """Регистрирует функцию прогрева кэша"""
+    _warmers.append(func)
+    return func
+
+
+@warmer
+def _prime_pool():
+    # Первое соединение открывается до прихода пользователя
+    db.session.execute(text('SELECT 1'))
+
+
+@warmer
+def _battle_year_histogram():
+    from app.services.battle_service import BattleService
+    BattleService.get_year_histogram()
+
+
+@warmer
+def _position_timeline():
+    from app.services.position_service import PositionService
+    PositionService.get_timeline()
+
+
+def prepare_before_fork(app):
+    """Работа, результат которой рабочие процессы получают через fork"""
+    configure_mappers()
+    return compile_templates(app)
+
+
+def compile_templates(app):
+    """Компилирует все шаблоны Jinja2 в кэш окружения; возвращает их число"""
+    compiled = 0
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except Exception as e:
+            app.logger.warning(f"Шаблон {name} не скомпилирован: {e}")
+    return compiled
+
+
+def reset_after_fork(app):
+    """
+    Сбрасывает ресурсы, унаследованные от мастер-процесса: соединения пула
+    нельзя делить между процессами, фоновые потоки после fork не существуют.
+    Слушатель шины кэшей и запись снимков метрик запускаются в каждом процессе заново.
+    """
+    from app.cache_bus import start_listener
+    from app.metrics import start_flusher
+    from app.services.diagram_service import reset_executor
+    with app.app_context():
+        # close=False: сокеты остаются у родителя, в этом процессе лишь забываются
+        db.engine.dispose(close=False)
+    reset_executor()
+    start_listener(app)
+    start_flusher(app)
+
+
+def warm_caches(app):
+    """Прогрев кэшей текущего процесса; ошибки не мешают запуску"""
+    with app.app_context():
+        for func in _warmers:
+            try:
+                func()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning(f"Прогрев {func.__name__} не выполнен: {e}")
+        db.session.remove()
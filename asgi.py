@@ -0,0 +1,9 @@
+# ASGI-точка входа: асинхронные ленты (/async/...) + Flask-приложение.
+# Запуск: uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 4
+import os
+
+os.environ.setdefault('LOAD_MIGRATIONS', '0')
+
+from app.asgi import create_asgi_app
+
+app = create_asgi_app()
@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 from dotenv import load_dotenv
 
@@ -11,16 +12,126 @@ class Config:
     DB_USER = os.getenv('DB_USER', 'postgres')
     DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres')
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-    UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
+    UPLOAD_FOLDER = os.path.join(BASE_DIR, 'app', 'static', 'uploads')
     ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
 
+    # Обработка схем сражений: ширины миниатюр, форматы вариантов, фоновые потоки
+    DIAGRAM_WIDTHS = (320, 640, 1280, 2048)
+    DIAGRAM_FORMATS = ('avif', 'webp')
+    DIAGRAM_WORKERS = int(os.getenv('DIAGRAM_WORKERS', '2'))
+    # Тайловая пирамида (deep zoom) для крупных сканов
+    DIAGRAM_TILE_MIN_PIXELS = int(os.getenv('DIAGRAM_TILE_MIN_PIXELS', str(4_000_000)))
+    DIAGRAM_TILE_SIZE = 256
+
     # Секретный ключ для Flask
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key')
     
     # Настройки подключения к БД
     SQLALCHEMY_DATABASE_URI = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Подключать Flask-Migrate (команды `flask db`); серверу приложений не нужно
+    LOAD_MIGRATIONS = os.getenv('LOAD_MIGRATIONS', '1') == '1'
+
+    # Пул соединений
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # секунды
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))  # секунды
+    DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', '30000'))  # миллисекунды, 0 — без ограничения
+
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_pre_ping': True,
+        'connect_args': {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'},
+    }
+
+    # Асинхронный API только для чтения (app.asgi): тот же сервер БД через asyncpg
+    ASYNC_DATABASE_URI = os.getenv(
+        'ASYNC_DATABASE_URI',
+        f'postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+    )
+    ASYNC_API_PREFIX = os.getenv('ASYNC_API_PREFIX', '/async')
+
+    # Сервер приложений (gunicorn.conf.py)
+    WEB_BIND = os.getenv('WEB_BIND', '0.0.0.0:8000')
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+    WEB_THREADS = int(os.getenv('WEB_THREADS', '4'))
+    WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', '60'))  # секунды
+    WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))  # секунды
+    WEB_MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', '2000'))  # перезапуск процесса, 0 — никогда
+    WEB_WARMUP = os.getenv('WEB_WARMUP', '1') == '1'
+
+    # Инструментирование запросов к БД
+    SQL_QUERY_BUDGET = int(os.getenv('SQL_QUERY_BUDGET', '50'))  # запросов на HTTP-запрос
+    SQL_TIMING_HEADER = os.getenv('SQL_TIMING_HEADER', '1') == '1'  # заголовок Server-Timing
+
+    # Метрики Prometheus
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+    # Каталог снимков метрик рабочих процессов (см. app/metrics.py); gunicorn.conf.py
+    # задаёт instance/metrics, для uvicorn --workers задать вручную и очищать перед запуском
+    METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))  # секунды
+
+    # Профилирование запросов по требованию
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+    PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+    PROFILING_INTERVAL = float(os.getenv('PROFILING_INTERVAL', '0.005'))  # секунды между сэмплами
+    PROFILING_DIR = os.getenv('PROFILING_DIR')  # по умолчанию instance/profiles
+
+    # Кэш гистограммы сражений по годам для временной шкалы, секунды
+    BATTLE_HISTOGRAM_TTL = int(os.getenv('BATTLE_HISTOGRAM_TTL', '300'))
+    # Начальное окно шкалы на странице сражений: столько лет от первого года
+    BATTLE_WINDOW_INITIAL_YEARS = int(os.getenv('BATTLE_WINDOW_INITIAL_YEARS', '5'))
+
+    # Хронология положений подразделений для анимации кампаний, секунды
+    # (сбрасывается и при изменении перемещений)
+    POSITION_TIMELINE_TTL = int(os.getenv('POSITION_TIMELINE_TTL', '300'))
+    POSITION_FRAMES_DIR = os.getenv('POSITION_FRAMES_DIR')  # по умолчанию instance/position_frames
+
+    # Итоги соединений (сражения и трофеи поддерева), секунды; записи
+    # участий сбрасывают итоги затронутых соединений сразу
+    UNIT_ROLLUP_TTL = int(os.getenv('UNIT_ROLLUP_TTL', '3600'))
+
+    # HTML-дерево участников на странице сражения, секунды
+    BATTLE_OOB_TTL = int(os.getenv('BATTLE_OOB_TTL', '3600'))
+
+    # Шина сброса кэшей между процессами (LISTEN/NOTIFY, см. app/cache_bus.py);
+    # пока слушатель не подключён, кэши живут не дольше CACHE_BUS_FALLBACK_TTL секунд
+    CACHE_BUS_ENABLED = os.getenv('CACHE_BUS_ENABLED', '1') == '1'
+    CACHE_BUS_CHANNEL = os.getenv('CACHE_BUS_CHANNEL', 'cache_invalidation')
+    CACHE_BUS_FALLBACK_TTL = int(os.getenv('CACHE_BUS_FALLBACK_TTL', '30'))
+    CACHE_BUS_RECONNECT = int(os.getenv('CACHE_BUS_RECONNECT', '5'))  # секунды
+
+    # Живые обновления карт сражений и событий: SSE-поток ASGI-приложения
+    # (ASYNC_API_PREFIX/live). Условия работы:
+    #   - сайт запущен через uvicorn asgi:app, либо при gunicorn run:app прокси
+    #     направляет ASYNC_API_PREFIX в uvicorn (тогда LIVE_STREAM_SERVED=1);
+    #     gunicorn без этого пишет предупреждение при запуске, карты не обновляются;
+    #   - установлены триггеры журнала: `flask changes install-triggers` (один раз
+    #     на базу); без них ASGI-приложение предупреждает при запуске.
+    LIVE_UPDATES_ENABLED = os.getenv('LIVE_UPDATES_ENABLED', '1') == '1'
+    # Поток отдаёт ASGI-приложение (uvicorn asgi:app), оно само включает флаг; под
+    # gunicorn run:app включать, только если прокси направляет ASYNC_API_PREFIX в uvicorn
+    LIVE_STREAM_SERVED = os.getenv('LIVE_STREAM_SERVED', '0') == '1'
+    LIVE_DEBOUNCE = float(os.getenv('LIVE_DEBOUNCE', '0.5'))  # секунды накопления уведомлений
+    LIVE_HEARTBEAT = int(os.getenv('LIVE_HEARTBEAT', '15'))  # секунды между пингами
+    LIVE_CLIENT_QUEUE = int(os.getenv('LIVE_CLIENT_QUEUE', '100'))  # сообщений на клиента
+
+    # Черновики мастера добавления сражения старше этого срока удаляются, секунды
+    BATTLE_DRAFT_TTL = int(os.getenv('BATTLE_DRAFT_TTL', str(7 * 24 * 3600)))
 
 class TestConfig(Config):
     TESTING = True
-    DB_NAME = os.getenv('TEST_DB_NAME', 'battles_test_db')
\ No newline at end of file
+    DB_NAME = os.getenv('TEST_DB_NAME', 'battles_test_db')
+    # Адреса БД собираются в Config при определении класса — пересобираем под тестовую базу
+    SQLALCHEMY_DATABASE_URI = os.getenv(
+        'TEST_DATABASE_URL',
+        f'postgresql://{Config.DB_USER}:{Config.DB_PASSWORD}@{Config.DB_HOST}:{Config.DB_PORT}/{DB_NAME}'
+    )
+    ASYNC_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace('postgresql://', 'postgresql+asyncpg://', 1)
+    SQLALCHEMY_ENGINE_OPTIONS = {**Config.SQLALCHEMY_ENGINE_OPTIONS, 'pool_size': 2, 'max_overflow': 0}
+    LOAD_MIGRATIONS = False
+    LIVE_UPDATES_ENABLED = False
\ No newline at end of file
@@ -0,0 +1,102 @@
+# gunicorn.conf.py — запуск в продакшене:
+#     gunicorn -c gunicorn.conf.py run:app
+#
+# Приложение создаётся один раз в мастер-процессе (preload_app) и
+# наследуется рабочими процессами через fork. Число процессов и потоков
+# берётся из Config (WEB_WORKERS, WEB_THREADS и т.д.).
+#
+# Плавный перезапуск: HUP перезапускает рабочие процессы с тем же
+# загруженным кодом; для обновления кода при preload_app — USR2 (новый
+# мастер) и затем QUIT старому мастеру. Текущие запросы дорабатывают
+# в пределах WEB_GRACEFUL_TIMEOUT.
+import logging
+import os
+import time
+
+# Рабочим процессам не нужны команды миграций (alembic) — см. Config.LOAD_MIGRATIONS
+os.environ.setdefault('LOAD_MIGRATIONS', '0')
+# Метрики процессов сводятся через снимки в каталоге (см. app/metrics.py)
+os.environ.setdefault('METRICS_MULTIPROC_DIR',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics'))
+
+from config import Config
+
+_started = time.monotonic()
+log = logging.getLogger('gunicorn.error')
+
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS
+threads = Config.WEB_THREADS
+worker_class = 'gthread'
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = Config.WEB_GRACEFUL_TIMEOUT
+max_requests = Config.WEB_MAX_REQUESTS
+max_requests_jitter = max(Config.WEB_MAX_REQUESTS // 10, 0)
+keepalive = 5
+preload_app = True
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+
+def _flask_app(server):
+    return server.app.wsgi()
+
+
+def on_starting(server):
+    from app.metrics import clear_multiproc_dir
+
+    # Снимки прошлого запуска исказили бы счётчики
+    if Config.METRICS_MULTIPROC_DIR:
+        clear_multiproc_dir(Config.METRICS_MULTIPROC_DIR)
+
+
+def when_ready(server):
+    from app.warmup import prepare_before_fork
+
+    app = _flask_app(server)
+    compiled = prepare_before_fork(app)
+    log.info("Мастер готов за %.0f мс (шаблонов скомпилировано: %d)",
+             (time.monotonic() - _started) * 1000, compiled)
+    if app.config.get('LIVE_UPDATES_ENABLED', True) and not app.config.get('LIVE_STREAM_SERVED'):
+        # SSE-поток есть только в ASGI-приложении (см. Config.LIVE_UPDATES_ENABLED)
+        log.warning("Живые обновления карт не работают: поток обслуживает только uvicorn asgi:app; "
+                    "направьте %s в uvicorn и задайте LIVE_STREAM_SERVED=1 или LIVE_UPDATES_ENABLED=0",
+                    app.config.get('ASYNC_API_PREFIX', '/async'))
+
+
+def post_fork(server, worker):
+    from app.warmup import reset_after_fork
+
+    worker.forked_at = time.monotonic()
+    worker.first_request_logged = False
+    reset_after_fork(_flask_app(server))
+
+
+def post_worker_init(worker):
+    from app.warmup import warm_caches
+
+    app = worker.app.wsgi()
+    if app.config.get('WEB_WARMUP', True):
+        warm_caches(app)
+    log.info("Процесс %s готов за %.0f мс после fork",
+             worker.pid, (time.monotonic() - worker.forked_at) * 1000)
+
+
+def pre_request(worker, req):
+    # Холодный старт: от запуска мастера и от fork до первого запроса процесса
+    if not worker.first_request_logged:
+        worker.first_request_logged = True
+        now = time.monotonic()
+        log.info("Процесс %s: первый запрос %s через %.0f мс после fork (%.0f мс от старта сервера)",
+                 worker.pid, req.path, (now - worker.forked_at) * 1000, (now - _started) * 1000)
+
+
+def child_exit(server, worker):
+    from app.metrics import mark_process_dead
+
+    # Счётчики завершившегося процесса остаются в сводке /metrics
+    if Config.METRICS_MULTIPROC_DIR:
+        mark_process_dead(worker.pid, Config.METRICS_MULTIPROC_DIR)
+
+
+def worker_abort(worker):
+    log.warning("Процесс %s прерван по таймауту (WEB_TIMEOUT=%s)", worker.pid, timeout)
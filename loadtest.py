@@ -0,0 +1,79 @@
+"""
+Нагрузочное сравнение синхронных и асинхронных JSON-лент.
+
+Каждый путь опрашивается CONCURRENCY параллельными клиентами; выводятся
+пропускная способность и перцентили задержки. По умолчанию сравнивается
+одно и то же окно сражений через Flask (/battles/api/window) и через
+асинхронный API (/async/battles/window).
+
+    uvicorn asgi:app --workers 1 --port 8000
+    python loadtest.py --base-url http://localhost:8000 --concurrency 50 --requests 2000
+"""
+import argparse
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PATHS = [
+    '/battles/api/window?from=1805-01-01&to=1815-12-31',
+    '/async/battles/window?from=1805-01-01&to=1815-12-31',
+]
+
+
+def _fetch(url):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def run(base_url, path, concurrency, total):
+    url = base_url.rstrip('/') + path
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(_fetch, [url] * total))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(duration for duration, ok in results if ok)
+    errors = sum(1 for _, ok in results if not ok)
+
+    def percentile(p):
+        if not latencies:
+            return float('nan')
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        'path': path,
+        'rps': total / elapsed,
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'mean': statistics.fmean(latencies) * 1000 if latencies else float('nan'),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS)
+    args = parser.parse_args()
+
+    print(f"{'path':<60} {'rps':>8} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    for path in args.paths:
+        _fetch(args.base_url.rstrip('/') + path)  # прогрев пула соединений
+        r = run(args.base_url, path, args.concurrency, args.requests)
+        print(f"{r['path']:<60} {r['rps']:>8.1f} {r['mean']:>7.1f}ms {r['p50']:>7.1f}ms "
+              f"{r['p95']:>7.1f}ms {r['p99']:>7.1f}ms {r['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
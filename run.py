@@ -8,11 +8,12 @@ sys.path.append(str(Path(__file__).parent))
 # УДАЛИ ЭТУ СТРОКУ:
 # from app import app   ← УДАЛИ ЭТУ СТРОКУ
 
-from app import create_app, db
+from app import create_app
 
 # Создаём приложение через фабричный метод
 app = create_app()
 
+# Сервер разработки. В продакшене: gunicorn -c gunicorn.conf.py run:app
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
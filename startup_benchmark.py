@@ -0,0 +1,100 @@
+"""
+Бенчмарк запуска приложения: время импорта пакета app и create_app().
+
+Каждый прогон — отдельный процесс `python -X importtime`, поэтому кэши
+модулей не влияют на результат. Выводится медиана по прогонам и самые
+дорогие импорты верхнего уровня. С --budget-ms скрипт завершается с
+кодом 1, если медиана превышает бюджет. Та же проверка входит в тесты
+(tests/test_startup.py, бюджет — STARTUP_BUDGET_MS).
+
+    python startup_benchmark.py --runs 5 --budget-ms 600
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+CHILD = """
+import json, sys, time
+sys.path.insert(0, {base_dir!r})
+started = time.perf_counter()
+from app import create_app
+from config import Config
+imported = time.perf_counter()
+
+class BenchConfig(Config):
+    pass
+if {database_uri!r}:
+    BenchConfig.SQLALCHEMY_DATABASE_URI = {database_uri!r}
+    BenchConfig.SQLALCHEMY_ENGINE_OPTIONS = {{}}
+
+create_app(BenchConfig)
+created = time.perf_counter()
+print(json.dumps({{'import_ms': (imported - started) * 1000, 'create_ms': (created - imported) * 1000}}))
+"""
+
+
+def parse_importtime(stderr):
+    """Строки -X importtime -> [(модуль, собственное мкс, накопленное мкс, глубина)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        self_us, cumulative_us, name = int(parts[0]), int(parts[1]), parts[2]
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((name.strip(), self_us, cumulative_us, depth))
+    return rows
+
+
+def run_once(env, database_uri):
+    code = CHILD.format(base_dir=BASE_DIR, database_uri=database_uri)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, env=env, cwd=BASE_DIR)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr[-2000:])
+        raise SystemExit(f'Запуск приложения завершился с кодом {result.returncode}')
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return timings, parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='сколько самых дорогих импортов показать')
+    parser.add_argument('--budget-ms', type=float, help='бюджет медианы import + create_app, мс')
+    parser.add_argument('--database-uri', default='sqlite://',
+                        help='URI БД для create_app; пустая строка — URI из Config')
+    parser.add_argument('--load-migrations', action='store_true', help='запуск с Flask-Migrate (как CLI)')
+    args = parser.parse_args()
+
+    env = dict(os.environ, LOAD_MIGRATIONS='1' if args.load_migrations else '0')
+
+    totals, imports, creates, last_imports = [], [], [], []
+    for _ in range(args.runs):
+        timings, last_imports = run_once(env, args.database_uri)
+        imports.append(timings['import_ms'])
+        creates.append(timings['create_ms'])
+        totals.append(timings['import_ms'] + timings['create_ms'])
+
+    median = statistics.median(totals)
+    print(f'import app:    {statistics.median(imports):8.1f} мс (медиана из {args.runs})')
+    print(f'create_app():  {statistics.median(creates):8.1f} мс')
+    print(f'итого:         {median:8.1f} мс (минимум {min(totals):.1f} мс)')
+
+    print('\nСамые дорогие импорты верхнего уровня (последний прогон):')
+    top_level = sorted((r for r in last_imports if r[3] <= 1), key=lambda r: r[2], reverse=True)
+    for name, _, cumulative_us, _ in top_level[:args.top]:
+        print(f'  {cumulative_us / 1000:8.1f} мс  {name}')
+
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f'\nПревышен бюджет запуска: {median:.1f} мс > {args.budget_ms:.1f} мс')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Общие фикстуры тестов.
+
+Чистые функции (упаковка ответов API, курсоры, кадры) проверяются без базы.
+Тестам маршрутов нужен PostgreSQL с PostGIS: база TEST_DB_NAME
+(battles_test_db) на сервере из DB_HOST/DB_PORT или TEST_DATABASE_URL.
+Если сервер недоступен, такие тесты пропускаются.
+"""
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, db
+from config import TestConfig
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text('CREATE EXTENSION IF NOT EXISTS postgis'))
+        except OperationalError as e:
+            pytest.skip(f'Тестовая база недоступна: {e.orig}')
+        db.drop_all()
+        db.create_all()
+        # Форма подразделения не передаёт type: в рабочей базе колонка допускает NULL
+        db.session.execute(text('ALTER TABLE military_units ALTER COLUMN type DROP NOT NULL'))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def session(app):
+    """Сессия теста; после теста все таблицы очищаются"""
+    yield db.session
+    db.session.rollback()
+    tables = ', '.join(f'"{table.name}"' for table in db.metadata.sorted_tables)
+    db.session.execute(text(f'TRUNCATE {tables} RESTART IDENTITY CASCADE'))
+    db.session.commit()
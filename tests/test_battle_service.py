@@ -0,0 +1,43 @@
+from collections import namedtuple
+from datetime import date
+
+import pytest
+
+from app.services.battle_service import BattleService, date_to_epoch, parse_window_args
+
+Row = namedtuple('Row', 'id name date_begin victory place_name lon lat')
+
+
+def test_date_to_epoch_before_1970():
+    assert date_to_epoch(date(1970, 1, 2)) == 86400
+    assert date_to_epoch(date(1812, 9, 7)) < 0
+    assert date_to_epoch(None) is None
+
+
+def test_pack_window_is_columnar_with_victory_codes():
+    rows = [
+        Row(1, 'Бородино', date(1812, 9, 7), 'Россия', 'Бородино', 35.8212345, 55.5212345),
+        Row(2, 'Тарутино', date(1812, 10, 18), 'Россия', 'Тарутино', None, None),
+        Row(3, 'Малоярославец', date(1812, 10, 24), None, 'Малоярославец', 36.0, 55.0),
+        Row(4, 'Смоленск', date(1812, 8, 16), 'Франция', 'Смоленск', 32.0, 54.8),
+    ]
+
+    data = BattleService.pack_window(rows)
+
+    assert data['count'] == 4
+    assert data['ids'] == [1, 2, 3, 4]
+    assert data['victory_codes'] == ['Россия', 'Франция']
+    assert data['victory'] == [0, 0, None, 1]
+    assert data['lon'][:2] == [35.82123, None]
+    assert data['epoch'][0] == date_to_epoch(date(1812, 9, 7))
+
+
+def test_parse_window_args():
+    window = parse_window_args({'from': '1812-01-01', 'to': '1812-12-31', 'bbox': '30,50,40,60', 'q': ' Бор '})
+    assert window == {'date_from': date(1812, 1, 1), 'date_to': date(1812, 12, 31),
+                      'bbox': [30.0, 50.0, 40.0, 60.0], 'name_query': 'Бор'}
+    assert parse_window_args({}) == {'date_from': None, 'date_to': None, 'bbox': None, 'name_query': None}
+    with pytest.raises(ValueError):
+        parse_window_args({'from': '07.09.1812'})
+    with pytest.raises(ValueError):
+        parse_window_args({'bbox': '30,50,40'})
@@ -0,0 +1,44 @@
+from app.models import Battle, Battleparticipations, Country, MilitaryUnit, Trophy
+from app.routes.battles import _form_indexes
+
+
+def test_form_indexes_sorted_with_gaps():
+    form = {'trophies-3-type': 'a', 'trophies-1-type': 'b', 'trophies-1-description': '',
+            'trophies-x-type': 'c', 'trophies-10-type': 'd', 'participations-0-country_id': '1'}
+    assert _form_indexes(form, 'trophies', 'type') == [1, 3, 10]
+    assert _form_indexes(form, 'participations', 'country_id') == [0]
+
+
+def test_wizard_keeps_rows_with_non_contiguous_indexes(client, session):
+    country = Country(name='Россия')
+    session.add(country)
+    session.flush()
+    units = [MilitaryUnit(name=f'{i}-я армия', type='army', country_id=country.id) for i in (1, 2)]
+    session.add_all(units)
+    session.commit()
+
+    client.post('/battles/new', data={'step': '1', 'name': 'Бородинское сражение',
+                                      'date_begin': '1812-09-07', 'date_end': ''})
+    # Первая строка удалена на клиенте, «Нет участников» сдвинуло нумерацию
+    client.post('/battles/new/step2', data={
+        'step': '2',
+        'participations-1-country_id': str(country.id),
+        'participations-1-unit_id': str(units[0].id),
+        'participations-4-country_id': str(country.id),
+        'participations-4-unit_id': str(units[1].id),
+        'participations-4-side': 'allies',
+    })
+    response = client.post('/battles/new/step3', data={
+        'step': '3',
+        'trophies-1-type': 'Знамя',
+        'trophies-3-type': 'Орудие',
+        'trophies-3-quantity': '2',
+    })
+
+    assert response.status_code == 302
+    battle = Battle.query.filter_by(name='Бородинское сражение').one()
+    participations = Battleparticipations.query.filter_by(battle_id=battle.id)
+    assert sorted((p.unit_id, p.side) for p in participations) == \
+        sorted([(units[0].id, 'other'), (units[1].id, 'allies')])
+    trophies = Trophy.query.filter_by(battle_id=battle.id)
+    assert sorted((t.type, t.quantity) for t in trophies) == [('Знамя', 1), ('Орудие', 2)]
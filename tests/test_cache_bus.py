@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from app import cache_bus
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    """Подменяет реестр кэшей процесса и записывает вызовы сброса"""
+    calls = []
+    monkeypatch.setattr(cache_bus, '_caches', {})
+    cache_bus.register('rollup', lambda keys: calls.append(('rollup', keys)), tables=('military_units',))
+    cache_bus.register('feed', lambda keys: calls.append(('feed', keys)), tables=('events',))
+    return calls
+
+
+def test_payload_keeps_keys_when_short():
+    message = json.loads(cache_bus._payload({'rollup': [1, 2]}, {'units', 'battles'}))
+    assert message['caches'] == {'rollup': [1, 2]}
+    assert message['tables'] == ['battles', 'units']
+    assert message['origin'] == cache_bus._origin()
+
+
+def test_payload_drops_keys_over_limit():
+    payload = cache_bus._payload({'rollup': list(range(5000)), 'feed': None}, set())
+    assert len(payload) <= cache_bus.MAX_PAYLOAD
+    assert json.loads(payload)['caches'] == {'rollup': None, 'feed': None}
+
+
+def test_dispatch_evicts_tables_and_keys(caches):
+    payload = json.dumps({'origin': 'other:1', 'caches': {'rollup': [3], 'missing': [1]},
+                          'tables': ['events']})
+    cache_bus._Listener.dispatch(None, payload, 'self:1')
+    assert caches == [('feed', None), ('rollup', [3])]
+
+
+def test_dispatch_ignores_own_and_broken_messages(caches):
+    cache_bus._Listener.dispatch(None, json.dumps({'origin': 'self:1', 'caches': {'rollup': None}}), 'self:1')
+    cache_bus._Listener.dispatch(None, 'не json', 'self:1')
+    assert caches == []
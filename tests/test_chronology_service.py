@@ -0,0 +1,40 @@
+from datetime import date
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.models import Battle
+from app.pagination import encode_cursor
+from app.services.chronology_service import _after, parse_chronology_args
+
+CURSOR = (date(1812, 9, 7), 'battle', 10)
+
+
+def _sql(clause):
+    return str(clause.compile(dialect=postgresql.dialect()))
+
+
+def test_after_without_cursor_is_true():
+    assert _sql(_after('battle', Battle.date_begin, Battle.id, None)) == 'true'
+
+
+def test_after_depends_on_kind_order():
+    # Вид после курсорного: та же дата ещё не выдана
+    assert _sql(_after('event', Battle.date_begin, Battle.id, CURSOR)).startswith('battles.date_begin >= ')
+    # Вид до курсорного: та же дата уже выдана целиком
+    assert _sql(_after('assignment', Battle.date_begin, Battle.id, CURSOR)).startswith('battles.date_begin > ')
+    # Тот же вид: сравнение пары (дата, id)
+    assert _sql(_after('battle', Battle.date_begin, Battle.id, CURSOR)).startswith(
+        '(battles.date_begin, battles.id) > (')
+
+
+def test_parse_chronology_args():
+    args = parse_chronology_args({'unit': '5', 'limit': '10', 'after': encode_cursor(list(CURSOR))})
+    assert args['unit_id'] == 5 and args['commander_id'] is None
+    assert args['limit'] == 10
+    assert args['after'] == list(CURSOR)
+
+    for bad in ({'unit': 'x'}, {'limit': '0'}, {'after': 'битый'},
+                {'from': '1812-12-31', 'to': '1812-01-01'}):
+        with pytest.raises(ValueError):
+            parse_chronology_args(bad)
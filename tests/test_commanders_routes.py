@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+from app.models import Commander, Country
+from app.routes.commanders import _commander_sort_key
+
+
+def test_sort_key_treats_missing_stats_as_zero():
+    columns, row_values = _commander_sort_key('battles')
+    assert 'coalesce' in str(columns[0]).lower()
+    assert row_values(SimpleNamespace(stats=None, id=4)) == [0, 4]
+    assert row_values(SimpleNamespace(stats=SimpleNamespace(battles_count=3), id=4)) == [3, 4]
+    assert _commander_sort_key('name')[1] is None
+
+
+def test_list_keeps_commanders_without_stats(client, session):
+    country = Country(name='Россия')
+    session.add(country)
+    session.flush()
+    # Создан в обход форм: строки commander_stats нет
+    session.add(Commander(first_name='Пётр', last_name='Багратион', country_id=country.id))
+    session.commit()
+
+    for query in ('sort=battles', 'sort=rank', 'min_battles=0', 'sort=name'):
+        response = client.get(f'/commanders/commanders?{query}')
+        assert response.status_code == 200
+        assert 'Багратион' in response.get_data(as_text=True), query
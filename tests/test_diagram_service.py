@@ -0,0 +1,32 @@
+import pytest
+from flask import Flask
+
+from app.models import BattleDiagram
+from app.services.diagram_service import DiagramService, tile_max_level
+
+
+@pytest.fixture
+def app_context():
+    app = Flask(__name__)
+    app.config['DIAGRAM_TILE_MIN_PIXELS'] = 1_000_000
+    with app.app_context():
+        yield
+
+
+def test_tile_max_level():
+    assert tile_max_level(1, 1) == 0
+    assert tile_max_level(256, 100) == 8
+    assert tile_max_level(257, 100) == 9
+
+
+@pytest.mark.parametrize('variants, tiles, size, expected', [
+    (None, None, (100, 100), True),
+    ('failed', None, (100, 100), True),
+    ('ready', None, (100, 100), False),
+    ('ready', None, (2000, 2000), True),
+    ('ready', 'pending', (2000, 2000), True),
+    ('ready', 'ready', (2000, 2000), False),
+])
+def test_needs_processing(app_context, variants, tiles, size, expected):
+    diagram = BattleDiagram(variants_status=variants, tiles_status=tiles, width=size[0], height=size[1])
+    assert DiagramService.needs_processing(diagram) is expected
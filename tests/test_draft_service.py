@@ -0,0 +1,13 @@
+import pytest
+
+from app.services.draft_service import BattleDraftService
+
+
+def test_patch_rejects_unknown_sections():
+    with pytest.raises(ValueError, match='Неизвестные разделы'):
+        BattleDraftService.patch('draft', battle={}, notes={})
+
+
+def test_patch_rejects_losses_without_country():
+    with pytest.raises(ValueError, match='страну'):
+        BattleDraftService.patch('draft', losses={'country_id': None, 'killed': 120, 'wounded': 0})
@@ -0,0 +1,51 @@
+import json
+import struct
+from datetime import date
+
+import numpy as np
+
+from app.services.frame_service import (HEADER, MAGIC, FLAG_DELTA, WINDOW_FRAMES, FrameService,
+                                        encode_window, window_range)
+from app.services.position_service import PositionTimeline
+
+
+def _timeline():
+    return PositionTimeline(
+        unit_ids=[7, 9], unit_names=['Полк', 'Корпус'],
+        unit_index=np.array([0, 0, 1, 1]), days=np.array([0.0, 2.0, 0.0, 2.0]),
+        lon=np.array([10.0, 12.0, 20.0, 20.0]), lat=np.array([50.0, 50.0, 40.0, 42.0])
+    )
+
+
+def test_window_range_aligned_to_grid():
+    windows = window_range(date(1970, 1, 1), date(1970, 2, 15), step=1)
+    assert list(windows) == [0, 1]
+    assert list(window_range(date(1969, 12, 31), date(1969, 12, 31), step=1)) == [-1]
+
+
+def test_header_carries_window_size():
+    data = FrameService.header(_timeline(), first_day=-32, frame_count=64, step=1, delta=True)
+
+    magic, flags, window_frames, units, frames, first_day, step = HEADER.unpack_from(data)
+    assert (magic, flags & FLAG_DELTA, window_frames) == (MAGIC, FLAG_DELTA, WINDOW_FRAMES)
+    assert (units, frames, first_day, step) == (2, 64, -32, 1)
+
+    offset = HEADER.size
+    assert list(np.frombuffer(data, dtype='<i4', count=2, offset=offset)) == [7, 9]
+    (length,) = struct.unpack_from('<I', data, offset + 8)
+    assert json.loads(data[offset + 12:offset + 12 + length]) == ['Полк', 'Корпус']
+    assert len(data) % 4 == 0
+
+
+def test_encode_window_delta_restores_absolute_frames():
+    lon, lat = _timeline().positions(np.arange(4, dtype=np.float64) - 1)
+    absolute = np.frombuffer(encode_window(lon, lat), dtype='<f4').reshape(4, 2, 2)
+    delta = np.frombuffer(encode_window(lon, lat, delta=True), dtype='<f4').reshape(4, 2, 2).copy()
+
+    # Как в position_frames.js: кадр = дельта + предыдущий (NaN считается нулём)
+    for i in range(1, len(delta)):
+        delta[i] += np.nan_to_num(delta[i - 1], nan=0.0)
+
+    assert np.isnan(absolute[0]).all()
+    np.testing.assert_allclose(delta[1:], absolute[1:])
+    np.testing.assert_allclose(absolute[2], [[11.0, 50.0], [20.0, 41.0]])
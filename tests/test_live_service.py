@@ -0,0 +1,62 @@
+import json
+from collections import namedtuple
+from datetime import date
+
+from flask import Flask
+
+from app.services.live_service import LiveService, live_stream_url, parse_notification
+
+BattleRow = namedtuple('BattleRow', 'id name date_begin victory place_name lon lat')
+EventRow = namedtuple('EventRow', 'id event date place_name lon lat')
+
+
+def test_parse_notification():
+    assert parse_notification('battles:U:12') == ('battles', 12)
+    assert parse_notification('units:U:12') is None
+    assert parse_notification('battles:U:x') is None
+    assert parse_notification('battles:12') is None
+
+
+def test_collect_groups_ids_by_table():
+    changed = LiveService.collect(['battles:U:1', 'battles:D:2', 'places:U:3', 'battles:U:1', 'bad'])
+    assert changed == {'battles': {1, 2}, 'events': set(), 'places': {3}}
+
+
+def test_pack_changes_reports_missing_rows_as_deletes():
+    changed = {'battles': {1, 2}, 'events': {5}, 'places': set()}
+    battle_rows = [BattleRow(1, 'Бородино', date(1812, 9, 7), 'Россия', 'Бородино', 35.8, 55.5)]
+
+    data = LiveService.pack_changes(changed, battle_rows, [])
+
+    assert data['battles']['upserts']['ids'] == [1]
+    assert data['battles']['deletes'] == [2]
+    assert data['events'] == {'upserts': [], 'deletes': [5]}
+
+
+def test_pack_changes_omits_unchanged_tables():
+    changed = {'battles': set(), 'events': {5}, 'places': set()}
+    event_rows = [EventRow(5, 'Пожар Москвы', date(1812, 9, 14), 'Москва', 37.6, 55.75)]
+
+    data = LiveService.pack_changes(changed, [], event_rows)
+
+    assert 'battles' not in data
+    assert [event['id'] for event in data['events']['upserts']] == [5]
+    assert data['events']['deletes'] == []
+
+
+def test_format_event():
+    message = LiveService.format_event('changes', {'a': 'б'})
+    assert message == 'event: changes\ndata: {"a":"б"}\n\n'
+    assert json.loads(message.split('data: ')[1]) == {'a': 'б'}
+    assert LiveService.format_event('reset') == 'event: reset\ndata: {}\n\n'
+
+
+def test_live_stream_url_requires_asgi_app():
+    app = Flask(__name__)
+    app.config.update(LIVE_UPDATES_ENABLED=True, ASYNC_API_PREFIX='/async/')
+    with app.app_context():
+        assert live_stream_url() is None
+        app.config['LIVE_STREAM_SERVED'] = True
+        assert live_stream_url() == '/async/live'
+        app.config['LIVE_UPDATES_ENABLED'] = False
+        assert live_stream_url() is None
@@ -0,0 +1,68 @@
+import json
+import os
+
+from app import metrics
+from app.metrics import Counter, Gauge, Histogram, Registry
+
+
+def _registry():
+    registry = Registry()
+    requests = registry.register(Counter('requests_total', 'Запросы', ('endpoint',)))
+    in_flight = registry.register(Gauge('in_flight', 'В обработке'))
+    latency = registry.register(Histogram('latency_seconds', 'Время', buckets=(0.1, 1.0)))
+    return registry, requests, in_flight, latency
+
+
+def _write(directory, name, data):
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def test_histogram_render_is_cumulative():
+    registry, _, _, latency = _registry()
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    text = registry.render()
+
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'latency_seconds_count 3' in text
+
+
+def test_aggregate_sums_processes_and_skips_dead_gauges(tmp_path):
+    registry, requests, in_flight, latency = _registry()
+    requests.inc('index', amount=2)
+    in_flight.inc()
+    latency.observe(0.5)
+    _write(tmp_path, f'{os.getpid()}.json', registry.snapshot())
+
+    # Процесс 2**22 + 1 не существует (больше pid_max по умолчанию)
+    dead = {'requests_total': [[['index'], 3]], 'in_flight': [[[], 4]],
+            'latency_seconds': [[[], [[1, 0, 0], 0.05]]]}
+    _write(tmp_path, f'{2 ** 22 + 1}.json', dead)
+
+    merged = registry.aggregate(str(tmp_path))
+
+    assert merged['requests_total'] == {('index',): 5}
+    assert merged['in_flight'] == {(): 1}
+    assert merged['latency_seconds'] == {(): [[1, 1, 0], 0.55]}
+
+
+def test_mark_process_dead_moves_counters_to_archive(tmp_path, monkeypatch):
+    registry, requests, in_flight, _ = _registry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    requests.inc('index')
+    in_flight.inc()
+    _write(tmp_path, '100.json', registry.snapshot())
+    _write(tmp_path, '101.json', registry.snapshot())
+
+    metrics.mark_process_dead(100, str(tmp_path))
+    metrics.mark_process_dead(101, str(tmp_path))
+
+    assert sorted(os.listdir(tmp_path)) == [metrics.ARCHIVE_FILE]
+    merged = registry.aggregate(str(tmp_path))
+    assert merged['requests_total'] == {('index',): 2}
+    assert merged['in_flight'] == {}
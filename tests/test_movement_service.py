@@ -0,0 +1,27 @@
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import aliased
+
+from app.models import Place
+from app.services.movement_service import MovementService
+
+
+def _sql(stmt):
+    return str(stmt.compile(dialect=postgresql.dialect()))
+
+
+def test_route_update_clears_routes_without_coordinates():
+    start, end = aliased(Place), aliased(Place)
+    # Заполнение не трогает перемещения без координат
+    backfill = _sql(MovementService._route_update(start, end))
+    assert 'places_1.geom IS NOT NULL AND places_2.geom IS NOT NULL' in backfill.split('WHERE')[1]
+    assert 'CASE' not in backfill
+    # Правка обнуляет маршрут и расстояние, если у конца пути нет координат
+    edit = _sql(MovementService._route_update(start, end, clear_missing=True))
+    assert 'geom IS NOT NULL' not in edit.split('WHERE')[1]
+    assert edit.count('CASE WHEN (places_1.geom IS NOT NULL AND places_2.geom IS NOT NULL)') == 2
+
+
+def test_make_geom_requires_both_coordinates():
+    assert Place.make_geom(None, 37.6) is None
+    assert Place.make_geom(55.7, None) is None
+    assert 'ST_SetSRID(ST_MakePoint(' in _sql(Place.make_geom(55.7, 37.6))
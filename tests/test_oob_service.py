@@ -0,0 +1,48 @@
+from collections import namedtuple
+
+from app.services.oob_service import OrderOfBattleService
+
+Row = namedtuple('Row', 'unit_id parent_id name type country_name')
+Participation = namedtuple('Participation', 'unit_id side')
+
+
+def _names(nodes):
+    return [(node['name'], _names(node['children'])) for node in nodes]
+
+
+def test_build_tree_links_children_and_participations():
+    rows = [
+        Row(3, 1, 'Полк', 'regiment', 'Россия'),
+        Row(2, 1, 'Дивизия', 'division', 'Россия'),
+        Row(1, None, 'Армия', 'army', 'Россия'),
+        Row(3, 1, 'Полк', 'regiment', 'Россия'),
+    ]
+    participations = [Participation(3, 'defender'), Participation(9, 'attacker')]
+
+    roots = OrderOfBattleService.build_tree(rows, participations)
+
+    assert _names(roots) == [('Армия', [('Дивизия', []), ('Полк', [])])]
+    assert roots[0]['participations'] == []
+    assert roots[0]['children'][1]['participations'] == [participations[0]]
+
+
+def test_build_tree_keeps_units_of_a_hierarchy_cycle():
+    # 1 и 2 подчинены друг другу на дату сражения, 3 — подчинён 2
+    rows = [
+        Row(1, 2, 'А', 'corps', None),
+        Row(2, 1, 'Б', 'corps', None),
+        Row(3, 2, 'В', 'division', None),
+    ]
+
+    roots = OrderOfBattleService.build_tree(rows, [])
+
+    assert _names(roots) == [('Б', [('А', []), ('В', [])])]
+
+
+def test_build_tree_unknown_parent_becomes_root():
+    # Предок за пределом OOB_MAX_DEPTH в строки не попал
+    rows = [Row(1, 5, 'Дивизия', 'division', None), Row(2, None, 'Полк', 'regiment', None)]
+
+    roots = OrderOfBattleService.build_tree(rows, [])
+
+    assert _names(roots) == [('Дивизия', []), ('Полк', [])]
@@ -0,0 +1,39 @@
+from datetime import date
+
+from app.models import Commander, Country, UnitMovement
+from app.pagination import decode_cursor, encode_cursor, estimated_count
+
+
+def test_cursor_round_trip():
+    columns = [UnitMovement.date, UnitMovement.id]
+    cursor = encode_cursor([date(1812, 9, 7), 42])
+
+    assert '=' not in cursor
+    assert decode_cursor(cursor, columns) == [date(1812, 9, 7), 42]
+
+
+def test_cursor_keeps_none_and_strings():
+    columns = [Commander.last_name, Commander.id]
+    assert decode_cursor(encode_cursor(['Кутузов', 1]), columns) == ['Кутузов', 1]
+    assert decode_cursor(encode_cursor([None, 1]), columns) == [None, 1]
+
+
+def test_broken_cursor_is_ignored():
+    columns = [Commander.last_name, Commander.id]
+    assert decode_cursor('', columns) is None
+    assert decode_cursor('не-base64!', columns) is None
+    assert decode_cursor(encode_cursor(['Кутузов']), columns) is None
+    assert decode_cursor(encode_cursor([date(1812, 1, 1), 'x']), [UnitMovement.date, UnitMovement.id]) is None
+
+
+def test_estimated_count_keeps_session_and_bind_text(session):
+    country = Country(name='Россия')
+    session.add(country)
+    session.commit()
+    loaded = Country.query.all()
+
+    # ':слово' в поиске — значение параметра, а не имя параметра
+    query = Commander.query.filter(Commander.last_name.ilike('%:слово%'), Commander.id.in_([1, 2]))
+    assert isinstance(estimated_count(query), int)
+    # Сессия запроса не откатывается: загруженные строки не просрочены
+    assert 'name' in loaded[0].__dict__
@@ -0,0 +1,41 @@
+from datetime import date
+
+from app.models import Battle, Battleparticipations, Commander, Country, MilitaryUnit
+from app.services.participation_service import ParticipationService
+
+
+def test_sync_matches_unit_ids_as_multiset(session):
+    country = Country(name='Россия')
+    session.add(country)
+    session.flush()
+    battle = Battle(name='Бородинское сражение', date_begin=date(1812, 9, 7))
+    unit = MilitaryUnit(name='1-я армия', type='army', country_id=country.id)
+    other = MilitaryUnit(name='2-я армия', type='army', country_id=country.id)
+    commander = Commander(first_name='Михаил', last_name='Кутузов', country_id=country.id)
+    session.add_all([battle, unit, other, commander])
+    session.flush()
+    first = Battleparticipations(battle_id=battle.id, unit_id=unit.id, side='allies')
+    second = Battleparticipations(battle_id=battle.id, unit_id=unit.id, side='axis')
+    # Участник без подразделения (только командир) форме правки не виден
+    commander_only = Battleparticipations(battle_id=battle.id, commander_id=commander.id, side='allies')
+    session.add_all([first, second, commander_only])
+    session.commit()
+    ids = first.id, second.id, commander_only.id
+
+    def sync(unit_ids):
+        return ParticipationService.sync(
+            Battleparticipations.battle_id == battle.id,
+            [{'unit_id': unit_id} for unit_id in unit_ids],
+            key='unit_id',
+            defaults={'battle_id': battle.id, 'side': 'other'},
+        )
+
+    assert sync([unit.id, unit.id]) == {'inserted': 0, 'updated': 0, 'deleted': 0}
+    assert sync([unit.id, other.id]) == {'inserted': 1, 'updated': 0, 'deleted': 1}
+    session.commit()
+    session.expire_all()
+
+    rows = Battleparticipations.query.filter_by(battle_id=battle.id).order_by(Battleparticipations.id).all()
+    assert [(row.unit_id, row.side) for row in rows] == \
+        [(unit.id, 'allies'), (None, 'allies'), (other.id, 'other')]
+    assert [row.id for row in rows[:2]] == [ids[0], ids[2]]
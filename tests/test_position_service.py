@@ -0,0 +1,59 @@
+from collections import namedtuple
+from datetime import date
+
+import numpy as np
+import pytest
+
+from app.services.position_service import PositionService, date_to_day, parse_frames_args
+
+Row = namedtuple('Row', 'unit_id name date distance_km start_lon start_lat end_lon end_lat')
+
+
+@pytest.fixture
+def timeline():
+    day = date(1812, 6, 24)
+    return PositionService.build_timeline([
+        # 40 км — двое суток марша, затем стоянка до следующего перемещения
+        Row(1, 'Полк', day, 40.0, 0.0, 0.0, 4.0, 2.0),
+        Row(1, 'Полк', date(1812, 6, 30), 10.0, 4.0, 2.0, 5.0, 2.0),
+        Row(2, 'Корпус', day, None, 10.0, 10.0, 10.0, 11.0),
+    ])
+
+
+def test_build_timeline_units_and_version(timeline):
+    assert timeline.unit_ids == [1, 2]
+    assert timeline.unit_names == ['Полк', 'Корпус']
+    assert len(timeline) == 2
+    assert len(timeline.version) == 16
+
+
+def test_positions_interpolate_and_hold(timeline):
+    start = date_to_day(date(1812, 6, 24))
+    lon, lat = timeline.positions([start - 1, start, start + 1, start + 4, start + 100])
+
+    # До первого перемещения подразделения нет на карте
+    assert np.isnan(lon[0]).all() and np.isnan(lat[0]).all()
+    np.testing.assert_allclose(lon[1], [0.0, 10.0])
+    # Середина марша полка; корпус без расстояния идёт одни сутки
+    np.testing.assert_allclose([lon[2, 0], lat[2, 0]], [2.0, 1.0])
+    np.testing.assert_allclose([lon[2, 1], lat[2, 1]], [10.0, 11.0])
+    # Стоянка между перемещениями и конечная точка после последнего
+    np.testing.assert_allclose(lon[3], [4.0, 10.0])
+    np.testing.assert_allclose(lon[4], [5.0, 10.0])
+
+
+def test_empty_timeline():
+    timeline = PositionService.build_timeline([])
+    lon, lat = timeline.positions([0.0])
+    assert len(timeline) == 0 and lon.shape == (1, 0)
+
+
+def test_parse_frames_args():
+    assert parse_frames_args({'from': '1812-06-24', 'to': '1812-07-01', 'step': '2'}) == {
+        'date_from': date(1812, 6, 24), 'date_to': date(1812, 7, 1), 'step': 2}
+    with pytest.raises(ValueError):
+        parse_frames_args({'from': '1812-07-01', 'to': '1812-06-24'})
+    with pytest.raises(ValueError):
+        parse_frames_args({'from': '1812-06-24', 'to': '1812-07-01', 'step': '0'})
+    with pytest.raises(ValueError):
+        parse_frames_args({'from': '1800-01-01', 'to': '1812-01-01', 'step': '1'})
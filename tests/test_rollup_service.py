@@ -0,0 +1,39 @@
+from collections import namedtuple
+from datetime import date
+
+from app.services.rollup_service import RollupService
+
+Row = namedtuple('Row', 'kind row_id battle_id battle_name date_begin unit_id unit_name quantity')
+
+BORODINO = (1, 'Бородино', date(1812, 9, 7))
+SMOLENSK = (2, 'Смоленск', date(1812, 8, 16))
+
+
+def test_pack_rollup_counts_each_row_once():
+    rows = [
+        Row('participation', 10, *BORODINO, 5, 'Полк', 0),
+        # Тот же участник, пришедший вторым путём по поддереву
+        Row('participation', 10, *BORODINO, 5, 'Полк', 0),
+        Row('participation', 11, *BORODINO, 6, 'Батальон', 0),
+        Row('participation', 12, *SMOLENSK, 5, 'Полк', 0),
+        Row('trophy', 20, *BORODINO, 6, 'Батальон', 3),
+        Row('trophy', 20, *BORODINO, 6, 'Батальон', 3),
+    ]
+
+    rollup = RollupService.pack_rollup(rows)
+
+    assert rollup['battles_count'] == 2
+    assert rollup['participations'] == 3
+    assert rollup['units_involved'] == 2
+    assert (rollup['trophies'], rollup['trophy_quantity']) == (1, 3)
+    # Сражения по дате, подразделения по имени
+    assert [b['name'] for b in rollup['battles']] == ['Смоленск', 'Бородино']
+    assert rollup['battles'][1]['units'] == [{'id': 6, 'name': 'Батальон'}, {'id': 5, 'name': 'Полк'}]
+    assert rollup['battles'][1]['trophies'] == 3
+
+
+def test_pack_rollup_empty():
+    assert RollupService.pack_rollup([]) == {
+        'battles_count': 0, 'participations': 0, 'units_involved': 0,
+        'trophies': 0, 'trophy_quantity': 0, 'battles': [],
+    }
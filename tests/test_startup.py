@@ -0,0 +1,36 @@
+"""
+Регрессия времени запуска: import app + create_app() в отдельных процессах
+(см. startup_benchmark.py). Бюджет медианы — STARTUP_BUDGET_MS (мс),
+0 отключает проверку времени, например на медленной машине.
+"""
+import os
+import statistics
+
+import pytest
+
+from startup_benchmark import run_once
+
+STARTUP_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', '1500'))
+STARTUP_RUNS = 3
+
+# Модули, которые рабочему процессу при запуске не нужны
+DEFERRED_MODULES = ('flask_migrate', 'alembic', 'wsproto', 'flask_wtf', 'wtforms', 'dateutil')
+
+
+@pytest.fixture(scope='module')
+def runs():
+    env = dict(os.environ, LOAD_MIGRATIONS='0')
+    return [run_once(env, 'sqlite://') for _ in range(STARTUP_RUNS)]
+
+
+def test_startup_defers_heavy_imports(runs):
+    _, imports = runs[-1]
+    imported = {name.split('.')[0] for name, _, _, _ in imports}
+    assert imported.isdisjoint(DEFERRED_MODULES), sorted(imported & set(DEFERRED_MODULES))
+
+
+def test_startup_within_budget(runs):
+    if not STARTUP_BUDGET_MS:
+        pytest.skip('STARTUP_BUDGET_MS=0: бюджет запуска не проверяется')
+    median = statistics.median(timings['import_ms'] + timings['create_ms'] for timings, _ in runs)
+    assert median <= STARTUP_BUDGET_MS, f'запуск {median:.0f} мс > бюджета {STARTUP_BUDGET_MS:.0f} мс'
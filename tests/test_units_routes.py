@@ -0,0 +1,80 @@
+from datetime import date
+
+from app.models import (Battle, Battleparticipations, Commander, CommanderAssignment,
+                        Country, MilitaryUnit)
+from app.routes.units import _form_ids, _indexed_form_rows
+
+
+def test_indexed_form_rows_groups_by_index():
+    form = {'battle_id_1': '7', 'side_1': 'a', 'battle_id_0': '5', 'name': 'x', 'side_x': 'b'}
+    assert _indexed_form_rows(form, 'battle_id', 'side') == {
+        0: {'battle_id': '5', 'side': None},
+        1: {'battle_id': '7', 'side': 'a'},
+    }
+
+
+def test_form_ids_skips_empty_and_invalid():
+    form = {'battle_id_0': '5', 'battle_id_1': '', 'battle_id_2': 'abc', 'battle_id_3': '5'}
+    assert _form_ids(form, 'battle_id') == {5}
+
+
+def _references(session):
+    country = Country(name='Россия')
+    session.add(country)
+    session.flush()
+    battles = [Battle(name=f'Сражение {i}', date_begin=date(1812, 8, i + 1)) for i in range(2)]
+    commander = Commander(first_name='Михаил', last_name='Кутузов', country_id=country.id)
+    session.add_all([*battles, commander])
+    session.commit()
+    return country, battles, commander
+
+
+def test_new_unit_creates_participations_and_assignments(client, session):
+    country, battles, commander = _references(session)
+
+    response = client.post('/units/new', data={
+        'name': '1-я армия',
+        'country_id': str(country.id),
+        'commander_id_0': str(commander.id),
+        'start_date_0': '1812-08-01',
+        'battle_id_0': str(battles[0].id),
+        'side_0': 'Обороняющиеся',
+        'battle_id_1': str(battles[1].id),
+        'battle_id_2': '999999',
+    })
+
+    assert response.status_code == 302
+    unit = MilitaryUnit.query.filter_by(name='1-я армия').one()
+    participations = {p.battle_id: p.side for p in Battleparticipations.query.filter_by(unit_id=unit.id)}
+    assert participations == {battles[0].id: 'Обороняющиеся', battles[1].id: 'other'}
+    assignments = CommanderAssignment.query.filter_by(unit_id=unit.id).all()
+    assert [(a.commander_id, a.Com_start) for a in assignments] == [(commander.id, date(1812, 8, 1))]
+
+
+def test_edit_unit_syncs_participations(client, session):
+    country, battles, _ = _references(session)
+    unit = MilitaryUnit(name='2-я армия', type='army', country_id=country.id)
+    session.add(unit)
+    session.flush()
+    kept = Battleparticipations(unit_id=unit.id, battle_id=battles[0].id, side='attacker')
+    removed = Battleparticipations(unit_id=unit.id, battle_id=battles[1].id, side='attacker')
+    session.add_all([kept, removed])
+    session.commit()
+    kept_id, removed_id = kept.id, removed.id
+
+    response = client.post(f'/units/{unit.id}/edit', data={
+        'name': '2-я армия',
+        'country_id': str(country.id),
+        'participation_id_0': str(kept_id),
+        'battle_id_0': str(battles[0].id),
+        'side_0': 'defender',
+        'battle_id_1': str(battles[1].id),
+        'side_1': '',
+    })
+
+    assert response.status_code == 302
+    session.expire_all()
+    rows = {(p.id == kept_id, p.battle_id, p.side)
+            for p in Battleparticipations.query.filter_by(unit_id=unit.id)}
+    assert rows == {(True, battles[0].id, 'defender'), (False, battles[1].id, 'other')}
+    assert session.get(Battleparticipations, removed_id) is None